@@ -2,6 +2,8 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.exc import SQLAlchemyError
 from app.database import Session
 from app.database.models import Admin, Teacher, Student
+from app.main.progress import QuestionMetricsCube
+from app.reports.cache import ReportCache
 
 class AuthService:
     """Serviços relacionados à autenticação e gerenciamento de usuários (Admin, Teacher, Student)."""
@@ -351,8 +353,11 @@ class AuthService:
                 if not student:
                     return False, {"error": "Aluno não encontrado."}
                 
+                class_ids = QuestionMetricsCube.remove_student(session, student.id)
                 session.delete(student)
                 session.commit()
+                for class_id in class_ids:
+                    ReportCache.invalidate_class(class_id)
                 return True, {"msg": "Aluno deletado com sucesso!"}
         except SQLAlchemyError as e:
             session.rollback()
@@ -1,7 +1,9 @@
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from app.database import Session
-from app.database.models import Class, Enrollment, Student
+from app.database.models import Class, Enrollment, Student, QuestionClassMetrics
 from app.auth.services import AuthService
+from app.reports.cache import ReportCache
+from app.main.progress import QuestionMetricsCube
 
 class ClassroomService:
     """Serviço responsável por gerenciar as operações relacionadas às turmas, incluindo CRUD e matrículas."""
@@ -97,8 +99,12 @@ class ClassroomService:
                     classroom.subject = data['subject'].strip()
                 if 'year_semester' in data and data['year_semester'].strip():
                     classroom.year_semester = data['year_semester'].strip()
+                    session.query(QuestionClassMetrics).filter_by(class_id=classroom.id).update(
+                        {"year_semester": classroom.year_semester}, synchronize_session=False
+                    )
                 
                 session.commit()
+                ReportCache.invalidate_class(int(class_id))
                 session.refresh(classroom)
                 session.expunge(classroom)
                 return True, classroom
@@ -120,8 +126,10 @@ class ClassroomService:
                 if not classroom:
                     return False, {"error": "Turma não encontrada."}
                 
+                session.query(QuestionClassMetrics).filter_by(class_id=classroom.id).delete(synchronize_session=False)
                 session.delete(classroom)
                 session.commit()
+                ReportCache.invalidate_class(int(class_id))
                 return True, {"msg": "Turma deletada com sucesso."}
         except SQLAlchemyError as e:
             session.rollback()
@@ -147,7 +155,9 @@ class ClassroomService:
                     
                 enrollment = Enrollment(class_id=class_id, student_id=student_id)
                 session.add(enrollment)
+                QuestionMetricsCube.add_students(session, int(class_id), [int(student_id)])
                 session.commit()
+                ReportCache.invalidate_class(int(class_id))
                 session.refresh(enrollment)
                 session.expunge(enrollment)
                 return True, enrollment
@@ -173,7 +183,9 @@ class ClassroomService:
                     return False, {"error": "Matrícula não encontrada."}
                 
                 session.delete(enrollment)
+                QuestionMetricsCube.add_students(session, int(class_id), [int(student_id)], sign=-1)
                 session.commit()
+                ReportCache.invalidate_class(int(class_id))
                 return True, {"msg": "Matrícula cancelada com sucesso."}
         except SQLAlchemyError as e:
             session.rollback()
@@ -268,7 +280,9 @@ class ClassroomService:
                 if not existing:
                     enrollment = Enrollment(class_id=class_id, student_id=student_id)
                     session.add(enrollment)
+                    QuestionMetricsCube.add_students(session, int(class_id), [student_id])
                     session.commit()
+                    ReportCache.invalidate_class(int(class_id))
             return True, {"msg": "Aluno matriculado com sucesso."}
         except SQLAlchemyError as e:
             return False, {"error": f"Erro de banco ao matricular: {str(e)}"}
@@ -299,13 +313,17 @@ class ClassroomService:
                 student_ids_to_enroll.append(student_id)
             
             with Session() as session:
+                enrolled_ids = []
                 for student_id in student_ids_to_enroll:
                     existing = session.query(Enrollment).filter_by(class_id=class_id, student_id=student_id).first()
                     if not existing:
                         enrollment = Enrollment(class_id=class_id, student_id=student_id)
                         session.add(enrollment)
+                        enrolled_ids.append(student_id)
                 
+                QuestionMetricsCube.add_students(session, int(class_id), enrolled_ids)
                 session.commit()
+            ReportCache.invalidate_class(int(class_id))
             return True, "Alunos matriculados com sucesso."
             
         except SQLAlchemyError as e:
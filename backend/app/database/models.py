@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, TIMESTAMP, text, ForeignKey, Text, Boolean, CheckConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, TIMESTAMP, text, ForeignKey, Text, Boolean, CheckConstraint, UniqueConstraint, Index
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -60,10 +60,13 @@ class Question(Base):
     expected_query = Column(Text, nullable=False)
     question_number = Column(Integer, nullable=False)
     is_special = Column(Boolean, default=False)
+    statement_timeout_ms = Column(Integer, nullable=True)
+    answer_key_version = Column(Integer, nullable=False, default=1, server_default=text('1'))
     created_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
 
 class Submission(Base):
     __tablename__ = 'submissions'
+    __table_args__ = (Index('idx_submissions_student_question', 'student_id', 'question_id'),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     student_id = Column(Integer, ForeignKey('students.id', ondelete='CASCADE'), nullable=False)
     question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), nullable=False)
@@ -71,4 +74,61 @@ class Submission(Base):
     submitted_query = Column(Text, nullable=False)
     is_correct = Column(Boolean, nullable=False, default=False)
     execution_output = Column(Text, nullable=True)
-    submitted_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
\ No newline at end of file
+    answer_key_version = Column(Integer, nullable=True)
+    submitted_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+
+class StudentQuestionProgress(Base):
+    __tablename__ = 'student_question_progress'
+    student_id = Column(Integer, ForeignKey('students.id', ondelete='CASCADE'), primary_key=True)
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    correct_attempts = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    total_time_seconds = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    skipped = Column(Boolean, nullable=False, default=False, server_default=text('0'))
+    first_correct_submission_id = Column(Integer, nullable=True)
+    first_correct_at = Column(TIMESTAMP, nullable=True)
+    first_correct_time_spent_seconds = Column(Integer, nullable=True)
+    last_correct_submission_id = Column(Integer, nullable=True)
+    updated_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+
+class QuestionClassMetrics(Base):
+    __tablename__ = 'question_class_metrics'
+    __table_args__ = (
+        Index('idx_question_class_metrics_question', 'question_id'),
+        Index('idx_question_class_metrics_semester', 'year_semester', 'question_id'),
+    )
+    class_id = Column(Integer, ForeignKey('classes.id', ondelete='CASCADE'), primary_key=True)
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True)
+    year_semester = Column(String(20), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    correct_attempts = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    total_time_seconds = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    students_attempted = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    students_correct = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    updated_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+
+class AnswerKeyVersion(Base):
+    __tablename__ = 'answer_key_versions'
+    __table_args__ = (UniqueConstraint('question_id', 'version'),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), nullable=False)
+    version = Column(Integer, nullable=False)
+    expected_query = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+
+class AnswerKeyFingerprint(Base):
+    __tablename__ = 'answer_key_fingerprints'
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True)
+    expected_query_hash = Column(String(64), nullable=False)
+    row_count = Column(Integer, nullable=False)
+    columns = Column(Text, nullable=False)
+    order_sensitive = Column(Boolean, nullable=False, default=False)
+    row_digests = Column(Text(16777215), nullable=True)
+    result_digest = Column(String(64), nullable=False)
+    computed_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+
+class ReportCacheTag(Base):
+    __tablename__ = 'report_cache_tags'
+    tag = Column(String(64), primary_key=True)
+    generation = Column(BigInteger, nullable=False, default=0, server_default=text('0'))
+    updated_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
@@ -1,5 +1,13 @@
 from app.main.routes import bp
+from app.main.commands import self_test_command, backfill_progress_command
+from app.main.writebehind import SubmissionWriteBehind
 
 def init_app(app):
-    """Inicializa o módulo principal, registrando as rotas e preparando o serviço."""
-    app.register_blueprint(bp)
\ No newline at end of file
+    """Inicializa o módulo principal, registrando as rotas, os comandos de linha de comando e preparando o serviço."""
+    app.register_blueprint(bp)
+    app.cli.add_command(self_test_command)
+    app.cli.add_command(backfill_progress_command)
+    if SubmissionWriteBehind.ENABLED:
+        # Iniciada na primeira requisição, e não aqui: comandos de linha de comando também criam o app e não devem
+        # abrir um spill nem reenviar os spills de outros processos.
+        app.before_request(SubmissionWriteBehind.ensure_started)
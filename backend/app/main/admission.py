@@ -0,0 +1,194 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+class ScenarioAdmission:
+    """
+    Controle de admissão de um cenário: limita as correções simultâneas e enfileira as excedentes numa fila justa
+    por chave (aluno), atendida em rodízio, de modo que um aluno com várias requisições não passe na frente dos demais.
+    Quando a fila excede o orçamento, ou a espera estoura o limite, a requisição é recusada com uma sugestão de retry-after.
+    Trabalho de segundo plano (ex.: recorreção) usa a faixa de baixa prioridade: ocupa no máximo max_low_priority vagas,
+    só entra quando não há alunos na fila e, ao liberar uma vaga, os alunos em espera são sempre atendidos primeiro.
+    """
+
+    def __init__(self, max_concurrent, max_queue, max_wait, max_low_priority=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_low_priority = max_low_priority if max_low_priority is not None else max(1, max_concurrent // 2)
+        self.active = 0
+        self.active_low_priority = 0
+        self.queued = 0
+        self._queues = OrderedDict()
+        self._low_priority_queue = deque()
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._avg_service = 0.5
+
+    def acquire(self, key, low_priority=False):
+        """Tenta obter uma vaga. Retorna (admitido, espera em segundos ou retry_after sugerido)."""
+        started = time.monotonic()
+        with self._lock:
+            if low_priority and self._low_priority_free() and not self._low_priority_queue:
+                self.active += 1
+                self.active_low_priority += 1
+                self._record_admission(0.0)
+                return True, 0.0
+            if not low_priority and self.active < self.max_concurrent and self.queued == 0:
+                self.active += 1
+                self._record_admission(0.0)
+                return True, 0.0
+            if self.queued + len(self._low_priority_queue) >= self.max_queue:
+                self._rejected += 1
+                return False, self._retry_after()
+
+            waiter = {"event": threading.Event(), "granted": False}
+            if low_priority:
+                self._low_priority_queue.append(waiter)
+            else:
+                self._queues.setdefault(key, deque()).append(waiter)
+                self.queued += 1
+
+        waiter["event"].wait(self.max_wait)
+        waited = time.monotonic() - started
+        with self._lock:
+            if not waiter["granted"]:
+                if low_priority:
+                    self._low_priority_queue.remove(waiter)
+                else:
+                    queue = self._queues.get(key)
+                    if queue is not None:
+                        queue.remove(waiter)
+                        if not queue:
+                            del self._queues[key]
+                    self.queued -= 1
+                self._timed_out += 1
+                return False, self._retry_after()
+            self._record_admission(waited)
+            return True, waited
+
+    def release(self, service_seconds=None, low_priority=False):
+        """Libera a vaga e entrega-a ao próximo da fila, em rodízio entre as chaves; a faixa de baixa prioridade vem por último."""
+        with self._lock:
+            self.active -= 1
+            if low_priority:
+                self.active_low_priority -= 1
+            if service_seconds is not None:
+                self._avg_service = 0.8 * self._avg_service + 0.2 * service_seconds
+            while self.active < self.max_concurrent and self._queues:
+                key, queue = next(iter(self._queues.items()))
+                waiter = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(key)
+                else:
+                    del self._queues[key]
+                self.queued -= 1
+                self.active += 1
+                waiter["granted"] = True
+                waiter["event"].set()
+            while self._low_priority_queue and self._low_priority_free():
+                waiter = self._low_priority_queue.popleft()
+                self.active += 1
+                self.active_low_priority += 1
+                waiter["granted"] = True
+                waiter["event"].set()
+
+    def snapshot(self):
+        """Retorna as métricas do cenário: profundidade da fila, vagas em uso e tempos de espera."""
+        with self._lock:
+            return {
+                "active": self.active,
+                "queue_depth": self.queued,
+                "queued_keys": len(self._queues),
+                "active_low_priority": self.active_low_priority,
+                "low_priority_queue_depth": len(self._low_priority_queue),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "avg_wait_seconds": round(self._total_wait / self._admitted, 4) if self._admitted else 0.0,
+                "max_wait_seconds": round(self._max_wait_seen, 4),
+                "avg_service_seconds": round(self._avg_service, 4)
+            }
+
+    def _low_priority_free(self):
+        """Indica se a faixa de baixa prioridade pode ocupar uma vaga agora (chamado com o lock adquirido)."""
+        return (
+            self.queued == 0
+            and self.active < self.max_concurrent
+            and self.active_low_priority < self.max_low_priority
+        )
+
+    def _record_admission(self, waited):
+        """Contabiliza uma admissão (chamado com o lock adquirido)."""
+        self._admitted += 1
+        self._total_wait += waited
+        self._max_wait_seen = max(self._max_wait_seen, waited)
+
+    def _retry_after(self):
+        """Estima em quantos segundos a fila atual deve andar (chamado com o lock adquirido)."""
+        return max(1, math.ceil((self.queued + 1) / self.max_concurrent * self._avg_service))
+
+class AdmissionRegistry:
+    """Mantém um controle de admissão por cenário (slug), para que o pico de um cenário não esgote os demais."""
+
+    MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT_PER_SCENARIO', 8))
+    MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE_PER_SCENARIO', 64))
+    MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', 10))
+    MAX_LOW_PRIORITY = int(os.getenv('ADMISSION_MAX_LOW_PRIORITY_PER_SCENARIO', max(1, MAX_CONCURRENT // 2)))
+
+    _lock = threading.Lock()
+    _scenarios = {}
+
+    @staticmethod
+    def get(slug):
+        """Retorna o controle de admissão do cenário, criando-o se necessário."""
+        admission = AdmissionRegistry._scenarios.get(slug)
+        if admission is None:
+            with AdmissionRegistry._lock:
+                admission = AdmissionRegistry._scenarios.setdefault(
+                    slug,
+                    ScenarioAdmission(
+                        AdmissionRegistry.MAX_CONCURRENT, AdmissionRegistry.MAX_QUEUE,
+                        AdmissionRegistry.MAX_WAIT_SECONDS, AdmissionRegistry.MAX_LOW_PRIORITY
+                    )
+                )
+        return admission
+
+    @staticmethod
+    def key(role, user_id):
+        """
+        Chave da fila justa de um usuário. Inclui o papel porque os ids de alunos, professores e administradores
+        vêm de tabelas diferentes e podem coincidir; todas as rotas de correção devem usar esta mesma chave.
+        """
+        return f"{role}:{user_id}"
+
+    @staticmethod
+    def run(slug, key, func, low_priority=False):
+        """
+        Executa func() dentro de uma vaga do cenário, aguardando na fila da chave se necessário.
+        Com low_priority, usa a faixa de segundo plano, que cede as vagas aos alunos.
+        Retorna (True, resultado de func) ou (False, retry_after em segundos) quando a requisição é recusada.
+        """
+        admission = AdmissionRegistry.get(slug)
+        admitted, retry_after = admission.acquire(key, low_priority=low_priority)
+        if not admitted:
+            return False, retry_after
+
+        started = time.monotonic()
+        try:
+            return True, func()
+        finally:
+            admission.release(time.monotonic() - started, low_priority=low_priority)
+
+    @staticmethod
+    def stats():
+        """Retorna as métricas de todos os cenários."""
+        return {slug: admission.snapshot() for slug, admission in list(AdmissionRegistry._scenarios.items())}
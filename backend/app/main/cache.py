@@ -0,0 +1,228 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Cache LRU limitado por tamanho e por tempo de vida (TTL), seguro para uso entre threads, com estatísticas de uso."""
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        """Retorna o valor armazenado para a chave ou None se ausente/expirado."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            expires_at, value = entry
+            if self.ttl and expires_at < time.monotonic():
+                del self._data[key]
+                self._misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value):
+        """Armazena o valor para a chave, descartando as entradas menos usadas quando o limite é atingido."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Remove as entradas cujas chaves satisfazem o predicado (ou todas, se nenhum for informado)."""
+        with self._lock:
+            keys = [k for k in self._data if predicate is None or predicate(k)]
+            for k in keys:
+                del self._data[k]
+            self._invalidations += len(keys)
+            return len(keys)
+
+    def stats(self):
+        """Retorna as estatísticas de uso do cache."""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate_percentage": round(self._hits / total * 100, 2) if total > 0 else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations
+            }
+
+def sql_hash(sql):
+    """Gera o hash estável de uma query SQL para compor chaves de cache."""
+    return hashlib.sha256(sql.strip().encode('utf-8')).hexdigest()
+
+class ExpectedResultCache:
+    """
+    Cache dos resultados das queries esperadas (gabaritos), chaveado por (slug, question_id, hash da expected_query).
+    Evita reexecutar o gabarito no banco do cenário a cada submissão de aluno.
+    """
+
+    _cache = TTLCache(
+        maxsize=int(os.getenv('EXPECTED_CACHE_MAXSIZE', 512)),
+        ttl=int(os.getenv('EXPECTED_CACHE_TTL_SECONDS', 600))
+    )
+
+    @staticmethod
+    def key(slug, question_id, expected_query):
+        """Monta a chave de cache de um gabarito."""
+        return (slug, int(question_id), sql_hash(expected_query))
+
+    @staticmethod
+    def get(slug, question_id, expected_query):
+        """Retorna o resultado em cache do gabarito ou None."""
+        return ExpectedResultCache._cache.get(ExpectedResultCache.key(slug, question_id, expected_query))
+
+    @staticmethod
+    def set(slug, question_id, expected_query, result):
+        """Armazena o resultado de execução do gabarito."""
+        ExpectedResultCache._cache.set(ExpectedResultCache.key(slug, question_id, expected_query), result)
+
+    @staticmethod
+    def invalidate_question(question_id):
+        """Remove do cache todos os resultados de uma questão."""
+        return ExpectedResultCache._cache.invalidate(lambda k: k[1] == int(question_id))
+
+    @staticmethod
+    def invalidate_scenario(slug):
+        """Remove do cache todos os resultados de um cenário."""
+        return ExpectedResultCache._cache.invalidate(lambda k: k[0] == slug)
+
+    @staticmethod
+    def stats():
+        """Retorna as estatísticas de acerto/falha do cache de gabaritos."""
+        return ExpectedResultCache._cache.stats()
+
+class QueryResultCache:
+    """
+    Cache compartilhado entre alunos dos resultados de execução, chaveado por (slug, SQL canônica).
+    Só guarda execuções bem-sucedidas e de até MAX_ROWS linhas.
+    """
+
+    MAX_ROWS = int(os.getenv('QUERY_CACHE_MAX_ROWS', 1000))
+
+    _cache = TTLCache(
+        maxsize=int(os.getenv('QUERY_CACHE_MAXSIZE', 2048)),
+        ttl=int(os.getenv('QUERY_CACHE_TTL_SECONDS', 300))
+    )
+
+    @staticmethod
+    def get(slug, canonical_sql):
+        """Retorna o resultado em cache da query canônica no cenário, ou None."""
+        return QueryResultCache._cache.get((slug, canonical_sql))
+
+    @staticmethod
+    def set(slug, canonical_sql, result):
+        """Armazena o resultado, desde que seja um sucesso e não ultrapasse o limite de linhas."""
+        data = result.get('data')
+        if result.get('error') or not data or len(data['rows']) > QueryResultCache.MAX_ROWS:
+            return
+        QueryResultCache._cache.set((slug, canonical_sql), result)
+
+    @staticmethod
+    def invalidate_scenario(slug):
+        """Remove os resultados de um cenário."""
+        return QueryResultCache._cache.invalidate(lambda k: k[0] == slug)
+
+    @staticmethod
+    def stats():
+        """Retorna as estatísticas do cache de execuções."""
+        return QueryResultCache._cache.stats()
+
+class VerdictCache:
+    """Cache dos vereditos de correção, chaveado por (slug, question_id, hash do gabarito, SQL canônica)."""
+
+    _cache = TTLCache(
+        maxsize=int(os.getenv('VERDICT_CACHE_MAXSIZE', 4096)),
+        ttl=int(os.getenv('VERDICT_CACHE_TTL_SECONDS', 600))
+    )
+
+    @staticmethod
+    def key(slug, question_id, expected_query, canonical_sql):
+        """Monta a chave de cache de um veredito."""
+        return (slug, int(question_id), sql_hash(expected_query), canonical_sql)
+
+    @staticmethod
+    def get(slug, question_id, expected_query, canonical_sql):
+        """Retorna o veredito (válido, mensagem) em cache, ou None."""
+        return VerdictCache._cache.get(VerdictCache.key(slug, question_id, expected_query, canonical_sql))
+
+    @staticmethod
+    def set(slug, question_id, expected_query, canonical_sql, verdict):
+        """Armazena o veredito (válido, mensagem)."""
+        VerdictCache._cache.set(VerdictCache.key(slug, question_id, expected_query, canonical_sql), verdict)
+
+    @staticmethod
+    def invalidate_question(question_id):
+        """Remove os vereditos de uma questão."""
+        return VerdictCache._cache.invalidate(lambda k: k[1] == int(question_id))
+
+    @staticmethod
+    def invalidate_scenario(slug):
+        """Remove os vereditos de um cenário."""
+        return VerdictCache._cache.invalidate(lambda k: k[0] == slug)
+
+    @staticmethod
+    def stats():
+        """Retorna as estatísticas do cache de vereditos."""
+        return VerdictCache._cache.stats()
+
+class CostEstimateCache:
+    """Cache das estimativas de custo do EXPLAIN usadas pela guarda de custo, chaveado por (slug, SQL canônica)."""
+
+    _cache = TTLCache(
+        maxsize=int(os.getenv('COST_ESTIMATE_CACHE_MAXSIZE', 4096)),
+        ttl=int(os.getenv('COST_ESTIMATE_CACHE_TTL_SECONDS', 600))
+    )
+
+    @staticmethod
+    def get(slug, canonical_sql):
+        """Retorna a estimativa em cache da query canônica no cenário, ou None."""
+        return CostEstimateCache._cache.get((slug, canonical_sql))
+
+    @staticmethod
+    def set(slug, canonical_sql, estimate):
+        """Armazena a estimativa {'total_cost', 'plan_rows'} da query canônica."""
+        CostEstimateCache._cache.set((slug, canonical_sql), estimate)
+
+    @staticmethod
+    def invalidate_scenario(slug):
+        """Remove as estimativas de um cenário."""
+        return CostEstimateCache._cache.invalidate(lambda k: k[0] == slug)
+
+    @staticmethod
+    def stats():
+        """Retorna as estatísticas do cache de estimativas de custo."""
+        return CostEstimateCache._cache.stats()
+
+def invalidate_question_caches(question_id):
+    """Invalida todos os caches que dependem do gabarito de uma questão."""
+    ExpectedResultCache.invalidate_question(question_id)
+    VerdictCache.invalidate_question(question_id)
+
+def invalidate_scenario_caches(slug):
+    """Invalida todos os caches que dependem dos dados de um cenário."""
+    ExpectedResultCache.invalidate_scenario(slug)
+    QueryResultCache.invalidate_scenario(slug)
+    VerdictCache.invalidate_scenario(slug)
+    CostEstimateCache.invalidate_scenario(slug)
@@ -0,0 +1,26 @@
+import json
+import click
+from app.main.services import AnswerKeyService
+from app.main.progress import ProgressRollup
+
+@click.command('self-test')
+@click.argument('slug')
+@click.option('--workers', type=int, default=None, help='Número máximo de gabaritos executados em paralelo.')
+def self_test_command(slug, workers):
+    """Executa todos os gabaritos do cenário SLUG e atualiza as suas impressões digitais."""
+    success, result = AnswerKeyService.self_test(slug, max_workers=workers)
+    if not success:
+        raise click.ClickException(result)
+
+    click.echo(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+    if result['failed']:
+        raise SystemExit(1)
+
+@click.command('backfill-progress')
+@click.option('--question-id', type=int, default=None, help='Reconstrói apenas o progresso desta questão.')
+def backfill_progress_command(question_id):
+    """Reconstrói as tabelas student_question_progress e question_class_metrics a partir do histórico de submissões."""
+    success, result = ProgressRollup.backfill(question_id)
+    if not success:
+        raise click.ClickException(result)
+    click.echo(json.dumps(result, indent=2, ensure_ascii=False))
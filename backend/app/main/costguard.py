@@ -0,0 +1,167 @@
+import os
+from app.main.cache import CostEstimateCache
+from app.main.sqltext import tokenize_sql, WHITESPACE, COMMENT, WORD
+
+_CLAUSE_KEYWORDS = frozenset(('GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'FETCH', 'WINDOW', 'UNION', 'EXCEPT', 'INTERSECT'))
+
+class QueryCostGuard:
+    """
+    Etapa de proteção entre a checagem de segurança e a execução das consultas dos alunos.
+    Estima o custo pelo EXPLAIN do banco do cenário quando o backend oferece (rpc_explain) e, caso contrário,
+    por uma heurística sobre o número de junções e junções sem predicado (produto cartesiano).
+    O resultado é 'allow', 'downgrade' (executa com timeout e teto de linhas reduzidos) ou 'reject'; a heurística
+    nunca rejeita, pois produtos cartesianos são respostas legítimas em exercícios de SQL: ela só rebaixa e avisa.
+    As estimativas do EXPLAIN ficam em cache por (cenário, SQL canônica), e cada chamada ao rpc_explain é limitada a
+    EXPLAIN_TIMEOUT_SECONDS e ao que resta do orçamento da requisição.
+    """
+
+    MODE = os.getenv('COST_GUARD_MODE', 'explain').strip().lower()
+    MAX_COST = float(os.getenv('COST_GUARD_MAX_COST', 1e7))
+    DOWNGRADE_COST = float(os.getenv('COST_GUARD_DOWNGRADE_COST', 1e6))
+    MAX_JOINS = int(os.getenv('COST_GUARD_MAX_JOINS', 8))
+    DOWNGRADED_TIMEOUT_MS = int(os.getenv('COST_GUARD_DOWNGRADED_TIMEOUT_MS', 2000))
+    DOWNGRADED_MAX_ROWS = int(os.getenv('COST_GUARD_DOWNGRADED_MAX_ROWS', 500))
+    EXPLAIN_TIMEOUT_SECONDS = float(os.getenv('COST_GUARD_EXPLAIN_TIMEOUT_SECONDS', 2))
+
+    ALLOW = 'allow'
+    DOWNGRADE = 'downgrade'
+    REJECT = 'reject'
+
+    @staticmethod
+    def evaluate(client, sql, slug=None, canonical_sql=None, deadline=None):
+        """
+        Avalia o custo da consulta, retornando {'action', 'reason', 'source', 'estimate'}.
+        Com slug e canonical_sql, a estimativa do EXPLAIN é reaproveitada do cache; com deadline, o EXPLAIN não passa do orçamento restante.
+        """
+        if QueryCostGuard.MODE == 'off':
+            return QueryCostGuard._decision(QueryCostGuard.ALLOW, None, 'off', None)
+
+        estimate = None
+        if QueryCostGuard.MODE == 'explain':
+            estimate = QueryCostGuard._explain(client, sql, slug, canonical_sql, deadline)
+
+        if estimate is not None:
+            cost = estimate['total_cost']
+            if cost > QueryCostGuard.MAX_COST:
+                reason = f"Consulta bloqueada por custo estimado muito alto ({cost:.0f}). Verifique as condições de junção e os filtros."
+                return QueryCostGuard._decision(QueryCostGuard.REJECT, reason, 'explain', estimate)
+            if cost > QueryCostGuard.DOWNGRADE_COST:
+                return QueryCostGuard._decision(QueryCostGuard.DOWNGRADE, f"Custo estimado alto ({cost:.0f}).", 'explain', estimate)
+            return QueryCostGuard._decision(QueryCostGuard.ALLOW, None, 'explain', estimate)
+
+        analysis = QueryCostGuard.analyze(sql)
+        cartesian = analysis['cartesian_relations']
+        if cartesian:
+            reason = f"Atenção: produto cartesiano entre {cartesian} tabelas sem condição de junção; a consulta roda com tempo e linhas reduzidos."
+            return QueryCostGuard._decision(QueryCostGuard.DOWNGRADE, reason, 'heuristic', analysis)
+        if analysis['joins'] > QueryCostGuard.MAX_JOINS:
+            return QueryCostGuard._decision(QueryCostGuard.DOWNGRADE, f"Consulta com {analysis['joins']} junções.", 'heuristic', analysis)
+        return QueryCostGuard._decision(QueryCostGuard.ALLOW, None, 'heuristic', analysis)
+
+    @staticmethod
+    def _explain(client, sql, slug, canonical_sql, deadline):
+        """Retorna a estimativa do planejador (do cache ou do rpc_explain, com tempo limitado), ou None se indisponível."""
+        cacheable = slug is not None and canonical_sql is not None
+        if cacheable:
+            cached = CostEstimateCache.get(slug, canonical_sql)
+            if cached is not None:
+                return cached
+
+        request_timeout = QueryCostGuard.EXPLAIN_TIMEOUT_SECONDS
+        if deadline is not None:
+            request_timeout = min(request_timeout, deadline.remaining())
+        if request_timeout <= 0:
+            return None
+
+        try:
+            estimate = client.explain_cost(sql.strip().rstrip(';'), request_timeout=request_timeout)
+        except Exception as e:
+            print(f"Falha ao estimar custo via EXPLAIN: {e}")
+            return None
+        if estimate is not None and cacheable:
+            CostEstimateCache.set(slug, canonical_sql, estimate)
+        return estimate
+
+    @staticmethod
+    def analyze(sql):
+        """
+        Percorre os tokens da consulta contando, por SELECT (incluindo subconsultas e CTEs), as relações do FROM/JOIN
+        e as combinações sem predicado: vírgulas e CROSS JOIN, ou JOIN sem ON/USING, num SELECT sem WHERE.
+        Retorna {'joins': total de junções, 'cartesian_relations': maior número de tabelas combinadas sem predicado}.
+        """
+        result = {'joins': 0, 'cartesian_relations': 0}
+        scopes = []
+        depth = 0
+        prev_word = None
+
+        for kind, text in tokenize_sql(sql):
+            if kind in (WHITESPACE, COMMENT):
+                continue
+            if text == '(':
+                depth += 1
+                continue
+            if text == ')':
+                while scopes and scopes[-1]['depth'] == depth:
+                    QueryCostGuard._close_scope(scopes.pop(), result)
+                depth -= 1
+                continue
+
+            word = text.upper() if kind == WORD else None
+            if word == 'SELECT':
+                if scopes and scopes[-1]['depth'] == depth:
+                    QueryCostGuard._close_scope(scopes.pop(), result)
+                scopes.append({'depth': depth, 'relations': 0, 'unconstrained': 0, 'has_where': False, 'in_from': False, 'pending_join': False})
+            elif scopes and scopes[-1]['depth'] == depth:
+                QueryCostGuard._visit(scopes[-1], word, text, prev_word)
+            prev_word = word
+
+        while scopes:
+            QueryCostGuard._close_scope(scopes.pop(), result)
+        return result
+
+    @staticmethod
+    def _visit(scope, word, text, prev_word):
+        """Atualiza o estado do SELECT corrente com um token do seu próprio nível de parênteses."""
+        if word == 'FROM':
+            scope['in_from'] = True
+            scope['relations'] += 1
+        elif word == 'JOIN':
+            QueryCostGuard._settle_join(scope)
+            scope['relations'] += 1
+            if prev_word == 'CROSS':
+                scope['unconstrained'] += 1
+            elif prev_word != 'NATURAL':
+                scope['pending_join'] = True
+        elif word in ('ON', 'USING'):
+            scope['pending_join'] = False
+        elif word == 'WHERE':
+            QueryCostGuard._settle_join(scope)
+            scope['has_where'] = True
+            scope['in_from'] = False
+        elif word in _CLAUSE_KEYWORDS:
+            QueryCostGuard._settle_join(scope)
+            scope['in_from'] = False
+        elif text == ',' and scope['in_from']:
+            QueryCostGuard._settle_join(scope)
+            scope['relations'] += 1
+            scope['unconstrained'] += 1
+
+    @staticmethod
+    def _settle_join(scope):
+        """Contabiliza o JOIN anterior que terminou sem ON/USING."""
+        if scope['pending_join']:
+            scope['unconstrained'] += 1
+            scope['pending_join'] = False
+
+    @staticmethod
+    def _close_scope(scope, result):
+        """Fecha o SELECT, acumulando as suas junções no resultado da análise."""
+        QueryCostGuard._settle_join(scope)
+        result['joins'] += max(0, scope['relations'] - 1)
+        if scope['unconstrained'] and not scope['has_where']:
+            result['cartesian_relations'] = max(result['cartesian_relations'], scope['unconstrained'] + 1)
+
+    @staticmethod
+    def _decision(action, reason, source, estimate):
+        """Monta o resultado da avaliação."""
+        return {'action': action, 'reason': reason, 'source': source, 'estimate': estimate}
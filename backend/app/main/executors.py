@@ -0,0 +1,240 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from postgrest.exceptions import APIError
+
+STATEMENT_TIMEOUT_MESSAGE = 'Erro no banco de dados: tempo limite de execução da consulta excedido.'
+
+class ScenarioQueryError(Exception):
+    """Erro da própria query ou do banco do cenário (não transitório: não vale repetir a execução)."""
+
+class ScenarioExecutor:
+    """
+    Interface dos backends de execução dos cenários.
+    fetch(sql, timeout_ms, request_timeout) executa uma única consulta e retorna (colunas, linhas), com as linhas como tuplas na ordem
+    das colunas, abortando-a no banco se ultrapassar timeout_ms; request_timeout (segundos) limita a chamada remota inteira nos backends
+    de rede. explain_cost(sql, request_timeout) retorna a estimativa de custo do planejador, quando disponível.
+    """
+
+    backend = None
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        """Executa a consulta e retorna (colunas, linhas)."""
+        raise NotImplementedError
+
+    def explain_cost(self, sql, request_timeout=None):
+        """Retorna {'total_cost', 'plan_rows'} estimados pelo planejador, ou None se o backend não oferece estimativa."""
+        return None
+
+    def close(self):
+        """Libera os recursos do backend."""
+
+class SupabaseExecutor(ScenarioExecutor):
+    """
+    Executa as consultas remotamente pela função rpc_sql do projeto Supabase do cenário.
+    O statement timeout vai no cabeçalho STATEMENT_TIMEOUT_HEADER: a função de pre-request do PostgREST
+    (sql_trail_pre_request) o aplica na transação antes de a chamada começar. Um set_config dentro da própria
+    rpc_sql não limitaria a instrução já em execução.
+    """
+
+    backend = 'supabase'
+    STATEMENT_TIMEOUT_HEADER = 'X-Statement-Timeout'
+
+    def __init__(self, client, http_client=None):
+        self.client = client
+        self.http_client = http_client
+        self.supports_explain = True
+        self._request_timeout = threading.local()
+        if http_client is not None:
+            hooks = http_client.event_hooks
+            http_client.event_hooks = {**hooks, 'request': [*hooks.get('request', []), self._apply_request_timeout]}
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        """
+        Chama rpc_sql e converte a lista de objetos JSON em (colunas, linhas).
+        O timeout_ms vai no cabeçalho STATEMENT_TIMEOUT_HEADER; bancos sem a função de pre-request usam o statement_timeout do papel.
+        Com request_timeout, a chamada HTTP é abortada após esse tempo em vez do timeout padrão do cliente.
+        """
+        with self._bounded(request_timeout, timeout_ms):
+            response = self.client.rpc('rpc_sql', {'p_query': sql}).execute()
+
+        if getattr(response, 'error', None):
+            print('RPC error:', response.error)
+            error_message = getattr(response.error, 'message', str(response.error))
+            raise ScenarioQueryError(f'Erro no banco de dados: {error_message}')
+
+        data = response.data
+
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except Exception as e:
+                print("Falhou em passar para JSON.")
+                raise ScenarioQueryError(f'Falhou em passar para JSON: {e}')
+
+        if not isinstance(data, list):
+            print("Formato inesperado.")
+            raise ScenarioQueryError(data.get('error') if isinstance(data, dict) else "Formato inesperado")
+
+        columns = list(data[0].keys()) if data else []
+        rows = [tuple(item.values()) for item in data]
+        return columns, rows
+
+    def explain_cost(self, sql, request_timeout=None):
+        """Chama rpc_explain (EXPLAIN sem executar a consulta); retorna None se a função não existir no banco ou falhar."""
+        if not self.supports_explain:
+            return None
+        try:
+            with self._bounded(request_timeout, request_timeout * 1000 if request_timeout else None):
+                data = self.client.rpc('rpc_explain', {'p_query': sql}).execute().data
+        except APIError as e:
+            if e.code == 'PGRST202':
+                self.supports_explain = False
+            return None
+
+        if isinstance(data, str):
+            data = json.loads(data)
+        if not isinstance(data, dict) or data.get('error') or data.get('total_cost') is None:
+            return None
+        return {'total_cost': float(data['total_cost']), 'plan_rows': float(data.get('plan_rows') or 0)}
+
+    @contextmanager
+    def _bounded(self, request_timeout, statement_timeout_ms=None):
+        """Define o timeout das requisições HTTP e o statement timeout enviados por esta thread dentro do bloco."""
+        self._request_timeout.seconds = request_timeout
+        self._request_timeout.statement_ms = statement_timeout_ms
+        try:
+            yield
+        finally:
+            self._request_timeout.seconds = None
+            self._request_timeout.statement_ms = None
+
+    def _apply_request_timeout(self, request):
+        """
+        Hook de requisição do httpx: troca o timeout padrão do cliente pelo da chamada em andamento nesta thread
+        e envia o statement timeout dela no cabeçalho lido pela função de pre-request.
+        """
+        seconds = getattr(self._request_timeout, 'seconds', None)
+        if seconds is not None:
+            request.extensions['timeout'] = httpx.Timeout(max(seconds, 0.001)).as_dict()
+        statement_ms = getattr(self._request_timeout, 'statement_ms', None)
+        if statement_ms:
+            request.headers[self.STATEMENT_TIMEOUT_HEADER] = str(max(1, int(statement_ms)))
+
+    def close(self):
+        """Fecha o pool HTTP do cliente."""
+        if self.http_client is not None:
+            self.http_client.close()
+
+class SQLiteExecutor(ScenarioExecutor):
+    """
+    Executa as consultas localmente em um arquivo SQLite do cenário, aberto somente para leitura.
+    Cada thread mantém a sua própria conexão; todas ficam registradas para que close() as feche de uma vez.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def _connection(self):
+        """Retorna a conexão somente leitura da thread atual, abrindo-a na primeira utilização."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        """Executa a consulta no arquivo local, interrompendo-a pelo progress handler do SQLite ao estourar o timeout."""
+        conn = self._connection()
+        if timeout_ms:
+            expires_at = time.monotonic() + timeout_ms / 1000
+            conn.set_progress_handler(lambda: time.monotonic() > expires_at, 10000)
+        try:
+            cursor = conn.execute(sql)
+            rows = cursor.fetchall()
+        except sqlite3.OperationalError as e:
+            if str(e) == 'interrupted':
+                raise ScenarioQueryError(STATEMENT_TIMEOUT_MESSAGE)
+            raise ScenarioQueryError(f'Erro no banco de dados: {e}')
+        except sqlite3.Error as e:
+            raise ScenarioQueryError(f'Erro no banco de dados: {e}')
+        finally:
+            if timeout_ms:
+                conn.set_progress_handler(None, 0)
+        columns = [d[0] for d in cursor.description] if cursor.description else []
+        return columns, rows
+
+    def close(self):
+        """Fecha as conexões abertas por todas as threads."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+class DuckDBExecutor(ScenarioExecutor):
+    """
+    Executa as consultas localmente em um arquivo DuckDB do cenário (dialeto próximo ao PostgreSQL), somente leitura e sem acesso a arquivos ou rede fora dele.
+    Requer o pacote opcional duckdb.
+    """
+
+    backend = 'duckdb'
+
+    def __init__(self, path):
+        try:
+            import duckdb # type: ignore
+        except ImportError as e:
+            raise RuntimeError("O backend 'duckdb' requer o pacote duckdb instalado.") from e
+        self._duckdb = duckdb
+        self.path = path
+        # Sem acesso externo, as funções de tabela (read_csv_auto, read_text, ...) não leem arquivos do servidor
+        # nem a rede; com a configuração travada, a consulta do aluno não consegue reabilitá-lo com SET.
+        self._conn = duckdb.connect(path, read_only=True, config={
+            'enable_external_access': False,
+            'autoinstall_known_extensions': False,
+            'autoload_known_extensions': False,
+            'lock_configuration': True
+        })
+        self._local = threading.local()
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        """Executa a consulta em um cursor próprio da thread atual, interrompendo-a ao estourar o timeout."""
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._conn.cursor()
+            self._local.cursor = cursor
+
+        timer = threading.Timer(timeout_ms / 1000, cursor.interrupt) if timeout_ms else None
+        if timer:
+            timer.start()
+        try:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+        except self._duckdb.InterruptException:
+            raise ScenarioQueryError(STATEMENT_TIMEOUT_MESSAGE)
+        except self._duckdb.Error as e:
+            raise ScenarioQueryError(f'Erro no banco de dados: {e}')
+        finally:
+            if timer:
+                timer.cancel()
+        columns = [d[0] for d in cursor.description] if cursor.description else []
+        return columns, rows
+
+    def close(self):
+        """Fecha a conexão com o arquivo."""
+        self._conn.close()
+
+EMBEDDED_EXECUTORS = {
+    SQLiteExecutor.backend: SQLiteExecutor,
+    DuckDBExecutor.backend: DuckDBExecutor
+}
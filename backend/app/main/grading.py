@@ -0,0 +1,379 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd # type: ignore
+
+class ResultComparator:
+    """
+    Motor colunar de comparação dos resultados das queries.
+    Cada coluna é normalizada uma única vez conforme o seu dtype, evitando o DataFrame.map célula a célula,
+    e preservando os mesmos vereditos e mensagens da comparação em três níveis do SQLGrader.
+    """
+
+    SUCCESS_MESSAGE = "Parabens! As consultas sao equivalentes."
+
+    _ORDER_BY_RE = re.compile(r'\bORDER\s+BY\b')
+    _NON_ALNUM_RE = re.compile(r'[^a-z0-9]')
+    _HASH_MULTIPLIER = np.uint64(1000003)
+
+    @staticmethod
+    def compare(base_sql, base_data, stu_data):
+        """Compara dois resultados já executados ({'columns', 'rows', 'total'}) e retorna (veredito, mensagem)."""
+        if base_data['total'] != stu_data['total']:
+            return False, ResultComparator.row_count_message(base_data['total'], stu_data['total'])
+
+        base_cols, base_len = ResultComparator.normalize(base_data)
+        stu_cols, stu_len = ResultComparator.normalize(stu_data)
+
+        if ResultComparator._is_empty(base_cols, base_len) and ResultComparator._is_empty(stu_cols, stu_len):
+            return True, ResultComparator.SUCCESS_MESSAGE
+
+        same_shape = base_len == stu_len and len(base_cols) == len(stu_cols)
+
+        # NÍVEL 1: Conteúdo Correto, Ordem Correta
+        if same_shape and all(np.array_equal(b, s) for b, s in zip(base_cols, stu_cols)):
+            return True, ResultComparator.SUCCESS_MESSAGE
+
+        # NÍVEL 2: Conteúdo Correto, Ordem Errada
+        if same_shape and ResultComparator._same_rows_any_order(base_cols, stu_cols):
+            if ResultComparator.is_order_sensitive(base_sql):
+                return False, "Os dados estão corretos, mas a ordem está errada."
+            return True, ResultComparator.SUCCESS_MESSAGE
+
+        # NÍVEL 3: Busca Flexível (Aceita concatenação, colunas extras e ordenação diferente)
+        if base_len == stu_len and ResultComparator._flexible_match(base_cols, stu_cols, base_len):
+            return True, ResultComparator.SUCCESS_MESSAGE
+
+        return False, "Os dados nao conferem."
+
+    @staticmethod
+    def row_count_message(expected_total, received_total):
+        """Mensagem de feedback para resultados com número de linhas diferente do esperado."""
+        return f"O número de linhas retornadas difere. Esperado: {expected_total}, Recebido: {received_total}."
+
+    @staticmethod
+    def is_order_sensitive(base_sql):
+        """Indica se a query esperada impõe ordenação (ORDER BY), tornando a ordem das linhas parte da resposta."""
+        base_upper = " " + base_sql.upper().replace('\n', ' ') + " "
+        return bool(ResultComparator._ORDER_BY_RE.search(base_upper))
+
+    @staticmethod
+    def fingerprint(base_sql, base_data):
+        """
+        Gera a impressão digital canônica de um resultado esperado: contagem de linhas, colunas,
+        sensibilidade à ordem, digests por linha e o digest do resultado completo.
+        """
+        columns, n_rows = ResultComparator.normalize(base_data)
+        order_sensitive = ResultComparator.is_order_sensitive(base_sql)
+        row_digests = ResultComparator.row_digests(columns, n_rows)
+        return {
+            "row_count": n_rows,
+            "columns": list(base_data['columns']),
+            "order_sensitive": order_sensitive,
+            "row_digests": row_digests,
+            "result_digest": ResultComparator._result_digest(row_digests, len(columns), order_sensitive)
+        }
+
+    @staticmethod
+    def matches_fingerprint(fingerprint, stu_data):
+        """
+        Verifica se o resultado do aluno é equivalente ao gabarito usando apenas a impressão digital.
+        Um True garante o mesmo veredito de sucesso da comparação completa; um False apenas indica que ela é necessária.
+        """
+        if stu_data['total'] != fingerprint['row_count']:
+            return False
+
+        columns, n_rows = ResultComparator.normalize(stu_data)
+        if fingerprint['row_count'] == 0 and n_rows == 0:
+            return True
+
+        row_digests = ResultComparator.row_digests(columns, n_rows)
+        digest = ResultComparator._result_digest(row_digests, len(columns), fingerprint['order_sensitive'])
+        return digest == fingerprint['result_digest']
+
+    @staticmethod
+    def _result_digest(row_digests, n_cols, order_sensitive):
+        """Combina os digests das linhas (ordenados, quando a ordem não importa) e o número de colunas em um SHA-256."""
+        digests = row_digests if order_sensitive else np.sort(row_digests)
+        hasher = hashlib.sha256(f"{n_cols}:{len(digests)}:".encode('utf-8'))
+        hasher.update(np.ascontiguousarray(digests, dtype='<u8').tobytes())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def normalize(data):
+        """
+        Normaliza um resultado em uma lista de colunas (arrays de strings), retornando (colunas, número de linhas).
+        Equivale a arredondar para 2 casas, converter para str e aplicar strip/lower em cada célula.
+        Aceita tanto o formato por linhas ('rows') quanto o colunar de to_columnar ('values').
+        """
+        if 'values' in data:
+            df = pd.DataFrame(dict(enumerate(data['values'])), columns=range(len(data['values'])))
+        else:
+            df = pd.DataFrame(data['rows'], columns=data['columns'])
+        columns = [ResultComparator._normalize_column(df.iloc[:, i]) for i in range(df.shape[1])]
+        return columns, len(df)
+
+    @staticmethod
+    def to_columnar(data):
+        """
+        Converte um resultado por linhas no formato colunar compacto usado entre processos:
+        colunas homogêneas de bool, int ou float viram arrays NumPy; as demais, listas de valores.
+        """
+        rows = data['rows']
+        n_cols = len(data['columns'])
+        values = [list(col) for col in zip(*rows)] if rows else [[] for _ in range(n_cols)]
+        return {
+            'columns': list(data['columns']),
+            'total': data['total'],
+            'values': [ResultComparator._pack_column(col) for col in values]
+        }
+
+    @staticmethod
+    def _pack_column(values):
+        """Empacota a coluna num array NumPy quando todos os valores têm o mesmo tipo numérico, sem nulos."""
+        types = {type(v) for v in values}
+        if len(types) != 1:
+            return values
+        kind = types.pop()
+        if kind is bool:
+            return np.array(values, dtype=np.bool_)
+        if kind is float:
+            return np.array(values, dtype=np.float64)
+        if kind is int and -2**63 <= min(values) and max(values) < 2**63:
+            return np.array(values, dtype=np.int64)
+        return values
+
+    @staticmethod
+    def _normalize_column(series):
+        """
+        Normaliza uma coluna conforme o dtype, retornando um array de objetos str.
+        Booleanos e inteiros não precisam de fold de caixa/espaços; floats são arredondados no NumPy
+        e só as colunas textuais passam por strip/lower.
+        """
+        values = series.to_numpy()
+        kind = values.dtype.kind
+
+        if kind == 'b':
+            return np.where(values, 'true', 'false').astype(object)
+        if kind in 'iu':
+            return values.astype(str).astype(object)
+        if kind == 'f':
+            return np.array(list(map(str, np.round(values, 2).tolist())), dtype=object)
+        if kind != 'O':
+            values = series.astype(str).to_numpy()
+
+        return np.array([str(v).strip().lower() for v in values.tolist()], dtype=object)
+
+    @staticmethod
+    def _is_empty(columns, n_rows):
+        """Replica a semântica de DataFrame.empty (nenhuma linha ou nenhuma coluna)."""
+        return n_rows == 0 or not columns
+
+    @staticmethod
+    def row_digests(columns, n_rows):
+        """
+        Gera um digest uint64 por linha combinando o hash vetorizado de cada coluna normalizada.
+        A combinação depende da posição da coluna, então linhas com os mesmos valores em colunas trocadas diferem.
+        """
+        digests = np.zeros(n_rows, dtype=np.uint64)
+        for col in columns:
+            digests = (digests * ResultComparator._HASH_MULTIPLIER) ^ pd.util.hash_array(col)
+        return digests
+
+    @staticmethod
+    def _same_rows_any_order(base_cols, stu_cols):
+        """
+        Verifica se os dois resultados possuem o mesmo multiconjunto de linhas, desconsiderando a ordem.
+        Compara os digests ordenados das linhas em vez de ordenar listas de listas.
+        """
+        n_rows = len(base_cols[0]) if base_cols else 0
+        base_digests = np.sort(ResultComparator.row_digests(base_cols, n_rows))
+        stu_digests = np.sort(ResultComparator.row_digests(stu_cols, n_rows))
+        return np.array_equal(base_digests, stu_digests)
+
+    @staticmethod
+    def _alnum_column(column):
+        """Remove os caracteres não alfanuméricos de cada célula, processando apenas os valores distintos."""
+        codes, uniques = pd.factorize(column)
+        cleaned = [ResultComparator._NON_ALNUM_RE.sub('', v) for v in uniques.tolist()]
+        return [cleaned[i] for i in codes.tolist()]
+
+    @staticmethod
+    def _flexible_match(base_cols, stu_cols, n_rows):
+        """
+        Verifica se cada linha esperada está contida (por substring alfanumérica) em uma linha distinta do aluno.
+        Aceita concatenação de colunas e colunas extras.
+        """
+        stu_pool = [ResultComparator._NON_ALNUM_RE.sub('', "".join(row)) for row in zip(*stu_cols)] if stu_cols else [''] * n_rows
+        base_vals = [ResultComparator._alnum_column(col) for col in base_cols]
+
+        base_rows = zip(*base_vals) if base_vals else [()] * n_rows
+
+        matched, _ = FlexibleMatcher(stu_pool).match_all(base_rows)
+        return matched
+
+def _compare_columnar(base_sql, base_payload, stu_payload):
+    """Ponto de entrada dos processos de comparação: recebe os resultados no formato colunar."""
+    return ResultComparator.compare(base_sql, base_payload, stu_payload)
+
+class ComparisonOffload:
+    """
+    Despacha as comparações grandes para um pool de processos, para que a normalização e a busca flexível,
+    que seguram o GIL, não travem as demais requisições do processo. Os resultados trafegam no formato colunar
+    de ResultComparator.to_columnar; comparações abaixo de MIN_CELLS continuam no caminho rápido, na própria thread.
+    """
+
+    MIN_CELLS = int(os.getenv('COMPARE_OFFLOAD_MIN_CELLS', 200000))
+    WORKERS = int(os.getenv('COMPARE_PROCESS_WORKERS', 2))
+
+    _lock = threading.Lock()
+    _pool = None
+    _stats = {"inline": 0, "offloaded": 0, "fallbacks": 0}
+
+    @staticmethod
+    def compare(base_sql, base_data, stu_data):
+        """Compara os resultados, no pool de processos quando o número de células passa de MIN_CELLS."""
+        cells = len(base_data['rows']) * len(base_data['columns']) + len(stu_data['rows']) * len(stu_data['columns'])
+        if ComparisonOffload.WORKERS <= 0 or cells < ComparisonOffload.MIN_CELLS or base_data['total'] != stu_data['total']:
+            ComparisonOffload._count("inline")
+            return ResultComparator.compare(base_sql, base_data, stu_data)
+
+        try:
+            future = ComparisonOffload._get_pool().submit(
+                _compare_columnar, base_sql, ResultComparator.to_columnar(base_data), ResultComparator.to_columnar(stu_data)
+            )
+            verdict = future.result()
+            ComparisonOffload._count("offloaded")
+            return verdict
+        except BrokenProcessPool as e:
+            print(f"Pool de comparação indisponível, comparando na própria thread: {e}")
+            with ComparisonOffload._lock:
+                ComparisonOffload._pool = None
+            ComparisonOffload._count("fallbacks")
+            return ResultComparator.compare(base_sql, base_data, stu_data)
+
+    @staticmethod
+    def stats():
+        """Retorna quantas comparações foram feitas na thread, no pool de processos e por fallback."""
+        with ComparisonOffload._lock:
+            return {**ComparisonOffload._stats, "workers": ComparisonOffload.WORKERS, "min_cells": ComparisonOffload.MIN_CELLS}
+
+    @staticmethod
+    def _get_pool():
+        """Cria o pool na primeira comparação grande. Usa spawn, pois o processo já tem threads ativas quando o pool nasce."""
+        with ComparisonOffload._lock:
+            if ComparisonOffload._pool is None:
+                ComparisonOffload._pool = ProcessPoolExecutor(
+                    max_workers=ComparisonOffload.WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return ComparisonOffload._pool
+
+    @staticmethod
+    def _count(key):
+        """Incrementa um contador sob o lock."""
+        with ComparisonOffload._lock:
+            ComparisonOffload._stats[key] += 1
+
+class FlexibleMatcher:
+    """
+    Casador indexado do nível 3 da comparação.
+    Indexa as linhas do aluno (já reduzidas a strings alfanuméricas) por trigramas, de modo que cada valor
+    esperado só é verificado contra as linhas candidatas que contêm todos os seus trigramas.
+    Mantém a mesma regra da busca linear: cada linha esperada consome a primeira linha do aluno ainda livre
+    que contém todos os seus valores.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self, stu_pool):
+        started = time.perf_counter()
+        self._pool = stu_pool
+        self._available = [True] * len(stu_pool)
+        self._next_free = 0
+        self._index = {}
+        self._needle_cache = {}
+
+        for row_id, text in enumerate(stu_pool):
+            for gram in {text[i:i + self.GRAM_SIZE] for i in range(len(text) - self.GRAM_SIZE + 1)}:
+                self._index.setdefault(gram, []).append(row_id)
+
+        self.stats = {
+            "index_seconds": time.perf_counter() - started,
+            "match_seconds": 0.0,
+            "rows_matched": 0,
+            "candidates_checked": 0,
+            "needle_cache_hits": 0,
+            "needle_cache_misses": 0,
+        }
+
+    def match_all(self, base_rows):
+        """Casa todas as linhas esperadas em ordem, retornando (todas_casaram, contadores)."""
+        started = time.perf_counter()
+        matched = True
+        for b_vals in base_rows:
+            if not self.match_row(b_vals):
+                matched = False
+                break
+        self.stats["match_seconds"] += time.perf_counter() - started
+        return matched, self.stats
+
+    def match_row(self, b_vals):
+        """Consome a primeira linha livre do aluno que contém todos os valores informados, retornando se encontrou."""
+        needles = {v for v in b_vals if v}
+        if not needles:
+            return self._take(self._first_free())
+
+        postings = sorted((self._rows_containing(n) for n in needles), key=lambda p: len(p[0]))
+        first, others = postings[0][0], [p[1] for p in postings[1:]]
+
+        for row_id in first:
+            self.stats["candidates_checked"] += 1
+            if self._available[row_id] and all(row_id in rows for rows in others):
+                return self._take(row_id)
+        return False
+
+    def _rows_containing(self, needle):
+        """Retorna (lista ordenada, conjunto) das linhas do aluno que contêm o valor, com cache por valor."""
+        cached = self._needle_cache.get(needle)
+        if cached is not None:
+            self.stats["needle_cache_hits"] += 1
+            return cached
+        self.stats["needle_cache_misses"] += 1
+
+        if len(needle) < self.GRAM_SIZE:
+            candidates = range(len(self._pool))
+        else:
+            grams = {needle[i:i + self.GRAM_SIZE] for i in range(len(needle) - self.GRAM_SIZE + 1)}
+            lists = sorted((self._index.get(g, []) for g in grams), key=len)
+            candidate_set = set(lists[0])
+            for lst in lists[1:]:
+                if not candidate_set:
+                    break
+                candidate_set.intersection_update(lst)
+            candidates = sorted(candidate_set)
+
+        rows = [row_id for row_id in candidates if needle in self._pool[row_id]]
+        cached = (rows, set(rows))
+        self._needle_cache[needle] = cached
+        return cached
+
+    def _first_free(self):
+        """Retorna o índice da primeira linha do aluno ainda não consumida, ou None."""
+        while self._next_free < len(self._available) and not self._available[self._next_free]:
+            self._next_free += 1
+        return self._next_free if self._next_free < len(self._available) else None
+
+    def _take(self, row_id):
+        """Marca a linha do aluno como consumida."""
+        if row_id is None:
+            return False
+        self._available[row_id] = False
+        self.stats["rows_matched"] += 1
+        return True
@@ -0,0 +1,370 @@
+from sqlalchemy import func, case, update, bindparam, tuple_
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from app.database import Session
+from app.database.models import Question, Submission, StudentQuestionProgress, QuestionClassMetrics, Enrollment, Class
+
+SKIP_QUERY = 'SKIP'
+
+def upsert(session, table, values, updates):
+    """
+    Insere as linhas na tabela ou, no conflito da chave primária, aplica updates(table, valores_recebidos),
+    que retorna as expressões de atualização das colunas. Suporta MySQL/TiDB e SQLite.
+    """
+    if session.get_bind().dialect.name == 'sqlite':
+        stmt = sqlite.insert(table).values(values)
+        stmt = stmt.on_conflict_do_update(index_elements=list(table.primary_key.columns), set_=updates(table, stmt.excluded))
+    else:
+        stmt = mysql.insert(table).values(values)
+        stmt = stmt.on_duplicate_key_update(updates(table, stmt.inserted))
+    session.execute(stmt)
+
+class ProgressRollup:
+    """
+    Mantém a tabela student_question_progress, um resumo por (aluno, questão) das submissões: tentativas,
+    tempo total, desistência e a primeira/última submissão correta. É atualizada na mesma transação que grava
+    as submissões, para que os relatórios de progresso não precisem varrer o histórico de submissões.
+    Os contadores são somados por upsert e os campos de acerto são mesclados por mínimo/máximo de id,
+    então gravações concorrentes do mesmo aluno não se sobrescrevem.
+    """
+
+    @staticmethod
+    def solved():
+        """Condição SQL de questão resolvida (acerto real, desistências não contam)."""
+        return StudentQuestionProgress.first_correct_submission_id.isnot(None)
+
+    @staticmethod
+    def completed():
+        """Condição SQL de questão concluída (resolvida ou pulada), usada para liberar o progresso."""
+        return ProgressRollup.solved() | (StudentQuestionProgress.skipped == True)
+
+    @staticmethod
+    def apply(session, rows):
+        """
+        Incorpora ao resumo as submissões recém-inseridas na sessão (dicionários com as colunas de submissions).
+        Deve ser chamado depois do INSERT e antes do commit, dentro da mesma transação.
+        """
+        deltas = {}
+        for row in rows:
+            key = (int(row["student_id"]), int(row["question_id"]))
+            delta = deltas.setdefault(key, {"attempts": 0, "correct_attempts": 0, "total_time_seconds": 0, "skipped": False})
+            skip = row["submitted_query"] == SKIP_QUERY
+            delta["attempts"] += 1
+            delta["correct_attempts"] += 1 if bool(row["is_correct"]) and not skip else 0
+            delta["total_time_seconds"] += int(row.get("time_spent_seconds") or 0)
+            delta["skipped"] = delta["skipped"] or skip
+        if not deltas:
+            return
+
+        ProgressRollup._upsert_counters(session, [
+            {
+                "student_id": student_id,
+                "question_id": question_id,
+                "attempts": delta["attempts"],
+                "correct_attempts": delta["correct_attempts"],
+                "total_time_seconds": delta["total_time_seconds"],
+                "skipped": delta["skipped"]
+            }
+            for (student_id, question_id), delta in deltas.items()
+        ])
+
+        # O upsert já criou/bloqueou as linhas de todos os pares até o commit, então esta leitura vê o estado deixado
+        # pelas transações concorrentes do mesmo aluno e questão. Ler antes do upsert não bastaria: sem gap locks no
+        # TiDB, duas primeiras submissões simultâneas veriam ambas a linha inexistente e contariam o aluno duas vezes.
+        current = ProgressRollup._locked_state(session, list(deltas))
+
+        correct_pairs = [key for key, delta in deltas.items() if delta["correct_attempts"]]
+        if correct_pairs:
+            ProgressRollup._merge_correct(session, ProgressRollup._correct_bounds(session, correct_pairs))
+
+        for key, delta in deltas.items():
+            attempts, first_correct_id = current[key]
+            delta["new_student"] = attempts == delta["attempts"]
+            delta["newly_correct"] = bool(delta["correct_attempts"]) and first_correct_id is None
+        QuestionMetricsCube.apply(session, deltas)
+
+    @staticmethod
+    def rebuild(session, question_id, student_ids=None):
+        """
+        Recalcula do zero, a partir de submissions, o resumo de uma questão (opcionalmente só dos alunos informados).
+        Usado pelo backfill e pela recorreção, que pode transformar acertos em erros e vice-versa.
+        O cubo de métricas da questão é reconstruído em seguida. Retorna a quantidade de linhas do resumo gravadas.
+        """
+        real_correct = (Submission.is_correct == True) & (Submission.submitted_query != SKIP_QUERY)
+        query = session.query(
+            Submission.student_id,
+            func.count(Submission.id).label('attempts'),
+            func.sum(case((real_correct, 1), else_=0)).label('correct_attempts'),
+            func.coalesce(func.sum(Submission.time_spent_seconds), 0).label('total_time_seconds'),
+            func.max(case((Submission.submitted_query == SKIP_QUERY, 1), else_=0)).label('skipped'),
+            func.min(case((real_correct, Submission.id), else_=None)).label('first_id'),
+            func.max(case((real_correct, Submission.id), else_=None)).label('last_id')
+        ).filter(Submission.question_id == question_id)
+        progress = session.query(StudentQuestionProgress).filter(StudentQuestionProgress.question_id == question_id)
+        if student_ids is not None:
+            query = query.filter(Submission.student_id.in_(student_ids))
+            progress = progress.filter(StudentQuestionProgress.student_id.in_(student_ids))
+        rows = query.group_by(Submission.student_id).all()
+
+        first_rows = ProgressRollup._submissions_by_id(session, [row.first_id for row in rows if row.first_id])
+        progress.delete(synchronize_session=False)
+        session.bulk_insert_mappings(StudentQuestionProgress, [
+            {
+                "student_id": row.student_id,
+                "question_id": question_id,
+                "attempts": row.attempts,
+                "correct_attempts": int(row.correct_attempts or 0),
+                "total_time_seconds": int(row.total_time_seconds),
+                "skipped": bool(row.skipped),
+                "first_correct_submission_id": row.first_id,
+                "first_correct_at": first_rows[row.first_id].submitted_at if row.first_id else None,
+                "first_correct_time_spent_seconds": first_rows[row.first_id].time_spent_seconds if row.first_id else None,
+                "last_correct_submission_id": row.last_id
+            }
+            for row in rows
+        ])
+        QuestionMetricsCube.rebuild_question(session, question_id)
+        return len(rows)
+
+    @staticmethod
+    def backfill(question_id=None):
+        """
+        Reconstrói o resumo a partir do histórico de submissões, uma questão por transação.
+        Retorna (sucesso, {'questions', 'rows'}) ou (False, erro).
+        """
+        try:
+            with Session() as session:
+                query = session.query(Question.id).order_by(Question.id)
+                if question_id is not None:
+                    query = query.filter(Question.id == question_id)
+                question_ids = [row.id for row in query.all()]
+
+            rows = 0
+            for qid in question_ids:
+                with Session() as session:
+                    rows += ProgressRollup.rebuild(session, qid)
+                    session.commit()
+            return True, {"questions": len(question_ids), "rows": rows}
+        except SQLAlchemyError as e:
+            return False, f"Erro ao reconstruir o progresso: {str(e)}"
+
+    @staticmethod
+    def _upsert_counters(session, values):
+        """Soma os contadores ao resumo, criando as linhas que ainda não existem."""
+        upsert(session, StudentQuestionProgress.__table__, values, ProgressRollup._counter_updates)
+
+    @staticmethod
+    def _counter_updates(table, incoming):
+        """Expressões de atualização dos contadores no conflito de chave."""
+        return {
+            "attempts": table.c.attempts + incoming.attempts,
+            "correct_attempts": table.c.correct_attempts + incoming.correct_attempts,
+            "total_time_seconds": table.c.total_time_seconds + incoming.total_time_seconds,
+            "skipped": table.c.skipped | incoming.skipped,
+            "updated_at": func.current_timestamp()
+        }
+
+    @staticmethod
+    def _locked_state(session, pairs):
+        """
+        Lê com leitura bloqueante (a versão mais recente, não o snapshot da transação) as tentativas já somadas
+        e o id da primeira correta antes da mesclagem, por par (aluno, questão).
+        """
+        rows = session.query(
+            StudentQuestionProgress.student_id,
+            StudentQuestionProgress.question_id,
+            StudentQuestionProgress.attempts,
+            StudentQuestionProgress.first_correct_submission_id
+        ).filter(
+            tuple_(StudentQuestionProgress.student_id, StudentQuestionProgress.question_id).in_(pairs)
+        ).with_for_update().all()
+        return {(row.student_id, row.question_id): (row.attempts, row.first_correct_submission_id) for row in rows}
+
+    @staticmethod
+    def _correct_bounds(session, pairs):
+        """Retorna, por par (aluno, questão), a primeira e a última submissão correta (id, horário e tempo gasto da primeira)."""
+        real_correct = (Submission.is_correct == True) & (Submission.submitted_query != SKIP_QUERY)
+        bounds = session.query(
+            Submission.student_id,
+            Submission.question_id,
+            func.min(Submission.id).label('first_id'),
+            func.max(Submission.id).label('last_id')
+        ).filter(
+            real_correct,
+            tuple_(Submission.student_id, Submission.question_id).in_(pairs)
+        ).group_by(Submission.student_id, Submission.question_id).all()
+
+        first_rows = ProgressRollup._submissions_by_id(session, [row.first_id for row in bounds])
+        return [
+            {
+                "p_student_id": row.student_id,
+                "p_question_id": row.question_id,
+                "p_first_id": row.first_id,
+                "p_first_at": first_rows[row.first_id].submitted_at,
+                "p_first_time": first_rows[row.first_id].time_spent_seconds,
+                "p_last_id": row.last_id
+            }
+            for row in bounds
+        ]
+
+    @staticmethod
+    def _merge_correct(session, bounds):
+        """Mescla os limites de acerto no resumo: a primeira correta fica com o menor id e a última com o maior."""
+        if not bounds:
+            return
+        table = StudentQuestionProgress.__table__
+        is_earlier = table.c.first_correct_submission_id.is_(None) | (table.c.first_correct_submission_id > bindparam('p_first_id'))
+        # No MySQL as atribuições do UPDATE enxergam os valores já atualizados, então o id da primeira correta vem por último.
+        stmt = update(table).where(
+            table.c.student_id == bindparam('p_student_id'),
+            table.c.question_id == bindparam('p_question_id')
+        ).ordered_values(
+            (table.c.first_correct_at, case((is_earlier, bindparam('p_first_at')), else_=table.c.first_correct_at)),
+            (table.c.first_correct_time_spent_seconds, case((is_earlier, bindparam('p_first_time')), else_=table.c.first_correct_time_spent_seconds)),
+            (table.c.last_correct_submission_id, case(
+                (table.c.last_correct_submission_id.is_(None) | (table.c.last_correct_submission_id < bindparam('p_last_id')), bindparam('p_last_id')),
+                else_=table.c.last_correct_submission_id
+            )),
+            (table.c.first_correct_submission_id, case((is_earlier, bindparam('p_first_id')), else_=table.c.first_correct_submission_id))
+        )
+        session.execute(stmt, bounds)
+
+    @staticmethod
+    def _submissions_by_id(session, ids):
+        """Busca o horário e o tempo gasto das submissões informadas, indexados por id."""
+        if not ids:
+            return {}
+        rows = session.query(Submission.id, Submission.submitted_at, Submission.time_spent_seconds).filter(Submission.id.in_(ids)).all()
+        return {row.id: row for row in rows}
+
+class QuestionMetricsCube:
+    """
+    Mantém a tabela question_class_metrics, um cubo de métricas por (turma, questão) com o semestre da turma:
+    tentativas, tentativas corretas, tempo total e alunos que tentaram/acertaram, contando as submissões de todos
+    os alunos matriculados na turma. É atualizado junto com o resumo de progresso (somando os deltas das submissões)
+    e com as matrículas, para que as métricas filtradas por turma ou semestre sejam lidas do cubo em vez de
+    varrer submissions com joins em enrollments.
+    """
+
+    @staticmethod
+    def apply(session, deltas):
+        """
+        Soma ao cubo os deltas do resumo por (aluno, questão), em cada turma em que o aluno está matriculado.
+        Cada delta traz attempts, correct_attempts, total_time_seconds, new_student e newly_correct.
+        """
+        student_ids = {student_id for student_id, _ in deltas}
+        classes = {}
+        for student_id, class_id, year_semester in session.query(
+            Enrollment.student_id, Class.id, Class.year_semester
+        ).join(Class, Enrollment.class_id == Class.id).filter(Enrollment.student_id.in_(student_ids)).all():
+            classes.setdefault(student_id, []).append((class_id, year_semester))
+
+        cells = {}
+        for (student_id, question_id), delta in deltas.items():
+            for class_id, year_semester in classes.get(student_id, []):
+                cell = cells.setdefault((class_id, question_id), {
+                    "class_id": class_id,
+                    "question_id": question_id,
+                    "year_semester": year_semester,
+                    "attempts": 0,
+                    "correct_attempts": 0,
+                    "total_time_seconds": 0,
+                    "students_attempted": 0,
+                    "students_correct": 0
+                })
+                cell["attempts"] += delta["attempts"]
+                cell["correct_attempts"] += delta["correct_attempts"]
+                cell["total_time_seconds"] += delta["total_time_seconds"]
+                cell["students_attempted"] += 1 if delta["new_student"] else 0
+                cell["students_correct"] += 1 if delta["newly_correct"] else 0
+        if cells:
+            upsert(session, QuestionClassMetrics.__table__, list(cells.values()), QuestionMetricsCube._counter_updates)
+
+    @staticmethod
+    def remove_student(session, student_id):
+        """
+        Subtrai o resumo de progresso do aluno do cubo de cada turma em que ele está matriculado, antes de excluí-lo
+        (a exclusão apaga em cascata as matrículas e o resumo, mas não as células do cubo). Retorna as turmas afetadas.
+        """
+        class_ids = [row.class_id for row in session.query(Enrollment.class_id).filter(Enrollment.student_id == student_id).all()]
+        for class_id in class_ids:
+            QuestionMetricsCube.add_students(session, class_id, [student_id], sign=-1)
+        return class_ids
+
+    @staticmethod
+    def add_students(session, class_id, student_ids, sign=1):
+        """
+        Soma (sign=1, matrícula) ou subtrai (sign=-1, cancelamento) do cubo da turma o resumo de progresso dos alunos.
+        Deve ser chamado na mesma transação que altera as matrículas.
+        """
+        if not student_ids:
+            return
+        year_semester = session.query(Class.year_semester).filter(Class.id == class_id).scalar()
+        if year_semester is None:
+            return
+        rows = QuestionMetricsCube._aggregate(session).filter(
+            StudentQuestionProgress.student_id.in_(student_ids)
+        ).group_by(StudentQuestionProgress.question_id).all()
+        if rows:
+            upsert(session, QuestionClassMetrics.__table__, [
+                {
+                    "class_id": class_id,
+                    "question_id": row.question_id,
+                    "year_semester": year_semester,
+                    "attempts": sign * int(row.attempts),
+                    "correct_attempts": sign * int(row.correct_attempts),
+                    "total_time_seconds": sign * int(row.total_time_seconds),
+                    "students_attempted": sign * int(row.students_attempted),
+                    "students_correct": sign * int(row.students_correct)
+                }
+                for row in rows
+            ], QuestionMetricsCube._counter_updates)
+
+    @staticmethod
+    def rebuild_question(session, question_id):
+        """Recalcula do zero, a partir do resumo de progresso e das matrículas, o cubo de uma questão."""
+        rows = QuestionMetricsCube._aggregate(session, Enrollment.class_id, Class.year_semester).join(
+            Enrollment, StudentQuestionProgress.student_id == Enrollment.student_id
+        ).join(Class, Enrollment.class_id == Class.id).filter(
+            StudentQuestionProgress.question_id == question_id
+        ).group_by(Enrollment.class_id, Class.year_semester, StudentQuestionProgress.question_id).all()
+
+        session.query(QuestionClassMetrics).filter(QuestionClassMetrics.question_id == question_id).delete(synchronize_session=False)
+        session.bulk_insert_mappings(QuestionClassMetrics, [
+            {
+                "class_id": row.class_id,
+                "question_id": question_id,
+                "year_semester": row.year_semester,
+                "attempts": int(row.attempts),
+                "correct_attempts": int(row.correct_attempts),
+                "total_time_seconds": int(row.total_time_seconds),
+                "students_attempted": int(row.students_attempted),
+                "students_correct": int(row.students_correct)
+            }
+            for row in rows
+        ])
+
+    @staticmethod
+    def _aggregate(session, *columns):
+        """Consulta base que soma as linhas do resumo de progresso no formato das células do cubo."""
+        return session.query(
+            *columns,
+            StudentQuestionProgress.question_id,
+            func.sum(StudentQuestionProgress.attempts).label('attempts'),
+            func.sum(StudentQuestionProgress.correct_attempts).label('correct_attempts'),
+            func.sum(StudentQuestionProgress.total_time_seconds).label('total_time_seconds'),
+            func.count().label('students_attempted'),
+            func.count(StudentQuestionProgress.first_correct_submission_id).label('students_correct')
+        )
+
+    @staticmethod
+    def _counter_updates(table, incoming):
+        """Expressões de atualização das células no conflito de chave."""
+        return {
+            "attempts": table.c.attempts + incoming.attempts,
+            "correct_attempts": table.c.correct_attempts + incoming.correct_attempts,
+            "total_time_seconds": table.c.total_time_seconds + incoming.total_time_seconds,
+            "students_attempted": table.c.students_attempted + incoming.students_attempted,
+            "students_correct": table.c.students_correct + incoming.students_correct,
+            "updated_at": func.current_timestamp()
+        }
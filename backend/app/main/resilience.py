@@ -0,0 +1,138 @@
+import errno
+import os
+import random
+import threading
+import time
+import httpx
+
+TRANSIENT_ERRNOS = {
+    errno.ECONNRESET, errno.ECONNREFUSED, errno.ECONNABORTED, errno.EPIPE,
+    errno.ETIMEDOUT, errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ENETRESET
+}
+TRANSIENT_WINERRORS = {10053, 10054, 10060, 10061}
+
+def is_transient_error(exc):
+    """Indica se a exceção representa uma falha transitória de rede (vale tentar de novo), e não um erro da query."""
+    if isinstance(exc, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    if getattr(exc, 'winerror', None) in TRANSIENT_WINERRORS:
+        return True
+    if isinstance(exc, OSError) and exc.errno in TRANSIENT_ERRNOS:
+        return True
+    return False
+
+def backoff_delay(attempt, base=0.2, cap=2.0):
+    """Calcula a espera antes da próxima tentativa usando backoff exponencial com jitter completo."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+class Deadline:
+    """Orçamento de tempo de uma requisição, compartilhado entre todas as chamadas RPC que ela faz."""
+
+    DEFAULT_BUDGET_SECONDS = float(os.getenv('SCENARIO_REQUEST_DEADLINE_SECONDS', 30))
+
+    def __init__(self, budget=None):
+        self.budget = self.DEFAULT_BUDGET_SECONDS if budget is None else budget
+        self._expires_at = time.monotonic() + self.budget
+
+    def remaining(self):
+        """Retorna os segundos restantes do orçamento (nunca negativo)."""
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def expired(self):
+        """Indica se o orçamento já foi consumido."""
+        return self.remaining() <= 0
+
+class CircuitBreaker:
+    """
+    Disjuntor de um cenário: após falhas transitórias consecutivas abre e passa a falhar rápido,
+    liberando uma única tentativa de teste (half-open) quando o tempo de espera termina.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.total_failures = 0
+        self.total_rejections = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Indica se uma chamada pode ser feita agora."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.total_rejections += 1
+            return False
+
+    def retry_after(self):
+        """Retorna quantos segundos faltam para o disjuntor liberar uma nova tentativa."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+    def record_success(self):
+        """Registra uma chamada bem-sucedida, fechando o disjuntor."""
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Registra uma falha transitória, abrindo o disjuntor ao atingir o limite ou se o teste half-open falhar."""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.total_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self):
+        """Retorna o estado atual do disjuntor."""
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "total_failures": self.total_failures,
+                "total_rejections": self.total_rejections
+            }
+
+class CircuitBreakerRegistry:
+    """Mantém um disjuntor por cenário (slug)."""
+
+    FAILURE_THRESHOLD = int(os.getenv('SCENARIO_BREAKER_FAILURES', 5))
+    RESET_TIMEOUT_SECONDS = float(os.getenv('SCENARIO_BREAKER_RESET_SECONDS', 30))
+
+    _lock = threading.Lock()
+    _breakers = {}
+
+    @staticmethod
+    def get(slug):
+        """Retorna o disjuntor do cenário, criando-o se necessário."""
+        breaker = CircuitBreakerRegistry._breakers.get(slug)
+        if breaker is None:
+            with CircuitBreakerRegistry._lock:
+                breaker = CircuitBreakerRegistry._breakers.setdefault(
+                    slug,
+                    CircuitBreaker(CircuitBreakerRegistry.FAILURE_THRESHOLD, CircuitBreakerRegistry.RESET_TIMEOUT_SECONDS)
+                )
+        return breaker
+
+    @staticmethod
+    def stats():
+        """Retorna o estado de todos os disjuntores."""
+        return {slug: breaker.snapshot() for slug, breaker in list(CircuitBreakerRegistry._breakers.items())}
@@ -1,6 +1,12 @@
 from flask import request, jsonify, Blueprint
 from flask_jwt_extended import get_jwt_identity, get_jwt
-from .services import ScenarioDatabaseService, QuestionService, SubmissionService, SupabaseService, SQLGrader
+from .services import ScenarioDatabaseService, QuestionService, AnswerKeyService, SubmissionService, SupabaseService, SQLGrader, GradingService, GradingTicketService, RegradeService
+from .cache import ExpectedResultCache, QueryResultCache, VerdictCache, CostEstimateCache
+from .grading import ComparisonOffload
+from .scenarios import ScenarioClientRegistry
+from .resilience import CircuitBreakerRegistry
+from .writebehind import SubmissionWriteBehind
+from .admission import AdmissionRegistry
 from app.auth.decorators import role_required
 
 bp = Blueprint('main', __name__)
@@ -13,7 +19,18 @@ def serialize_question(q):
         "statement": q.statement,
         "expected_query": q.expected_query,
         "question_number": q.question_number,
-        "is_special": q.is_special
+        "is_special": q.is_special,
+        "statement_timeout_ms": q.statement_timeout_ms,
+        "answer_key_version": q.answer_key_version
+    }
+
+def serialize_answer_key_version(v):
+    """Converte um objeto AnswerKeyVersion em um dicionário para resposta JSON."""
+    return {
+        "question_id": v.question_id,
+        "version": v.version,
+        "expected_query": v.expected_query,
+        "created_at": v.created_at.isoformat() if v.created_at else None
     }
 
 def serialize_submission(s):
@@ -29,6 +46,55 @@ def serialize_submission(s):
         "timestamp": s.timestamp.isoformat()
     }
 
+def unavailable_response(res, statement):
+    """Monta a resposta 503 para falhas de disponibilidade do banco do cenário, sem registrar submissão."""
+    response = jsonify({'valid': False, 'error': res['error'], 'statement': statement})
+    response.headers['Retry-After'] = str(res.get('retry_after') or 1)
+    return response, 503
+
+def overloaded_response(retry_after, statement=None):
+    """Monta a resposta 429 para quando a fila de correções do cenário está cheia, sem registrar submissão."""
+    body, status, retry_after = validation_payload({'outcome': 'overloaded', 'retry_after': retry_after}, statement)
+    response = jsonify(body)
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status
+
+def validation_response(graded, statement):
+    """Monta a resposta HTTP de uma correção a partir de validation_payload, com o Retry-After quando houver."""
+    body, status, retry_after = validation_payload(graded, statement)
+    response = jsonify(body)
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response, status
+
+def validation_payload(graded, statement):
+    """Converte o desfecho de GradingService.grade_submission no corpo, status HTTP e Retry-After da resposta de /validate."""
+    outcome = graded['outcome']
+    if outcome == 'overloaded':
+        retry_after = graded['retry_after']
+        body = {'valid': False, 'error': f'Muitas correções em andamento neste cenário. Tente novamente em {retry_after} segundo(s).', 'statement': statement}
+        return body, 429, retry_after
+    if outcome == 'unavailable':
+        res = graded['result_table']
+        return {'valid': False, 'error': res['error'], 'statement': statement}, 503, res.get('retry_after') or 1
+    if outcome in ('rejected', 'query_error'):
+        return {'valid': False, 'error': graded['message'], 'statement': statement, 'warning': graded.get('warning')}, 200, None
+    if outcome == 'base_error':
+        return {'valid': False, 'error': f"Erro na base: {graded['message']}", 'statement': statement}, 500, None
+    if outcome == 'save_error':
+        return {'valid': False, 'error': f"Erro ao salvar submissão: {graded['message']}", 'statement': statement}, 500, None
+
+    is_valid, msg = graded['valid'], graded['message']
+    return {
+        'valid': is_valid,
+        'message': msg if is_valid else None,
+        'error': msg if not is_valid else None,
+        'statement': statement,
+        'result_table': graded['result_table'],
+        'expected_table': graded['expected_table'],
+        'warning': graded.get('warning')
+    }, 200, None
+
 def serialize_scenario(s):
     """Converte um objeto ScenarioDatabase em um dicionário para resposta JSON."""
     return {
@@ -58,6 +124,37 @@ def create_scenario():
         return jsonify(serialize_scenario(result)), 201
     return jsonify({"error": result}), 400
 
+@bp.route('/scenarios/connections/stats', methods=['GET'])
+@role_required('admin')
+def scenario_connections_stats():
+    """Retorna as estatísticas do registro de conexões com os bancos de cenário."""
+    stats = ScenarioClientRegistry.stats()
+    stats["circuit_breakers"] = CircuitBreakerRegistry.stats()
+    return jsonify(stats), 200
+
+@bp.route('/scenarios/connections/reload', methods=['POST'])
+@role_required('admin')
+def reload_scenario_connections():
+    """Relê as credenciais dos cenários e descarta os clientes cujas credenciais mudaram."""
+    configured = ScenarioClientRegistry.reload()
+    return jsonify({"configured_scenarios": configured}), 200
+
+@bp.route('/scenarios/admission/stats', methods=['GET'])
+@role_required('admin')
+def scenario_admission_stats():
+    """Retorna, por cenário, as métricas do controle de admissão: correções em andamento, profundidade da fila, tempos de espera e recusas."""
+    return jsonify(AdmissionRegistry.stats()), 200
+
+@bp.route('/scenarios/<slug>/self-test', methods=['POST'])
+@role_required('admin', 'teacher')
+def scenario_self_test(slug):
+    """Executa em paralelo todos os gabaritos do cenário, reportando falhas, número de linhas e latência por questão e atualizando as impressões digitais."""
+    data = request.get_json(silent=True) or {}
+    success, result = AnswerKeyService.self_test(slug, max_workers=data.get('max_workers'))
+    if success:
+        return jsonify(result), 200
+    return jsonify({"error": result}), 404
+
 @bp.route('/scenarios/<slug>', methods=['GET'])
 def get_scenario(slug):
     """Retorna os detalhes de um cenário específico identificado pelo slug."""
@@ -120,9 +217,45 @@ def update_question(question_id):
     data = request.get_json() or {}
     success, result = QuestionService.update_question(question_id, data)
     if success:
-        return jsonify(serialize_question(result)), 200
+        response = serialize_question(result)
+        jobs = RegradeService.list_jobs(question_id)
+        response["regrade_job"] = jobs[0] if jobs and jobs[0]["status"] in ("queued", "running") else None
+        return jsonify(response), 200
     return jsonify({"error": result}), 400
 
+@bp.route('/questions/<int:question_id>/answer-keys', methods=['GET'])
+@role_required('admin', 'teacher')
+def get_answer_key_versions(question_id):
+    """Retorna o histórico de versões do gabarito de uma questão."""
+    success, result = QuestionService.get_answer_key_versions(question_id)
+    if success:
+        return jsonify([serialize_answer_key_version(v) for v in result]), 200
+    return jsonify({"error": result}), 500
+
+@bp.route('/questions/<int:question_id>/regrade', methods=['POST'])
+@role_required('admin', 'teacher')
+def start_regrade(question_id):
+    """Inicia (ou retoma) a recorreção em segundo plano das submissões da questão pela versão atual do gabarito."""
+    success, result = QuestionService.get_question_by_id(question_id)
+    if not success:
+        return jsonify({"error": result}), 404
+    return jsonify(RegradeService.start(question_id)), 202
+
+@bp.route('/questions/<int:question_id>/regrade', methods=['GET'])
+@role_required('admin', 'teacher')
+def list_regrade_jobs(question_id):
+    """Lista os jobs de recorreção da questão, do mais recente para o mais antigo."""
+    return jsonify(RegradeService.list_jobs(question_id)), 200
+
+@bp.route('/regrade/jobs/<job_id>', methods=['GET'])
+@role_required('admin', 'teacher')
+def get_regrade_job(job_id):
+    """Retorna o progresso de um job de recorreção."""
+    success, result = RegradeService.get_job(job_id)
+    if success:
+        return jsonify(result), 200
+    return jsonify({"error": result}), 404
+
 @bp.route('/questions/<int:question_id>', methods=['DELETE'])
 @role_required('admin', 'teacher')
 def delete_question(question_id):
@@ -210,7 +343,6 @@ def validate():
         return jsonify({'valid': False, 'error': 'Questão não encontrada.'}), 404
 
     statement = question_data.statement
-    expected_sql = question_data.expected_query
 
     if not student_sql:
         return jsonify({'valid': False, 'error': 'Sua consulta está em branco.', 'statement': statement}), 400
@@ -219,32 +351,37 @@ def validate():
     if not is_safe:
         return jsonify({'valid': False, 'error': safe_msg, 'statement': statement}), 200
 
-    client = SupabaseService.get_client(slug)
-    if not client:
-        return jsonify({'error': f'Credenciais para o slug {slug} não encontradas.'}), 404
+    with SupabaseService.lease_client(slug) as client:
+        if not client:
+            return jsonify({'error': f'Credenciais para o slug {slug} não encontradas.'}), 404
 
-    stu_res = SupabaseService.execute_query(client, student_sql, max_rows=0)
-    if stu_res.get('error'):
-        SubmissionService.save_submission(student_id, q_id, time_spent, student_sql, False, stu_res['error'])
-        return jsonify({'valid': False, 'error': stu_res['error'], 'statement': statement}), 200
-        
-    base_res = SupabaseService.execute_query(client, expected_sql, max_rows=0)
-    if base_res.get('error'):
-        return jsonify({'valid': False, 'error': f"Erro na base: {base_res['error']}", 'statement': statement}), 500
+        if data.get('async'):
+            accepted, ticket = GradingTicketService.submit(slug, question_data, student_id, student_sql, time_spent)
+            if not accepted:
+                return overloaded_response(ticket, statement)
+            return jsonify({'ticket_id': ticket['id'], 'status': ticket['status'], 'statement': statement}), 202
 
-    is_valid, msg = SQLGrader.compare(expected_sql, student_sql, base_res, stu_res)
-    
-    success_save, save_msg = SubmissionService.save_submission(student_id, q_id, time_spent, student_sql, is_valid, msg)
-    if not success_save:
-        return jsonify({'valid': False, 'error': f"Erro ao salvar submissão: {save_msg}", 'statement': statement}), 500
-    return jsonify({
-        'valid': is_valid,
-        'message': msg if is_valid else None,
-        'error': msg if not is_valid else None,
-        'statement': statement,
-        'result_table': stu_res,
-        'expected_table': base_res
-    }), 200
+        graded = GradingService.grade_submission(client, slug, question_data, student_id, student_sql, time_spent)
+    return validation_response(graded, statement)
+
+@bp.route('/validate/tickets/<ticket_id>', methods=['GET'])
+@role_required('student')
+def get_validation_ticket(ticket_id):
+    """Consulta o ticket de uma correção assíncrona. Com ?wait=N, aguarda até N segundos pelo veredito (long polling)."""
+    student_id = get_jwt().get('user_id')
+    success, ticket = GradingTicketService.get_ticket(ticket_id, student_id, request.args.get('wait', 0, type=float))
+    if not success:
+        return jsonify({'error': ticket}), 404
+
+    response = {'ticket_id': ticket['id'], 'status': ticket['status'], 'question_id': ticket['question_id']}
+    if ticket['graded'] is not None:
+        success_q, question_data = QuestionService.get_question_by_id(ticket['question_id'])
+        statement = question_data.statement if success_q else None
+        body, status, retry_after = validation_payload(ticket['graded'], statement)
+        response['result'] = body
+        response['result_status'] = status
+        response['retry_after'] = retry_after
+    return jsonify(response), 200
 
 @bp.route('/validate/skip', methods=['POST'])
 @role_required('student')
@@ -276,7 +413,6 @@ def validate_testing():
         return jsonify({'valid': False, 'error': 'Questão não encontrada.'}), 404
 
     statement = question_data.statement
-    expected_sql = question_data.expected_query
 
     if not testing_sql:
         return jsonify({'valid': False, 'error': 'Sua consulta está em branco.', 'statement': statement}), 400
@@ -285,24 +421,74 @@ def validate_testing():
     if not is_safe:
         return jsonify({'valid': False, 'error': safe_msg, 'statement': statement}), 200
 
-    client = SupabaseService.get_client(slug)
-    if not client:
-        return jsonify({'error': f'Credenciais para o slug {slug} não encontradas.'}), 404
+    with SupabaseService.lease_client(slug) as client:
+        if not client:
+            return jsonify({'error': f'Credenciais para o slug {slug} não encontradas.'}), 404
+        claims = get_jwt()
+        admitted, graded = AdmissionRegistry.run(
+            slug, AdmissionRegistry.key(claims.get('role'), claims.get('user_id')),
+            lambda: GradingService.grade(client, slug, question_data, testing_sql, include_expected=True)
+        )
+    if not admitted:
+        return overloaded_response(graded, statement)
+    return validation_response(graded, statement)
+
+@bp.route('/validate/testing/batch', methods=['POST'])
+@role_required('teacher', 'admin')
+def validate_testing_batch():
+    """Valida um lote de consultas candidatas para uma questão, executando o gabarito uma única vez e retornando a matriz de vereditos com os tempos de cada consulta."""
+    data = request.get_json() or {}
+    slug = data.get('slug')
+    q_id = data.get('question_id')
+    candidates = data.get('candidates')
 
-    testing_res = SupabaseService.execute_query(client, testing_sql, max_rows=0)
-    if testing_res.get('error'):
-        return jsonify({'valid': False, 'error': testing_res['error'], 'statement': statement}), 200      
-    base_res = SupabaseService.execute_query(client, expected_sql, max_rows=0)
-    if base_res.get('error'):
-        return jsonify({'valid': False, 'error': f"Erro na base: {base_res['error']}", 'statement': statement}), 500
+    if not all([slug, q_id]):
+        return jsonify({'error': 'Parâmetros slug e question_id são obrigatórios.'}), 400
+    if not isinstance(candidates, list) or not candidates or not all(isinstance(c, str) for c in candidates):
+        return jsonify({'error': 'O parâmetro candidates deve ser uma lista não vazia de consultas.'}), 400
+    if len(candidates) > GradingService.MAX_BATCH_CANDIDATES:
+        return jsonify({'error': f'No máximo {GradingService.MAX_BATCH_CANDIDATES} consultas por lote.'}), 400
 
-    is_valid, msg = SQLGrader.compare(expected_sql, testing_sql, base_res, testing_res)
-    
-    return jsonify({
-        'valid': is_valid,
-        'message': msg if is_valid else None,
-        'error': msg if not is_valid else None,
-        'statement': statement,
-        'result_table': testing_res,
-        'expected_table': base_res
-    }), 200
\ No newline at end of file
+    success_q, question_data = QuestionService.get_question_by_id(q_id)
+    if not success_q:
+        return jsonify({'error': 'Questão não encontrada.'}), 404
+
+    with SupabaseService.lease_client(slug) as client:
+        if not client:
+            return jsonify({'error': f'Credenciais para o slug {slug} não encontradas.'}), 404
+        claims = get_jwt()
+        success, result = GradingService.grade_batch(
+            client, slug, question_data, candidates, AdmissionRegistry.key(claims.get('role'), claims.get('user_id'))
+        )
+    if not success:
+        if result.get('overloaded'):
+            return overloaded_response(result['retry_after'], question_data.statement)
+        if result.get('retryable'):
+            return unavailable_response(result, question_data.statement)
+        return jsonify({'error': f"Erro na base: {result['error']}", 'statement': question_data.statement}), 500
+
+    result['statement'] = question_data.statement
+    return jsonify(result), 200
+
+@bp.route('/validate/cache/stats', methods=['GET'])
+@role_required('admin')
+def expected_cache_stats():
+    """Retorna as estatísticas de acerto/falha dos caches de gabaritos, de execuções, de vereditos e de estimativas de custo, e das comparações fora do processo."""
+    stats = ExpectedResultCache.stats()
+    stats["query_results"] = QueryResultCache.stats()
+    stats["verdicts"] = VerdictCache.stats()
+    stats["cost_estimates"] = CostEstimateCache.stats()
+    stats["comparisons"] = ComparisonOffload.stats()
+    return jsonify(stats), 200
+
+@bp.route('/submissions/write-behind/stats', methods=['GET'])
+@role_required('admin')
+def submission_write_behind_stats():
+    """Retorna o estado da fila write-behind de submissões: pendentes, lotes gravados, falhas e recuperações do spill."""
+    return jsonify(SubmissionWriteBehind.stats()), 200
+
+@bp.route('/validate/tickets/stats', methods=['GET'])
+@role_required('admin')
+def validation_ticket_stats():
+    """Retorna a quantidade de tickets de correção assíncrona por estado, os tickets em aberto e as recusas por fila cheia."""
+    return jsonify(GradingTicketService.stats()), 200
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from dotenv import dotenv_values
+from supabase import create_client
+from supabase.lib.client_options import SyncClientOptions
+from app.main.executors import SupabaseExecutor, EMBEDDED_EXECUTORS
+
+SCENARIO_ENV_PREFIXES = ('SUPABASE_URL_', 'SUPABASE_KEY_', 'SCENARIO_BACKEND_', 'SCENARIO_DB_PATH_')
+
+class ScenarioClientRegistry:
+    """
+    Registro, por processo, das conexões com os bancos de cenário.
+    Carrega a configuração uma única vez e mantém um executor (ScenarioExecutor) aquecido por cenário.
+    Por padrão o backend é o Supabase (SUPABASE_URL_*/SUPABASE_KEY_*), com um pool HTTP próprio por cenário;
+    SCENARIO_BACKEND_<SUFIXO>=sqlite|duckdb com SCENARIO_DB_PATH_<SUFIXO> executa o cenário localmente.
+    Os executores são usados por empréstimo (lease): um executor substituído no reload só é fechado quando
+    o último empréstimo em andamento é devolvido.
+    """
+
+    MAX_CONNECTIONS = int(os.getenv('SCENARIO_POOL_MAX_CONNECTIONS', 10))
+    MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('SCENARIO_POOL_MAX_KEEPALIVE', 5))
+    KEEPALIVE_EXPIRY_SECONDS = float(os.getenv('SCENARIO_POOL_KEEPALIVE_EXPIRY_SECONDS', 60))
+    TIMEOUT_SECONDS = float(os.getenv('SCENARIO_QUERY_TIMEOUT_SECONDS', 120))
+
+    _lock = threading.Lock()
+    _config = None
+    _entries = {}
+
+    @staticmethod
+    def suffix(slug):
+        """Converte o slug no sufixo usado nas variáveis de ambiente (ex.: recursos-humanos -> RECURSOS_HUMANOS)."""
+        return slug.upper().replace('-', '_')
+
+    @staticmethod
+    @contextmanager
+    def lease(slug):
+        """
+        Empresta o executor aquecido do cenário (criado na primeira utilização) durante o bloco with,
+        ou None se o cenário não estiver configurado.
+        """
+        entry = ScenarioClientRegistry._acquire(slug)
+        try:
+            yield entry["executor"] if entry else None
+        finally:
+            if entry:
+                ScenarioClientRegistry._release(entry)
+
+    @staticmethod
+    def reload(slug=None):
+        """
+        Relê do .env apenas as variáveis dos cenários (as demais, como as credenciais do TiDB e o segredo do JWT,
+        não são tocadas), trocando os executores cuja configuração mudou ou foi removida.
+        Com slug informado, apenas esse cenário é reavaliado.
+        """
+        for name, value in dotenv_values().items():
+            if value is not None and name.startswith(SCENARIO_ENV_PREFIXES):
+                os.environ[name] = value
+        retired = []
+        with ScenarioClientRegistry._lock:
+            ScenarioClientRegistry._config = ScenarioClientRegistry._load_config()
+            suffixes = [ScenarioClientRegistry.suffix(slug)] if slug else list(ScenarioClientRegistry._entries)
+            for suffix in suffixes:
+                entry = ScenarioClientRegistry._entries.get(suffix)
+                if entry and entry["settings"] != ScenarioClientRegistry._config.get(suffix):
+                    del ScenarioClientRegistry._entries[suffix]
+                    entry["retired"] = True
+                    if entry["leases"] == 0:
+                        retired.append(entry)
+            configured = sorted(ScenarioClientRegistry._config)
+        for entry in retired:
+            entry["executor"].close()
+        return configured
+
+    @staticmethod
+    def stats():
+        """Retorna as estatísticas do registro: cenários configurados, executores aquecidos e uso de cada um."""
+        with ScenarioClientRegistry._lock:
+            configured = sorted(ScenarioClientRegistry._get_config())
+            clients = {
+                suffix: {
+                    "backend": entry["executor"].backend,
+                    "created_at": entry["created_at"],
+                    "last_used_at": entry["last_used_at"],
+                    "acquisitions": entry["acquisitions"],
+                    "in_use": entry["leases"]
+                }
+                for suffix, entry in ScenarioClientRegistry._entries.items()
+            }
+        return {
+            "configured_scenarios": configured,
+            "warm_clients": clients,
+            "pool_limits": {
+                "max_connections": ScenarioClientRegistry.MAX_CONNECTIONS,
+                "max_keepalive_connections": ScenarioClientRegistry.MAX_KEEPALIVE_CONNECTIONS,
+                "keepalive_expiry_seconds": ScenarioClientRegistry.KEEPALIVE_EXPIRY_SECONDS,
+                "timeout_seconds": ScenarioClientRegistry.TIMEOUT_SECONDS
+            }
+        }
+
+    @staticmethod
+    def _acquire(slug):
+        """Retorna a entrada do cenário com um empréstimo a mais, criando-a se necessário, ou None se não configurado."""
+        suffix = ScenarioClientRegistry.suffix(slug)
+        with ScenarioClientRegistry._lock:
+            entry = ScenarioClientRegistry._entries.get(suffix)
+            if entry is None:
+                settings = ScenarioClientRegistry._get_config().get(suffix)
+                if not settings:
+                    return None
+                entry = ScenarioClientRegistry._create_entry(settings)
+                ScenarioClientRegistry._entries[suffix] = entry
+            entry["leases"] += 1
+            entry["acquisitions"] += 1
+            entry["last_used_at"] = time.time()
+            return entry
+
+    @staticmethod
+    def _release(entry):
+        """Devolve um empréstimo, fechando o executor substituído quando o último usuário o libera."""
+        with ScenarioClientRegistry._lock:
+            entry["leases"] -= 1
+            close = entry["retired"] and entry["leases"] == 0
+        if close:
+            entry["executor"].close()
+
+    @staticmethod
+    def _get_config():
+        """Retorna as credenciais carregadas, lendo as variáveis de ambiente apenas na primeira chamada."""
+        if ScenarioClientRegistry._config is None:
+            ScenarioClientRegistry._config = ScenarioClientRegistry._load_config()
+        return ScenarioClientRegistry._config
+
+    @staticmethod
+    def _load_config():
+        """
+        Monta o mapa sufixo -> configuração a partir das variáveis de ambiente:
+        SUPABASE_URL_*/SUPABASE_KEY_* para o backend remoto e SCENARIO_BACKEND_*/SCENARIO_DB_PATH_* para os locais.
+        """
+        config = {}
+        for name, url in os.environ.items():
+            if not name.startswith('SUPABASE_URL_'):
+                continue
+            suffix = name[len('SUPABASE_URL_'):]
+            key = os.getenv(f"SUPABASE_KEY_{suffix}")
+            if url and key:
+                config[suffix] = {"backend": "supabase", "url": url, "key": key}
+
+        for name, backend in os.environ.items():
+            if not name.startswith('SCENARIO_BACKEND_'):
+                continue
+            suffix = name[len('SCENARIO_BACKEND_'):]
+            backend = backend.strip().lower()
+            path = os.getenv(f"SCENARIO_DB_PATH_{suffix}")
+            if backend in EMBEDDED_EXECUTORS and path:
+                config[suffix] = {"backend": backend, "path": path}
+        return config
+
+    @staticmethod
+    def _create_entry(settings):
+        """Cria o executor do cenário conforme o backend configurado."""
+        if settings["backend"] == "supabase":
+            executor = ScenarioClientRegistry._create_supabase_executor(settings["url"], settings["key"])
+        else:
+            executor = EMBEDDED_EXECUTORS[settings["backend"]](settings["path"])
+
+        now = time.time()
+        return {
+            "executor": executor,
+            "settings": settings,
+            "created_at": now,
+            "last_used_at": now,
+            "acquisitions": 0,
+            "leases": 0,
+            "retired": False
+        }
+
+    @staticmethod
+    def _create_supabase_executor(url, key):
+        """Cria o cliente do Supabase com um pool HTTP próprio e limitado."""
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=ScenarioClientRegistry.MAX_CONNECTIONS,
+                max_keepalive_connections=ScenarioClientRegistry.MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=ScenarioClientRegistry.KEEPALIVE_EXPIRY_SECONDS
+            ),
+            timeout=ScenarioClientRegistry.TIMEOUT_SECONDS
+        )
+        client = create_client(url, key, options=SyncClientOptions(httpx_client=http_client))
+        return SupabaseExecutor(client, http_client)
@@ -1,12 +1,28 @@
+import base64
 import json
+import math
 import os
 import time
-import re
-import pandas as pd # type: ignore
-from supabase import create_client
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sqlalchemy import func, or_
 from sqlalchemy.exc import SQLAlchemyError
 from app.database import Session
-from app.database.models import ScenarioDatabase, Question, Submission
+from app.database.models import ScenarioDatabase, Question, Submission, AnswerKeyFingerprint, AnswerKeyVersion, StudentQuestionProgress, QuestionClassMetrics
+from app.main.grading import ResultComparator, ComparisonOffload
+from app.main.cache import ExpectedResultCache, QueryResultCache, VerdictCache, sql_hash, invalidate_question_caches, invalidate_scenario_caches
+from app.main.sqltext import canonicalize_sql, check_query_safety
+from app.main.costguard import QueryCostGuard
+from app.main.scenarios import ScenarioClientRegistry
+from app.main.executors import ScenarioQueryError
+from app.main.writebehind import SubmissionWriteBehind
+from app.main.progress import ProgressRollup
+from app.reports.cache import ReportCache
+from app.main.resilience import CircuitBreakerRegistry, Deadline, backoff_delay, is_transient_error
+from app.main.admission import AdmissionRegistry
 
 class ScenarioDatabaseService:
     """Gerencia a recuperação dos bancos de dados de cenário."""
@@ -49,6 +65,9 @@ class ScenarioDatabaseService:
                 session.commit()
                 session.refresh(scenario)
                 session.expunge(scenario)
+                ScenarioClientRegistry.reload(scenario.slug)
+                # Relatórios sem filtro dependem das etiquetas de todos os cenários: passam a depender também deste.
+                ReportCache.invalidate(scenario_id=scenario.id)
                 return True, scenario
         except SQLAlchemyError as e:
             return False, f"Erro ao criar banco de dados: {str(e)}"
@@ -62,8 +81,11 @@ class ScenarioDatabaseService:
                 if not scenario:
                     return False, "Banco de dados não encontrado."
                 
+                slug = scenario.slug
                 session.delete(scenario)
                 session.commit()
+                invalidate_scenario_caches(slug)
+                ReportCache.invalidate(scenario_id=int(scenario_id))
                 return True, "Banco de dados deletado com sucesso."
         except SQLAlchemyError as e:
             return False, f"Erro ao deletar banco de dados: {str(e)}"
@@ -77,6 +99,7 @@ class ScenarioDatabaseService:
                 if not scenario:
                     return False, "Banco de dados não encontrado."
                 
+                old_slug = scenario.slug
                 if 'name' in data: scenario.name = data['name']
                 if 'slug' in data: scenario.slug = data['slug']
                 if 'diagram_url' in data: scenario.diagram_url = data['diagram_url']
@@ -84,6 +107,8 @@ class ScenarioDatabaseService:
                 session.commit()
                 session.refresh(scenario)
                 session.expunge(scenario)
+                invalidate_scenario_caches(old_slug)
+                invalidate_scenario_caches(scenario.slug)
                 return True, scenario
         except SQLAlchemyError as e:
             return False, f"Erro ao atualizar banco de dados: {str(e)}"
@@ -101,16 +126,22 @@ class QuestionService:
                     statement=data.get('statement'),
                     expected_query=data.get('expected_query'),
                     question_number=data.get('question_number'),
-                    is_special=data.get('is_special', False)
+                    is_special=data.get('is_special', False),
+                    statement_timeout_ms=data.get('statement_timeout_ms'),
+                    answer_key_version=1
                 )
                 session.add(question)
+                session.flush()
+                session.add(AnswerKeyVersion(question_id=question.id, version=1, expected_query=question.expected_query))
                 session.commit()
                 session.refresh(question)
                 session.expunge(question)
-                return True, question
         except SQLAlchemyError as e:
             return False, f"Erro ao criar questão: {str(e)}"
 
+        AnswerKeyService.refresh_fingerprint(question)
+        return True, question
+
     @staticmethod
     def get_all_questions():
         """Retorna a lista de todas as questões disponíveis, com tratamento de erros e gerenciamento de sessão adequado."""
@@ -176,26 +207,70 @@ class QuestionService:
 
     @staticmethod
     def update_question(question_id, data):
-        """Atualiza os detalhes de uma questão específica identificada pelo ID, modificando as informações no banco de dados e retornando o resultado da operação, incluindo a exclusão de submissões associadas à questão para garantir a integridade dos dados."""
+        """
+        Atualiza os detalhes de uma questão específica identificada pelo ID. As submissões são preservadas:
+        quando a expected_query muda, uma nova versão do gabarito é registrada e as submissões são recorrigidas em segundo plano.
+        """
         try:
             with Session() as session:
                 question = session.query(Question).filter_by(id=question_id).first()
                 if not question:
                     return False, "Questão não encontrada."
-                
+
+                key_changed = 'expected_query' in data and data['expected_query'] != question.expected_query
+                if key_changed:
+                    QuestionService._bump_answer_key_version(session, question, data['expected_query'])
+
                 if 'statement' in data: question.statement = data['statement']
-                if 'expected_query' in data: question.expected_query = data['expected_query']
                 if 'question_number' in data: question.question_number = data['question_number']
                 if 'is_special' in data: question.is_special = data['is_special']
+                if 'statement_timeout_ms' in data: question.statement_timeout_ms = data['statement_timeout_ms']
                 
-                session.query(Submission).filter_by(question_id=question_id).delete()
                 session.commit()
                 session.refresh(question)
                 session.expunge(question)
-                
-                return True, question
+                invalidate_question_caches(question_id)
         except SQLAlchemyError as e:
             return False, f"Erro ao atualizar questão: {str(e)}"
+
+        if key_changed:
+            AnswerKeyService.refresh_fingerprint(question)
+            RegradeService.start(question.id)
+        return True, question
+
+    @staticmethod
+    def get_scenario_slug(question):
+        """Retorna o slug do cenário ao qual a questão pertence."""
+        try:
+            with Session() as session:
+                scenario = session.query(ScenarioDatabase).filter_by(id=question.scenario_database_id).first()
+                if scenario:
+                    return True, scenario.slug
+                return False, "Cenário da questão não encontrado."
+        except SQLAlchemyError as e:
+            return False, f"Erro ao buscar cenário da questão: {str(e)}"
+
+    @staticmethod
+    def _bump_answer_key_version(session, question, expected_query):
+        """Registra a nova expected_query como a próxima versão do gabarito, guardando também a versão atual se ela ainda não estiver no histórico."""
+        current = question.answer_key_version or 1
+        if not session.query(AnswerKeyVersion.id).filter_by(question_id=question.id, version=current).first():
+            session.add(AnswerKeyVersion(question_id=question.id, version=current, expected_query=question.expected_query))
+
+        question.expected_query = expected_query
+        question.answer_key_version = current + 1
+        session.add(AnswerKeyVersion(question_id=question.id, version=question.answer_key_version, expected_query=expected_query))
+
+    @staticmethod
+    def get_answer_key_versions(question_id):
+        """Retorna o histórico de versões do gabarito de uma questão, da mais recente para a mais antiga."""
+        try:
+            with Session() as session:
+                versions = session.query(AnswerKeyVersion).filter_by(question_id=question_id).order_by(AnswerKeyVersion.version.desc()).all()
+                session.expunge_all()
+                return True, versions
+        except SQLAlchemyError as e:
+            return False, f"Erro ao buscar versões do gabarito: {str(e)}"
     
     @staticmethod
     def delete_question(question_id):
@@ -207,37 +282,207 @@ class QuestionService:
                     return False, "Questão não encontrada."
                 
                 session.query(Submission).filter_by(question_id=question_id).delete()
+                session.query(StudentQuestionProgress).filter_by(question_id=question_id).delete()
+                session.query(QuestionClassMetrics).filter_by(question_id=question_id).delete()
                 session.delete(question)
                 session.commit()
+                invalidate_question_caches(question_id)
+                ReportCache.invalidate(question_id=int(question_id))
                 return True, "Questão e submissões deletadas com sucesso."
         except SQLAlchemyError as e:
             return False, f"Erro ao deletar questão: {str(e)}"
 
+class AnswerKeyService:
+    """Gerencia as impressões digitais (fingerprints) dos gabaritos, usadas para validar respostas corretas sem reexecutar a query esperada."""
+
+    SELF_TEST_WORKERS = int(os.getenv('ANSWER_KEY_SELF_TEST_WORKERS', 4))
+
+    @staticmethod
+    def refresh_fingerprint(question):
+        """Executa a query esperada da questão uma vez e persiste a sua impressão digital canônica."""
+        success, slug = QuestionService.get_scenario_slug(question)
+        if not success:
+            return False, slug
+
+        with SupabaseService.lease_client(slug) as client:
+            if not client:
+                return False, f"Credenciais para o slug {slug} não encontradas."
+            base_res = SupabaseService.execute_expected_query(client, slug, question)
+
+        if base_res.get('error'):
+            print(f"Falha ao gerar fingerprint da questão {question.id}: {base_res['error']}")
+            return False, base_res['error']
+
+        return AnswerKeyService.save_fingerprint(question, ResultComparator.fingerprint(question.expected_query, base_res['data']))
+
+    @staticmethod
+    def save_fingerprint(question, fingerprint):
+        """Persiste (insere ou atualiza) a impressão digital do gabarito de uma questão."""
+        try:
+            with Session() as session:
+                record = session.get(AnswerKeyFingerprint, question.id) or AnswerKeyFingerprint(question_id=question.id)
+                record.expected_query_hash = sql_hash(question.expected_query)
+                record.row_count = fingerprint['row_count']
+                record.columns = json.dumps(fingerprint['columns'])
+                record.order_sensitive = fingerprint['order_sensitive']
+                record.row_digests = base64.b64encode(fingerprint['row_digests'].astype('<u8').tobytes()).decode('ascii')
+                record.result_digest = fingerprint['result_digest']
+                record.computed_at = func.now()
+                session.add(record)
+                session.commit()
+                return True, fingerprint
+        except SQLAlchemyError as e:
+            return False, f"Erro ao salvar fingerprint da questão: {str(e)}"
+
+    @staticmethod
+    def get_fingerprint(question, with_row_digests=False):
+        """Retorna a impressão digital do gabarito da questão, desde que ela corresponda à expected_query atual."""
+        try:
+            with Session() as session:
+                fields = [
+                    AnswerKeyFingerprint.expected_query_hash,
+                    AnswerKeyFingerprint.row_count,
+                    AnswerKeyFingerprint.columns,
+                    AnswerKeyFingerprint.order_sensitive,
+                    AnswerKeyFingerprint.result_digest
+                ]
+                if with_row_digests:
+                    fields.append(AnswerKeyFingerprint.row_digests)
+
+                record = session.query(*fields).filter(AnswerKeyFingerprint.question_id == question.id).first()
+                if not record or record.expected_query_hash != sql_hash(question.expected_query):
+                    return False, "Fingerprint do gabarito indisponível."
+
+                fingerprint = {
+                    "row_count": record.row_count,
+                    "columns": json.loads(record.columns),
+                    "order_sensitive": bool(record.order_sensitive),
+                    "result_digest": record.result_digest
+                }
+                if with_row_digests:
+                    raw = base64.b64decode(record.row_digests or '')
+                    fingerprint["row_digests"] = np.frombuffer(raw, dtype='<u8').astype(np.uint64)
+                return True, fingerprint
+        except SQLAlchemyError as e:
+            return False, f"Erro ao buscar fingerprint: {str(e)}"
+
+    @staticmethod
+    def self_test(slug, max_workers=None):
+        """
+        Executa todos os gabaritos de um cenário em paralelo (com paralelismo limitado), sem usar resultados em cache,
+        reportando falhas, número de linhas, latência e alertas por questão. Atualiza as impressões digitais como efeito colateral.
+        """
+        success, scenario = ScenarioDatabaseService.get_scenario_by_slug(slug)
+        if not success:
+            return False, scenario
+
+        success, questions = QuestionService.get_questions_by_scenario(scenario.id)
+        if not success:
+            return False, questions
+
+        with SupabaseService.lease_client(slug) as client:
+            if not client:
+                return False, f"Credenciais para o slug {slug} não encontradas."
+
+            # O objetivo é validar o estado atual do banco do cenário: descarta resultados e vereditos em cache.
+            invalidate_scenario_caches(slug)
+
+            started = time.perf_counter()
+            workers = max(1, min(max_workers or AnswerKeyService.SELF_TEST_WORKERS, len(questions) or 1))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(lambda q: AnswerKeyService._self_test_question(client, slug, q), questions))
+        results.sort(key=lambda r: (r['question_number'] is None, r['question_number'], r['question_id']))
+
+        return True, {
+            "slug": slug,
+            "total": len(results),
+            "passed": sum(1 for r in results if r['ok']),
+            "failed": sum(1 for r in results if not r['ok']),
+            "with_warnings": sum(1 for r in results if r['warnings']),
+            "workers": workers,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            "results": results
+        }
+
+    @staticmethod
+    def _self_test_question(client, slug, question):
+        """Executa o gabarito de uma questão, compara com a impressão digital anterior e a atualiza."""
+        _, previous = AnswerKeyService.get_fingerprint(question)
+        started = time.perf_counter()
+        base_res = SupabaseService.execute_expected_query(client, slug, question, Deadline())
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        report = {
+            "question_id": question.id,
+            "question_number": question.question_number,
+            "ok": not base_res.get('error'),
+            "error": base_res.get('error'),
+            "row_count": None,
+            "columns": None,
+            "elapsed_ms": elapsed_ms,
+            "warnings": [],
+            "fingerprint_refreshed": False
+        }
+        if base_res.get('error'):
+            return report
+
+        data = base_res['data']
+        report["row_count"] = data['total']
+        report["columns"] = list(data['columns'])
+        if data['total'] == 0:
+            report["warnings"].append("O gabarito não retornou linhas.")
+        if len(set(data['columns'])) != len(data['columns']):
+            report["warnings"].append("O gabarito retorna colunas com nomes repetidos.")
+        if isinstance(previous, dict):
+            if previous['row_count'] != data['total']:
+                report["warnings"].append(f"O número de linhas mudou: {previous['row_count']} -> {data['total']}.")
+            elif previous['columns'] != list(data['columns']):
+                report["warnings"].append("As colunas do resultado mudaram.")
+
+        saved, _ = AnswerKeyService.save_fingerprint(question, ResultComparator.fingerprint(question.expected_query, data))
+        report["fingerprint_refreshed"] = saved
+        return report
+
 class SubmissionService:
     """Gerencia as submissões dos alunos e verifica progresso."""
     
     @staticmethod
-    def save_submission(student_id, question_id, time_spent, submitted_query, is_correct, output):
-        """Salva uma submissão de um aluno para uma questão específica, registrando o tempo gasto, a query submetida, se a resposta está correta e o output da execução, com tratamento de erros e gerenciamento de sessão adequado."""
+    def save_submission(student_id, question_id, time_spent, submitted_query, is_correct, output, answer_key_version=None):
+        """
+        Salva uma submissão de um aluno para uma questão específica, registrando o tempo gasto, a query submetida, se a resposta está correta e o output da execução.
+        Com a gravação write-behind habilitada, a submissão é anotada no spill local e gravada em lote pela SubmissionWriteBehind.
+        """
         try:
+            row = {
+                "student_id": int(student_id),
+                "question_id": int(question_id),
+                "time_spent_seconds": int(time_spent) if time_spent else 0,
+                "submitted_query": str(submitted_query),
+                "is_correct": bool(is_correct),
+                "execution_output": json.dumps(output) if output else None,
+                "answer_key_version": answer_key_version
+            }
+            if SubmissionWriteBehind.ENABLED:
+                SubmissionWriteBehind.enqueue(row)
+                return True, "Submissão salva com sucesso."
+
             with Session() as session:
-                submission = Submission(
-                    student_id=int(student_id),
-                    question_id=int(question_id),
-                    time_spent_seconds=int(time_spent) if time_spent else 0,
-                    submitted_query=str(submitted_query),
-                    is_correct=bool(is_correct),
-                    execution_output=json.dumps(output) if output else None
-                )
+                submission = Submission(**row)
                 session.add(submission)
+                session.flush()
+                ProgressRollup.apply(session, [row])
                 session.commit()
-                return True, "Submissão salva com sucesso."
+            ReportCache.invalidate_submissions([(row["student_id"], row["question_id"])])
+            return True, "Submissão salva com sucesso."
         except Exception as e:
             return False, f"Erro ao salvar: {str(e)}"
     
     @staticmethod
     def check_special_completion(student_id, scenario_id):
         """Verifica se o aluno completou as 10 questões especiais do cenário."""
+        # Garante que as submissões ainda na fila write-behind deste processo entrem na contagem; as aceitas por
+        # outros workers entram quando a fila deles for gravada (ver SubmissionWriteBehind).
+        SubmissionWriteBehind.flush()
         try:
             with Session() as session:
                 special_questions = session.query(Question).filter_by(
@@ -249,11 +494,11 @@ class SubmissionService:
                 if not special_ids:
                     return False, "Nenhuma questão especial encontrada para este cenário."
 
-                completed_count = session.query(Submission).filter(
-                    Submission.student_id == student_id,
-                    Submission.question_id.in_(special_ids),
-                    Submission.is_correct == True
-                ).distinct(Submission.question_id).count()
+                completed_count = session.query(func.count()).select_from(StudentQuestionProgress).filter(
+                    StudentQuestionProgress.student_id == student_id,
+                    StudentQuestionProgress.question_id.in_(special_ids),
+                    ProgressRollup.completed()
+                ).scalar()
 
                 return completed_count >= 10, completed_count
         except SQLAlchemyError as e:
@@ -264,17 +509,20 @@ class SubmissionService:
         """Salva uma desistência como 'correta' para liberar o progresso, mas com query marcada."""
         try:
             with Session() as session:
-                submission = Submission(
-                    student_id=student_id,
-                    question_id=question_id,
-                    time_spent_seconds=0,
-                    submitted_query="SKIP",
-                    is_correct=True,
-                    execution_output=json.dumps({"msg": "Pulou"})
-                )
-                session.add(submission)
+                row = {
+                    "student_id": int(student_id),
+                    "question_id": int(question_id),
+                    "time_spent_seconds": 0,
+                    "submitted_query": "SKIP",
+                    "is_correct": True,
+                    "execution_output": json.dumps({"msg": "Pulou"})
+                }
+                session.add(Submission(**row))
+                session.flush()
+                ProgressRollup.apply(session, [row])
                 session.commit()
-                return True, "Sucesso."
+            ReportCache.invalidate_submissions([(row["student_id"], row["question_id"])])
+            return True, "Sucesso."
         except SQLAlchemyError as e:
             session.rollback()
             return False, str(e)
@@ -282,175 +530,724 @@ class SubmissionService:
 class SupabaseService:
     """Gerencia conexoes e execução de queries RPC no Supabase."""
 
+    MAX_RESULT_ROWS = int(os.getenv('SCENARIO_MAX_RESULT_ROWS', 5000))
+    STATEMENT_TIMEOUT_MS = int(os.getenv('SCENARIO_STATEMENT_TIMEOUT_MS', 5000))
+    DEADLINE_GRACE_SECONDS = 1.0
+
+    _executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv('SCENARIO_QUERY_WORKERS', 16)),
+        thread_name_prefix='scenario-query'
+    )
+
     @staticmethod
-    def get_client(slug):
-        """Cria um cliente do Supabase para um cenário específico identificado pelo slug, utilizando as variáveis de ambiente para obter as credenciais necessárias, e retornando o cliente ou None se as credenciais não estiverem disponíveis."""
-        suffix = slug.upper().replace('-', '_')
-        url = os.getenv(f"SUPABASE_URL_{suffix}")
-        key = os.getenv(f"SUPABASE_KEY_{suffix}")
-        if not url or not key:
-            return None
-        return create_client(url, key)
+    def submit(fn, *args, **kwargs):
+        """Agenda uma execução no pool limitado de threads de queries de cenário, retornando um Future."""
+        return SupabaseService._executor.submit(fn, *args, **kwargs)
+
+    @staticmethod
+    def lease_client(slug):
+        """
+        Empresta o executor aquecido (Supabase ou local) do cenário identificado pelo slug, para uso num bloco with;
+        o valor emprestado é None se o cenário não estiver configurado.
+        """
+        return ScenarioClientRegistry.lease(slug)
     
     @staticmethod
-    def execute_query(client, sql: str, max_rows: int = 20, retries: int = 3, backoff: float = 1.0):
-        """Executa a query via RCP com logica de retry e tratamento de erros."""
+    def execute_query(client, sql: str, max_rows: int = 20, retries: int = 3, backoff: float = 0.2, slug=None, deadline=None, row_limit=None, timeout_ms=None):
+        """
+        Executa a query no executor do cenário (RPC do Supabase ou backend local) com retry apenas para falhas transitórias de rede (backoff exponencial com jitter),
+        disjuntor por cenário (quando o slug é informado) e orçamento de tempo compartilhado pela requisição.
+        Falhas de disponibilidade retornam 'retryable': True.
+        Com row_limit, o teto de linhas é aplicado no próprio banco (LIMIT row_limit + 1); se ele for excedido,
+        apenas as primeiras linhas são trazidas, o total real vem de um COUNT e o resultado é marcado como 'truncated'.
+        Toda chamada leva um statement timeout (timeout_ms ou STATEMENT_TIMEOUT_MS), limitado ao que resta do orçamento da requisição,
+        e a própria chamada HTTP é abortada quando o orçamento acaba (mais DEADLINE_GRACE_SECONDS, para o erro do banco chegar antes).
+        """
         sql = sql.strip().rstrip(';')
+        rpc_query = f"SELECT * FROM (\n{sql}\n) AS _sql_trail_q LIMIT {int(row_limit) + 1}" if row_limit else sql
+        deadline = deadline or Deadline()
+        breaker = CircuitBreakerRegistry.get(slug) if slug else None
         last_exception = None
 
         for attempt in range(1, retries + 1):
+            # O orçamento é conferido antes do disjuntor: allow() em half-open reserva a tentativa de teste,
+            # que só é liberada por record_success/record_failure depois de uma chamada de fato.
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                break
+            if breaker and not breaker.allow():
+                return SupabaseService._unavailable(breaker.retry_after())
+            statement_timeout = max(1, int(min(timeout_ms or SupabaseService.STATEMENT_TIMEOUT_MS, remaining * 1000)))
             try:
-                response = client.rpc('rpc_sql', {'p_query': sql}).execute()
+                columns, data = client.fetch(rpc_query, statement_timeout, request_timeout=remaining + SupabaseService.DEADLINE_GRACE_SECONDS)
+            except ScenarioQueryError as e:
+                if breaker: breaker.record_success()
+                return {'data': None, 'error': str(e)}
             except Exception as e:
+                if not is_transient_error(e):
+                    if breaker: breaker.record_success()
+                    print(f"Erro executando Query: {e}")
+                    return {'data': None, 'error': str(e)}
+
                 last_exception = e
-                if attempt < retries and getattr(e, 'winerror', None) == 10054:
-                    print(f"Conexao restada (tentativa {attempt}/{retries}). Tentando novamente em {backoff} segundos... (Tentativa {attempt}/{retries})")
-                    time.sleep(backoff)
-                    backoff *= 2
+                if breaker: breaker.record_failure()
+                delay = backoff_delay(attempt, backoff)
+                # Só espera se, depois do backoff, ainda sobrar orçamento para a próxima tentativa.
+                if attempt < retries and delay < deadline.remaining():
+                    print(f"Falha de conexao (tentativa {attempt}/{retries}). Tentando novamente em {delay:.2f} segundos...")
+                    time.sleep(delay)
                     continue
-                print(f"Erro executando Query: {e}")
-                return {'data': None, 'error': str(e)}
-            
-            if getattr(response, 'error', None):
-                print('RPC error:', response.error)
-                error_message = getattr(response.error, 'message', str(response.error))
-                return {'data': None, 'error': f'Erro no banco de dados: {error_message}'}
-
-            data = response.data
-
-            if isinstance(data, str):
-                try:
-                    data = json.loads(data)
-                except Exception as e:
-                    print("Falhou em passar para JSON.")
-                    return {'data': None, 'error': f'Falhou em passar para JSON: {e}'}
-            
-            if not isinstance(data, list):
-                print("Formato inesperado.")
-                return {'data': None, 'error': data.get('error') if isinstance(data, dict) else "Formato inesperado"}
-             
+                break
+
+            if breaker: breaker.record_success()
+
             total = len(data)
-            display = data if max_rows == 0 else data[:max_rows]
-            columns = list(display[0].keys()) if display else []
-            rows = [tuple(item.values()) for item in display]
+            truncated = bool(row_limit) and total > row_limit
+            if truncated:
+                data = data[:row_limit]
+                count_res = SupabaseService.count_rows(client, sql, slug=slug, deadline=deadline, timeout_ms=timeout_ms)
+                if count_res.get('error'):
+                    return count_res
+                total = count_res['total']
+
+            rows = data if max_rows == 0 else data[:max_rows]
             return {
                 'data': {
-                    'columns': columns,
+                    'columns': columns if rows else [],
                     'rows': rows,
-                    'total': total
+                    'total': total,
+                    'truncated': truncated
                 },
                 'error': None
             }
         if last_exception:
-            return {'data': None, 'error': f"Falha em executar query apos {retries} tentativas: {last_exception}"}
-        return {'data': None, 'error': 'Falha em executar query apos tentativas.'}
+            return {'data': None, 'error': f"Falha em executar query apos {attempt} tentativas: {last_exception}", 'retryable': True}
+        if deadline.expired():
+            return {'data': None, 'error': 'Tempo limite da requisição esgotado antes de executar a consulta.', 'retryable': True}
+        return {'data': None, 'error': 'Falha em executar query apos tentativas.', 'retryable': True}
+
+    @staticmethod
+    def breaker_open_result(slug):
+        """
+        Retorna o resultado de indisponibilidade se o disjuntor do cenário estiver aberto, ou None.
+        Não consome a tentativa de teste (half-open) do disjuntor.
+        """
+        retry_after = CircuitBreakerRegistry.get(slug).retry_after() if slug else 0
+        return SupabaseService._unavailable(retry_after) if retry_after else None
+
+    @staticmethod
+    def _unavailable(retry_after):
+        """Monta o resultado de uma chamada recusada pelo disjuntor aberto."""
+        return {'data': None, 'error': f"O banco do cenário está temporariamente indisponível. Tente novamente em {retry_after} segundos.", 'retryable': True, 'retry_after': retry_after}
+
+    @staticmethod
+    def count_rows(client, sql: str, slug=None, deadline=None, timeout_ms=None):
+        """Executa a query apenas em modo de contagem (COUNT no banco), sem trafegar as linhas."""
+        sql = sql.strip().rstrip(';')
+        res = SupabaseService.execute_query(client, f"SELECT COUNT(*) AS total FROM (\n{sql}\n) AS _sql_trail_q", max_rows=0, slug=slug, deadline=deadline, timeout_ms=timeout_ms)
+        if res.get('error'):
+            return res
+        rows = res['data']['rows']
+        return {'total': int(rows[0][0]) if rows else 0, 'error': None}
+
+    @staticmethod
+    def execute_student_query(client, sql: str, slug=None, deadline=None, timeout_ms=None, row_limit=None):
+        """Executa a query do aluno limitada a row_limit (padrão MAX_RESULT_ROWS) linhas no banco."""
+        return SupabaseService.execute_query(client, sql, max_rows=0, slug=slug, deadline=deadline, row_limit=row_limit or SupabaseService.MAX_RESULT_ROWS, timeout_ms=timeout_ms)
+
+    @staticmethod
+    def statement_timeout_ms(question):
+        """Retorna o statement timeout da questão, ou o padrão STATEMENT_TIMEOUT_MS se ela não define um."""
+        return getattr(question, 'statement_timeout_ms', None) or SupabaseService.STATEMENT_TIMEOUT_MS
+
+    @staticmethod
+    def execute_expected_query(client, slug, question, deadline=None):
+        """Executa a query esperada (gabarito) de uma questão, reaproveitando o resultado em cache quando disponível."""
+        cached = ExpectedResultCache.get(slug, question.id, question.expected_query)
+        if cached is not None:
+            return cached
+
+        result = SupabaseService.execute_query(client, question.expected_query, max_rows=0, slug=slug, deadline=deadline, timeout_ms=SupabaseService.statement_timeout_ms(question))
+        if not result.get('error'):
+            ExpectedResultCache.set(slug, question.id, question.expected_query, result)
+        return result
     
 class SQLGrader:
     """Responsavel por analisar e comparar os resultados das queries."""
 
     @staticmethod
     def is_safe_query(query: str) -> bool:
-        """Verifica se a query submetida é segura, garantindo que ela comece com SELECT ou WITH, não contenha múltiplas instruções e não utilize comandos SQL potencialmente perigosos, utilizando expressões regulares para detectar padrões suspeitos e retornando um booleano indicando se a query é considerada segura ou não."""
-        query_upper = query.upper()
-        
-        if not (query.strip().lower().startswith('select') or query.strip().lower().startswith('with')):
-            return False, "Sua consulta deve iniciar com SELECT ou WITH."
-            
-        if ';' in query.strip().rstrip(';'):
-            return False, "Apenas uma instrução SQL é permitida por vez."
-
-        dangerous_keywords = [
-            r'\bDROP\b', r'\bDELETE\b', r'\bUPDATE\b', r'\bINSERT\b', 
-            r'\bALTER\b', r'\bTRUNCATE\b', r'\bGRANT\b', r'\bREVOKE\b', r'\bEXEC\b'
-        ]
-        for keyword in dangerous_keywords:
-            if re.search(keyword, query_upper):
-                clean_keyword = keyword.replace(r'\b', '')
-                return False, f"Uso de comando não permitido: {clean_keyword}"
-
-        return True, "Valid."
+        """Verifica se a query submetida é segura (uma única instrução iniciada por SELECT ou WITH e sem comandos proibidos), usando o lexer de sqltext para ignorar literais e comentários."""
+        return check_query_safety(query)
     
     @staticmethod
     def compare(base_sql, student_sql, base_res, student_res):
-        """Compara os DataFrames resultantes."""
-        base_upper = " " + base_sql.upper().replace('\n', ' ') + " "
-        
+        """Compara os resultados das queries usando o motor colunar do ResultComparator, em outro processo quando o resultado é grande."""
         base_data = base_res.get('data')
         stu_data = student_res.get('data')
 
         if not base_data or not stu_data:
             return False, "Erro. Uma das queries nao retornou dados validos."
-        
-        if base_data['total'] != stu_data['total']:
-            return False, f"O número de linhas retornadas difere. Esperado: {base_data['total']}, Recebido: {stu_data['total']}."
-        
-        df_base = pd.DataFrame(base_data['rows'], columns=base_data['columns'])
-        df_stu = pd.DataFrame(stu_data['rows'], columns=stu_data['columns'])
-
-        if df_base.empty and df_stu.empty:
-            return True, "Parabens! As consultas sao equivalentes."
-        
-        df_base_norm = SQLGrader._normalize_df(df_base)
-        df_stu_norm = SQLGrader._normalize_df(df_stu)
-
-        # NÍVEL 1: Conteúdo Correto, Ordem Correta
-        if df_base_norm.values.tolist() == df_stu_norm.values.tolist():
-            return True, "Parabens! As consultas sao equivalentes."
-
-        # NÍVEL 2: Conteúdo Correto, Ordem Errada
-        if SQLGrader._sort_matrix(df_base_norm) == SQLGrader._sort_matrix(df_stu_norm):
-            if re.search(r'\bORDER\s+BY\b', base_upper):
-                return False, "Os dados estão corretos, mas a ordem está errada."
-            return True, "Parabens! As consultas sao equivalentes."
-
-        # NÍVEL 3: Busca Flexível (Aceita concatenação, colunas extras e ordenação diferente)
-        if len(df_base_norm) == len(df_stu_norm):
-            
-            stu_pool = []
-            for s_row in df_stu_norm.values.tolist():
-                s_string = re.sub(r'[^a-z0-9]', '', "".join(map(str, s_row)))
-                stu_pool.append(s_string)
-            
-            all_base_rows_found = True
-            
-            for b_row in df_base_norm.values.tolist():
-                b_vals = [re.sub(r'[^a-z0-9]', '', str(v)) for v in b_row]
-                
-                row_matched = False
-                for i, s_super_string in enumerate(stu_pool):
-                    if all(b_val in s_super_string for b_val in b_vals):
-                        row_matched = True
-                        stu_pool.pop(i)
-                        break
-                
-                if not row_matched:
-                    all_base_rows_found = False
-                    break
-            
-            if all_base_rows_found:
-                return True, "Parabens! As consultas sao equivalentes."
-
-        return False, "Os dados nao conferem."
-
-    @staticmethod
-    def _normalize_df(df):
-        """Normaliza os dados do DataFrame para comparação."""
-        df = df.round(2)
-        df = df.astype(str)
-        df = df.map(lambda x: x.strip().lower() if isinstance(x, str) else x)
-        return df
-    
+
+        return ComparisonOffload.compare(base_sql, base_data, stu_data)
+
     @staticmethod
-    def _sort_matrix(df):
-        """Ordena as linhas do DataFrame para comparação, retornando uma lista de listas ordenada."""
-        return sorted(df.values.tolist())
-    
+    def check_fingerprint(fingerprint, student_res):
+        """
+        Tenta aprovar a consulta apenas pela impressão digital do gabarito, sem o resultado esperado.
+        Só o acerto é decidido assim: a impressão digital não acompanha mudanças nos dados do cenário, e um erro
+        precisa do resultado esperado para o feedback. Retorna (True, mensagem), ou None quando a comparação
+        completa é necessária.
+        """
+        stu_data = student_res.get('data')
+        if not fingerprint or not stu_data or stu_data.get('truncated'):
+            return None
+
+        if ResultComparator.matches_fingerprint(fingerprint, stu_data):
+            return True, ResultComparator.SUCCESS_MESSAGE
+        return None
+
+    @staticmethod
+    def expected_row_count(base_res, fingerprint):
+        """Retorna o total de linhas do gabarito, pelo resultado já executado ou pela impressão digital, ou None se desconhecido."""
+        base_data = (base_res or {}).get('data')
+        if base_data:
+            return base_data['total']
+        return fingerprint['row_count'] if fingerprint else None
+
+    @staticmethod
+    def needs_full_result(base_res, student_res):
+        """Indica se o resultado do aluno foi truncado pelo teto de linhas e precisa ser baixado por completo para a comparação."""
+        base_data = base_res.get('data')
+        stu_data = student_res.get('data')
+        return bool(base_data and stu_data and stu_data.get('truncated') and base_data['total'] == stu_data['total'])
+
+class GradingService:
+    """
+    Orquestra a execução e a correção de uma consulta para uma questão: caches de execução e de veredito
+    (por SQL canônica), guarda de custo, impressão digital do gabarito, execução concorrente do gabarito e comparação.
+    """
+
+    MAX_BATCH_CANDIDATES = int(os.getenv('BATCH_VALIDATION_MAX_CANDIDATES', 50))
+    BATCH_WORKERS = int(os.getenv('BATCH_VALIDATION_WORKERS', 4))
+
+    # Pool separado do de queries de cenário: um lote grande não ocupa as threads usadas pelas correções dos alunos.
+    _batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch-validation')
+
+    @staticmethod
+    def grade(client, slug, question, student_sql, deadline=None, include_expected=False, base_res=None):
+        """
+        Corrige a consulta e retorna um dicionário com 'outcome' ('graded', 'rejected', 'query_error', 'base_error' ou 'unavailable'),
+        'valid', 'message', 'result_table' e 'expected_table', mais o aviso da guarda de custo ('warning') se a consulta foi rebaixada.
+        Com include_expected, o resultado do gabarito é sempre carregado para exibição.
+        Com base_res, o resultado do gabarito já executado é reutilizado e nenhuma tarefa extra é agendada no pool.
+        """
+        deadline = deadline or Deadline()
+        canonical_sql = canonicalize_sql(student_sql)
+        timeout_ms = SupabaseService.statement_timeout_ms(question)
+        row_limit = None
+        warning = None
+
+        stu_res = QueryResultCache.get(slug, canonical_sql)
+        if stu_res is not None:
+            cached_verdict = VerdictCache.get(slug, question.id, question.expected_query, canonical_sql)
+            if cached_verdict is not None:
+                if base_res is None:
+                    base_res = (SupabaseService.execute_expected_query(client, slug, question, deadline) if include_expected
+                                else ExpectedResultCache.get(slug, question.id, question.expected_query))
+                return GradingService._graded(cached_verdict, stu_res, base_res)
+
+        if stu_res is None:
+            # Com o banco indisponível, falha rápido antes de gastar o orçamento da requisição no EXPLAIN da guarda de custo.
+            unavailable = SupabaseService.breaker_open_result(slug)
+            if unavailable:
+                return {'outcome': 'unavailable', 'result_table': unavailable}
+            guard = QueryCostGuard.evaluate(client, student_sql, slug=slug, canonical_sql=canonical_sql, deadline=deadline)
+            if guard['action'] == QueryCostGuard.REJECT:
+                return {'outcome': 'rejected', 'valid': False, 'message': guard['reason'], 'guard': guard}
+            if guard['action'] == QueryCostGuard.DOWNGRADE:
+                print(f"Consulta rebaixada pela guarda de custo ({guard['source']}): {guard['reason']}")
+                timeout_ms = min(timeout_ms, QueryCostGuard.DOWNGRADED_TIMEOUT_MS)
+                row_limit = QueryCostGuard.DOWNGRADED_MAX_ROWS
+                warning = guard['reason']
+
+        fingerprint = None
+        if not include_expected and base_res is None:
+            has_fingerprint, fingerprint = AnswerKeyService.get_fingerprint(question)
+            fingerprint = fingerprint if has_fingerprint else None
+
+        # Sem fingerprint o gabarito sempre será necessário: executa-o em paralelo com a query do aluno.
+        base_future = None if fingerprint or base_res is not None else SupabaseService.submit(SupabaseService.execute_expected_query, client, slug, question, deadline)
+
+        if stu_res is None:
+            # Uma resposta correta tem tantas linhas quanto o gabarito: com esse tamanho já conhecido, o teto de linhas
+            # cobre o gabarito inteiro e a query do aluno é comparada com uma única execução, sem baixá-la de novo.
+            expected_rows = SQLGrader.expected_row_count(base_res or ExpectedResultCache.get(slug, question.id, question.expected_query), fingerprint)
+            if expected_rows:
+                row_limit = max(row_limit or SupabaseService.MAX_RESULT_ROWS, expected_rows)
+            stu_res = SupabaseService.execute_student_query(client, student_sql, slug=slug, deadline=deadline, timeout_ms=timeout_ms, row_limit=row_limit)
+            if stu_res.get('retryable'):
+                return {'outcome': 'unavailable', 'result_table': stu_res}
+            if stu_res.get('error'):
+                return {'outcome': 'query_error', 'valid': False, 'message': stu_res['error'], 'result_table': stu_res, 'warning': warning}
+            QueryResultCache.set(slug, canonical_sql, stu_res)
+
+        verdict = SQLGrader.check_fingerprint(fingerprint, stu_res) if fingerprint else None
+        if verdict:
+            base_res = ExpectedResultCache.get(slug, question.id, question.expected_query)
+        else:
+            if base_res is None:
+                base_res = base_future.result() if base_future else SupabaseService.execute_expected_query(client, slug, question, deadline)
+            if base_res.get('retryable'):
+                return {'outcome': 'unavailable', 'result_table': base_res}
+            if base_res.get('error'):
+                return {'outcome': 'base_error', 'valid': False, 'message': base_res['error'], 'expected_table': base_res}
+
+            # O tamanho do gabarito não era conhecido antes da execução e ele também é grande: traz o resultado do aluno
+            # até o tamanho do gabarito (o total já confere) para comparar linha a linha.
+            if SQLGrader.needs_full_result(base_res, stu_res):
+                stu_res = SupabaseService.execute_student_query(client, student_sql, slug=slug, deadline=deadline, timeout_ms=timeout_ms, row_limit=base_res['data']['total'])
+                if stu_res.get('retryable'):
+                    return {'outcome': 'unavailable', 'result_table': stu_res}
+
+            verdict = SQLGrader.compare(question.expected_query, student_sql, base_res, stu_res)
+
+        VerdictCache.set(slug, question.id, question.expected_query, canonical_sql, verdict)
+        return {**GradingService._graded(verdict, stu_res, base_res), 'warning': warning}
+
+    @staticmethod
+    def grade_submission(client, slug, question, student_id, student_sql, time_spent):
+        """
+        Corrige a consulta de um aluno dentro do controle de admissão do cenário e registra a submissão conforme o desfecho.
+        Retorna o resultado de grade(), com outcome 'overloaded' (e 'retry_after') quando a fila do cenário está cheia,
+        ou 'save_error' quando a submissão não pôde ser salva.
+        """
+        admitted, graded = AdmissionRegistry.run(
+            slug, AdmissionRegistry.key('student', student_id), lambda: GradingService.grade(client, slug, question, student_sql)
+        )
+        if not admitted:
+            return {'outcome': 'overloaded', 'valid': False, 'message': None, 'retry_after': graded}
+
+        if graded['outcome'] == 'query_error':
+            SubmissionService.save_submission(student_id, question.id, time_spent, student_sql, False, graded['message'], question.answer_key_version)
+        elif graded['outcome'] == 'graded':
+            success_save, save_msg = SubmissionService.save_submission(
+                student_id, question.id, time_spent, student_sql, graded['valid'], graded['message'], question.answer_key_version
+            )
+            if not success_save:
+                return {**graded, 'outcome': 'save_error', 'message': save_msg}
+        return graded
+
+    @staticmethod
+    def grade_batch(client, slug, question, candidates, key):
+        """
+        Corrige uma lista de consultas candidatas para a mesma questão, executando o gabarito uma única vez
+        e as candidatas em paralelo no pool próprio de lotes (BATCH_WORKERS threads).
+        O gabarito e cada candidata ocupam uma vaga do controle de admissão do cenário na fila da chave (key),
+        de modo que um lote disputa o banco do cenário como várias correções, e não como uma só.
+        Retorna (sucesso, resultado): em caso de sucesso, a matriz de vereditos com os tempos de cada consulta;
+        caso contrário, o resultado com falha do gabarito (com 'overloaded' e 'retry_after' se ele não foi admitido).
+        """
+        started = time.perf_counter()
+        admitted, base_res = AdmissionRegistry.run(slug, key, lambda: SupabaseService.execute_expected_query(client, slug, question, Deadline()))
+        if not admitted:
+            return False, {'data': None, 'error': None, 'overloaded': True, 'retry_after': base_res}
+        expected_ms = round((time.perf_counter() - started) * 1000, 2)
+        if base_res.get('error'):
+            return False, base_res
+
+        futures = [
+            GradingService._batch_executor.submit(GradingService._grade_candidate, client, slug, question, sql, base_res, key)
+            for sql in candidates
+        ]
+        results = []
+        for index, (sql, future) in enumerate(zip(candidates, futures)):
+            row = future.result()
+            row['index'] = index
+            row['sql'] = sql
+            results.append(row)
+
+        return True, {
+            'question_id': question.id,
+            'expected': {'total': base_res['data']['total'], 'elapsed_ms': expected_ms},
+            'results': results,
+            'summary': {
+                'valid': sum(1 for r in results if r['valid']),
+                'invalid': sum(1 for r in results if r['outcome'] == 'graded' and not r['valid']),
+                'errors': sum(1 for r in results if r['outcome'] != 'graded')
+            },
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    @staticmethod
+    def _grade_candidate(client, slug, question, sql, base_res, key):
+        """Corrige uma candidata do lote numa vaga própria do cenário, reaproveitando o resultado do gabarito e medindo o tempo gasto."""
+        started = time.perf_counter()
+        sql = (sql or '').strip()
+        is_safe, safe_msg = SQLGrader.is_safe_query(sql) if sql else (False, 'Sua consulta está em branco.')
+        if not is_safe:
+            graded = {'outcome': 'unsafe', 'valid': False, 'message': safe_msg}
+        else:
+            admitted, graded = AdmissionRegistry.run(slug, key, lambda: GradingService.grade(client, slug, question, sql, include_expected=True, base_res=base_res))
+            if not admitted:
+                graded = {'outcome': 'overloaded', 'valid': False, 'message': f'Muitas correções em andamento neste cenário. Tente novamente em {graded} segundo(s).'}
+
+        result_table = graded.get('result_table') or {}
+        data = result_table.get('data') or {}
+        return {
+            'outcome': graded['outcome'],
+            'valid': bool(graded.get('valid')),
+            'message': graded.get('message') or result_table.get('error'),
+            'total': data.get('total'),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    @staticmethod
+    def _graded(verdict, stu_res, base_res):
+        """Monta o resultado de uma correção concluída."""
+        is_valid, msg = verdict
+        return {'outcome': 'graded', 'valid': is_valid, 'message': msg, 'result_table': stu_res, 'expected_table': base_res}
+
+class GradingTicketService:
+    """
+    Correção assíncrona: a submissão é enfileirada num pool local de workers e o aluno recebe um ticket para
+    consultar o veredito depois, de modo que as threads HTTP não fiquem presas à latência do banco do cenário.
+    Os tickets concluídos ficam na memória do processo por TICKET_TTL_SECONDS (ou até serem os mais antigos além de
+    MAX_TICKETS_KEPT); tickets na fila ou em execução nunca são descartados. Com MAX_PENDING tickets em aberto,
+    novas submissões são recusadas com um retry_after, em vez de crescer a fila do pool sem limite.
+    """
+
+    WORKERS = int(os.getenv('ASYNC_GRADING_WORKERS', 8))
+    TICKET_TTL_SECONDS = int(os.getenv('ASYNC_GRADING_TICKET_TTL_SECONDS', 600))
+    MAX_TICKETS_KEPT = int(os.getenv('ASYNC_GRADING_MAX_TICKETS', 5000))
+    MAX_PENDING = int(os.getenv('ASYNC_GRADING_MAX_PENDING', 256))
+    MAX_WAIT_SECONDS = 30
+
+    _lock = threading.Lock()
+    _tickets = OrderedDict()
+    _finished = OrderedDict()
+    _done = {}
+    _pending = 0
+    _rejected = 0
+    _avg_service = 0.5
+    _runner = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='async-grading')
+
+    @staticmethod
+    def submit(slug, question, student_id, student_sql, time_spent):
+        """
+        Enfileira a correção da consulta do aluno.
+        Retorna (True, estado inicial do ticket) ou (False, retry_after em segundos) quando a fila está cheia.
+        """
+        ticket = {
+            "id": uuid.uuid4().hex,
+            "student_id": student_id,
+            "question_id": question.id,
+            "slug": slug,
+            "status": "queued",
+            "graded": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None
+        }
+        with GradingTicketService._lock:
+            GradingTicketService._prune()
+            if GradingTicketService._pending >= GradingTicketService.MAX_PENDING or len(GradingTicketService._tickets) >= GradingTicketService.MAX_TICKETS_KEPT:
+                GradingTicketService._rejected += 1
+                return False, GradingTicketService._retry_after()
+            GradingTicketService._tickets[ticket["id"]] = ticket
+            GradingTicketService._done[ticket["id"]] = threading.Event()
+            GradingTicketService._pending += 1
+        GradingTicketService._runner.submit(GradingTicketService._run, ticket, question, student_sql, time_spent)
+        return True, dict(ticket)
+
+    @staticmethod
+    def get_ticket(ticket_id, student_id, wait_seconds=0):
+        """
+        Retorna o ticket do aluno. Com wait_seconds, aguarda (até MAX_WAIT_SECONDS) o veredito antes de responder,
+        permitindo ao cliente fazer long polling em vez de consultar repetidamente.
+        """
+        with GradingTicketService._lock:
+            ticket = GradingTicketService._tickets.get(ticket_id)
+            done = GradingTicketService._done.get(ticket_id)
+        if not ticket or ticket["student_id"] != student_id:
+            return False, "Ticket de correção não encontrado."
+
+        if wait_seconds and done is not None:
+            done.wait(min(float(wait_seconds), GradingTicketService.MAX_WAIT_SECONDS))
+        with GradingTicketService._lock:
+            return True, dict(ticket)
+
     @staticmethod
-    def _get_alphanumeric_fingerprint(df):
-        """Gera uma representação alfanumérica dos dados do DataFrame."""
-        fingerprints = []
-        for _, row in df.iterrows():
-            row_str = "".join([str(x) for x in row.values])
-            clean_str = re.sub(r'[^a-z0-9]', '', row_str.lower())
-            fingerprints.append(clean_str)
-        return sorted(fingerprints)
+    def stats():
+        """Retorna a contagem dos tickets conhecidos pelo processo, por estado, e os limites da fila."""
+        with GradingTicketService._lock:
+            counts = {}
+            for ticket in GradingTicketService._tickets.values():
+                counts[ticket["status"]] = counts.get(ticket["status"], 0) + 1
+            return {
+                "workers": GradingTicketService.WORKERS,
+                "tickets": counts,
+                "pending": GradingTicketService._pending,
+                "max_pending": GradingTicketService.MAX_PENDING,
+                "rejected": GradingTicketService._rejected
+            }
+
+    @staticmethod
+    def _run(ticket, question, student_sql, time_spent):
+        """Worker: corrige e registra a submissão com um executor emprestado do cenário, guardando o desfecho no ticket."""
+        started = time.monotonic()
+        with GradingTicketService._lock:
+            ticket.update(status="running", started_at=time.time())
+        try:
+            with SupabaseService.lease_client(ticket["slug"]) as client:
+                if client:
+                    graded = GradingService.grade_submission(client, ticket["slug"], question, ticket["student_id"], student_sql, time_spent)
+                    status = "done"
+                else:
+                    graded = {'outcome': 'base_error', 'valid': False, 'message': f"Credenciais para o slug {ticket['slug']} não encontradas."}
+                    status = "failed"
+        except Exception as e:
+            print(f"Falha na correção assíncrona do ticket {ticket['id']}: {e}")
+            graded = {'outcome': 'base_error', 'valid': False, 'message': str(e)}
+            status = "failed"
+        with GradingTicketService._lock:
+            ticket.update(status=status, graded=graded, finished_at=time.time())
+            GradingTicketService._pending -= 1
+            GradingTicketService._avg_service = 0.8 * GradingTicketService._avg_service + 0.2 * (time.monotonic() - started)
+            GradingTicketService._finished[ticket["id"]] = ticket
+            done = GradingTicketService._done.get(ticket["id"])
+        if done is not None:
+            done.set()
+
+    @staticmethod
+    def _prune():
+        """
+        Descarta, do mais antigo para o mais novo, os tickets concluídos há mais de TICKET_TTL_SECONDS e os concluídos
+        excedentes de MAX_TICKETS_KEPT (chamado com o lock adquirido). Tickets na fila ou em execução são mantidos.
+        """
+        cutoff = time.time() - GradingTicketService.TICKET_TTL_SECONDS
+        finished = GradingTicketService._finished
+        while finished:
+            ticket_id, ticket = next(iter(finished.items()))
+            if ticket["finished_at"] >= cutoff and len(GradingTicketService._tickets) < GradingTicketService.MAX_TICKETS_KEPT:
+                break
+            del finished[ticket_id]
+            del GradingTicketService._tickets[ticket_id]
+            GradingTicketService._done.pop(ticket_id, None)
+
+    @staticmethod
+    def _retry_after():
+        """Estima em quantos segundos os workers esvaziam a fila atual (chamado com o lock adquirido)."""
+        return max(1, math.ceil(GradingTicketService._pending / GradingTicketService.WORKERS * GradingTicketService._avg_service))
+
+class RegradeService:
+    """
+    Recorrige, em segundo plano, as submissões de uma questão após a mudança do seu gabarito.
+    O gabarito novo é executado uma única vez; as submissões são lidas em lotes (paginação por id), deduplicadas pela SQL
+    canônica e corrigidas em paralelo, e os vereditos são gravados em atualizações em lote, uma transação curta por lote.
+    Cada correção passa pelo controle de admissão do cenário na faixa de baixa prioridade, cedendo as vagas aos alunos;
+    as threads só esperam pelo banco do cenário, e as comparações grandes seguem para o pool de processos de ComparisonOffload.
+    Só são processadas submissões ainda não corrigidas pela versão atual do gabarito, então um job interrompido pode ser retomado.
+    A fila write-behind de submissões deste processo é gravada antes da paginação e de novo antes de o job ser concluído.
+    """
+
+    CHUNK_SIZE = int(os.getenv('REGRADE_CHUNK_SIZE', 500))
+    WORKERS = int(os.getenv('REGRADE_WORKERS', 4))
+    MAX_JOBS_KEPT = 200
+
+    _lock = threading.Lock()
+    _jobs = OrderedDict()
+    _runner = ThreadPoolExecutor(
+        max_workers=int(os.getenv('REGRADE_MAX_CONCURRENT_JOBS', 2)),
+        thread_name_prefix='regrade'
+    )
+
+    @staticmethod
+    def start(question_id):
+        """Agenda a recorreção das submissões da questão e retorna o estado inicial do job."""
+        job = {
+            "id": uuid.uuid4().hex,
+            "question_id": int(question_id),
+            "answer_key_version": None,
+            "status": "queued",
+            "total": None,
+            "processed": 0,
+            "changed": 0,
+            "unique_queries": 0,
+            "deduplicated": 0,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None
+        }
+        with RegradeService._lock:
+            RegradeService._jobs[job["id"]] = job
+            while len(RegradeService._jobs) > RegradeService.MAX_JOBS_KEPT:
+                RegradeService._jobs.popitem(last=False)
+        RegradeService._runner.submit(RegradeService._run, job)
+        return dict(job)
+
+    @staticmethod
+    def get_job(job_id):
+        """Retorna o progresso de um job de recorreção."""
+        with RegradeService._lock:
+            job = RegradeService._jobs.get(job_id)
+            return (True, dict(job)) if job else (False, "Job de recorreção não encontrado.")
+
+    @staticmethod
+    def list_jobs(question_id=None):
+        """Retorna os jobs conhecidos pelo processo, do mais recente para o mais antigo, opcionalmente filtrados por questão."""
+        with RegradeService._lock:
+            jobs = [dict(j) for j in RegradeService._jobs.values() if question_id is None or j["question_id"] == int(question_id)]
+        return list(reversed(jobs))
+
+    @staticmethod
+    def _update(job, **fields):
+        """Atualiza o estado do job sob o lock do registro."""
+        with RegradeService._lock:
+            job.update(fields)
+
+    @staticmethod
+    def _run(job):
+        """Executa o job: gabarito uma vez, depois lotes de submissões até acabar ou o gabarito mudar de novo."""
+        RegradeService._update(job, status="running", started_at=time.time())
+        try:
+            status, error = RegradeService._regrade(job)
+        except Exception as e:
+            print(f"Falha na recorreção da questão {job['question_id']}: {e}")
+            status, error = "failed", str(e)
+        RegradeService._update(job, status=status, error=error, finished_at=time.time())
+
+    @staticmethod
+    def _regrade(job):
+        """Corpo do job; retorna (status final, erro)."""
+        success, question = QuestionService.get_question_by_id(job["question_id"])
+        if not success:
+            return "failed", question
+        version = question.answer_key_version
+        RegradeService._update(job, answer_key_version=version)
+
+        success, slug = QuestionService.get_scenario_slug(question)
+        if not success:
+            return "failed", slug
+        with SupabaseService.lease_client(slug) as client:
+            if not client:
+                return "failed", f"Credenciais para o slug {slug} não encontradas."
+            return RegradeService._regrade_submissions(job, question, version, client, slug)
+
+    @staticmethod
+    def _regrade_submissions(job, question, version, client, slug):
+        """Executa o gabarito novo e recorrige, em lotes, as submissões pendentes da questão; retorna (status final, erro)."""
+        base_res = SupabaseService.execute_expected_query(client, slug, question, Deadline())
+        if base_res.get('error'):
+            return "failed", f"Erro na base: {base_res['error']}"
+
+        # Submissões corrigidas pelo gabarito antigo ainda na fila write-behind entram na paginação.
+        SubmissionWriteBehind.flush()
+        pending = RegradeService._pending_filter(question.id, version)
+        try:
+            with Session() as session:
+                RegradeService._update(job, total=session.query(func.count(Submission.id)).filter(*pending).scalar())
+        except SQLAlchemyError as e:
+            return "failed", str(e)
+
+        verdicts = {}
+        last_id = 0
+        drained = False
+        with ThreadPoolExecutor(max_workers=RegradeService.WORKERS, thread_name_prefix='regrade-grade') as pool:
+            while True:
+                with Session() as session:
+                    current_version = session.query(Question.answer_key_version).filter(Question.id == question.id).scalar()
+                    if current_version != version:
+                        return "superseded", None
+                    chunk = session.query(Submission.id, Submission.student_id, Submission.submitted_query, Submission.is_correct).filter(
+                        *pending, Submission.id > last_id
+                    ).order_by(Submission.id).limit(RegradeService.CHUNK_SIZE).all()
+                if not chunk:
+                    if drained:
+                        return "completed", None
+                    # Antes de concluir, grava a fila write-behind deste processo (flush espera também o lote que a thread
+                    # de gravação estiver gravando); o que chegou ao banco nesse meio tempo é recorrigido numa última passada.
+                    success, flushed = SubmissionWriteBehind.flush()
+                    if not success:
+                        return "failed", f"Submissões pendentes na fila de gravação não puderam ser gravadas: {flushed}"
+                    drained = True
+                    continue
+
+                canonical = {row.id: canonicalize_sql(row.submitted_query) for row in chunk}
+                new_queries = {}
+                for row in chunk:
+                    if canonical[row.id] not in verdicts and canonical[row.id] not in new_queries:
+                        new_queries[canonical[row.id]] = row.submitted_query
+                futures = {
+                    key: pool.submit(RegradeService._grade_submission, job, client, slug, question, sql, base_res)
+                    for key, sql in new_queries.items()
+                }
+                for key, future in futures.items():
+                    verdict = future.result()
+                    if verdict is None:
+                        return "failed", "O banco do cenário ficou indisponível durante a recorreção."
+                    verdicts[key] = verdict
+
+                mappings = []
+                changed_students = set()
+                changed = 0
+                for row in chunk:
+                    is_correct, output = verdicts[canonical[row.id]]
+                    if bool(row.is_correct) != is_correct:
+                        changed += 1
+                        changed_students.add(row.student_id)
+                    mappings.append({
+                        "id": row.id,
+                        "is_correct": is_correct,
+                        "execution_output": json.dumps(output) if output else None,
+                        "answer_key_version": version
+                    })
+                with Session() as session:
+                    session.bulk_update_mappings(Submission, mappings)
+                    if changed_students:
+                        ProgressRollup.rebuild(session, question.id, sorted(changed_students))
+                    session.commit()
+                if changed_students:
+                    ReportCache.invalidate_submissions((student_id, question.id) for student_id in changed_students)
+
+                last_id = chunk[-1].id
+                RegradeService._update(
+                    job,
+                    processed=job["processed"] + len(chunk),
+                    changed=job["changed"] + changed,
+                    unique_queries=len(verdicts),
+                    deduplicated=job["deduplicated"] + len(chunk) - len(new_queries)
+                )
+
+    @staticmethod
+    def _pending_filter(question_id, version):
+        """Filtro das submissões da questão ainda não corrigidas pela versão do gabarito (desistências ficam de fora)."""
+        return (
+            Submission.question_id == question_id,
+            Submission.submitted_query != 'SKIP',
+            or_(Submission.answer_key_version.is_(None), Submission.answer_key_version != version)
+        )
+
+    @staticmethod
+    def _grade_submission(job, client, slug, question, sql, base_res):
+        """
+        Corrige uma consulta distinta contra o gabarito já executado, numa vaga de baixa prioridade do cenário
+        (recusada, espera o retry-after e tenta de novo); retorna (correta, saída) ou None se o cenário ficou indisponível.
+        """
+        is_safe, safe_msg = SQLGrader.is_safe_query(sql)
+        if not is_safe:
+            return False, safe_msg
+
+        while True:
+            admitted, graded = AdmissionRegistry.run(
+                slug, f"regrade:{job['id']}",
+                lambda: GradingService.grade(client, slug, question, sql, include_expected=True, base_res=base_res),
+                low_priority=True
+            )
+            if admitted:
+                break
+            time.sleep(graded)
+        if graded['outcome'] == 'unavailable':
+            return None
+        return bool(graded.get('valid')), graded.get('message')
@@ -0,0 +1,175 @@
+import re
+
+# Tipos de token produzidos por tokenize_sql.
+WHITESPACE = 'whitespace'
+COMMENT = 'comment'
+STRING = 'string'
+QUOTED_IDENTIFIER = 'quoted_identifier'
+WORD = 'word'
+NUMBER = 'number'
+PUNCTUATION = 'punctuation'
+
+# Expressão mestre: cada alternativa nomeada corresponde a um tipo de token. Comentários de bloco (aninháveis),
+# dollar quoting e textos não terminados casam apenas a abertura e são completados pelos auxiliares abaixo.
+_TOKEN_RE = re.compile(r"""
+    (?P<whitespace>\s+)
+  | (?P<line_comment>--[^\n]*)
+  | (?P<block_comment>/\*)
+  | (?P<string>'[^']*(?:''[^']*)*'(?!')|[eE]'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'(?!'))
+  | (?P<string_open>[eE]?')
+  | (?P<quoted_identifier>"[^"]*(?:""[^"]*)*"(?!"))
+  | (?P<quoted_identifier_open>")
+  | (?P<dollar>\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_À-￿][A-Za-z0-9_$À-￿]*)
+  | (?P<operator>::|<=|>=|<>|!=|\|\||->>|->|\#>>|\#>|@>|<@)
+  | (?P<punctuation>.)
+""", re.VERBOSE | re.DOTALL)
+
+_SIMPLE_KINDS = {
+    'whitespace': WHITESPACE,
+    'line_comment': COMMENT,
+    'string': STRING,
+    'quoted_identifier': QUOTED_IDENTIFIER,
+    'number': NUMBER,
+    'word': WORD,
+    'operator': PUNCTUATION,
+    'punctuation': PUNCTUATION
+}
+
+SQL_KEYWORDS = frozenset("""
+    ALL AND ANY AS ASC BETWEEN BY CASE CAST COALESCE CROSS CURRENT_DATE CURRENT_TIME CURRENT_TIMESTAMP
+    DESC DISTINCT ELSE END EXCEPT EXISTS EXTRACT FALSE FETCH FIRST FOR FROM FULL GROUP HAVING ILIKE IN
+    INNER INTERSECT INTERVAL IS JOIN LATERAL LEFT LIKE LIMIT NATURAL NOT NULL NULLIF NULLS OFFSET ON
+    OR ORDER OUTER OVER PARTITION RECURSIVE RIGHT ROW ROWS SELECT SIMILAR SOME THEN TRUE UNION USING
+    VALUES WHEN WHERE WINDOW WITH
+    AVG COUNT MAX MIN SUM ROUND UPPER LOWER LENGTH TRIM SUBSTRING CONCAT DATE_PART DATE_TRUNC NOW
+    ROW_NUMBER RANK DENSE_RANK LAG LEAD
+""".split())
+
+def tokenize_sql(sql):
+    """
+    Quebra a query em tokens (tipo, texto) numa única passada linear.
+    Reconhece literais ('...', E'...', $tag$...$tag$), identificadores entre aspas, comentários (-- e /* */ aninhados),
+    palavras, números e pontuação/operadores. Textos não terminados viram um único token até o fim da query.
+    """
+    return list(_iter_tokens(sql))
+
+def _iter_tokens(sql, i=0):
+    """Gera os tokens (tipo, texto) da query a partir da posição i."""
+    n = len(sql)
+    match = _TOKEN_RE.match
+
+    while i < n:
+        m = match(sql, i)
+        group = m.lastgroup
+        kind = _SIMPLE_KINDS.get(group)
+        if kind is not None:
+            yield kind, m.group()
+            i = m.end()
+            continue
+
+        end = _opening_end(sql, i, m.group())
+        yield (QUOTED_IDENTIFIER if group == 'quoted_identifier_open' else COMMENT if group == 'block_comment' else STRING), sql[i:end]
+        i = end
+
+def _opening_end(sql, i, opening):
+    """Retorna o fim do comentário de bloco, literal ou identificador cuja abertura (opening) começa em i."""
+    if opening == '/*':
+        return _block_comment_end(sql, i)
+    if opening == '"':
+        return _quoted_end(sql, i + 1, '"', False)
+    if opening.endswith("'"):
+        return _quoted_end(sql, i + len(opening), "'", len(opening) == 2)
+    end = sql.find(opening, i + len(opening))
+    return len(sql) if end == -1 else end + len(opening)
+
+def _quoted_end(sql, i, quote, backslash_escapes):
+    """Retorna o índice logo após o fechamento do texto entre aspas iniciado antes de i (aspas duplicadas escapam)."""
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        if backslash_escapes and ch == '\\':
+            i += 2
+            continue
+        if ch == quote:
+            if i + 1 < n and sql[i + 1] == quote:
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    return n
+
+def _block_comment_end(sql, i):
+    """Retorna o índice logo após o fim do comentário de bloco iniciado em i, respeitando o aninhamento do PostgreSQL."""
+    depth = 0
+    n = len(sql)
+    while i < n:
+        if sql.startswith('/*', i):
+            depth += 1
+            i += 2
+        elif sql.startswith('*/', i):
+            depth -= 1
+            i += 2
+            if depth == 0:
+                return i
+        else:
+            i += 1
+    return n
+
+def canonicalize_sql(sql):
+    """
+    Gera a forma canônica de uma query para uso como chave de cache: comentários e espaços viram um único espaço,
+    palavras-chave ficam em maiúsculas e os ';' finais são removidos. Literais e identificadores entre aspas são preservados.
+    """
+    parts = []
+    pending_space = False
+
+    for kind, text in tokenize_sql(sql):
+        if kind in (WHITESPACE, COMMENT):
+            pending_space = True
+            continue
+        if pending_space and parts:
+            parts.append(' ')
+        pending_space = False
+        if kind == WORD and text.upper() in SQL_KEYWORDS:
+            text = text.upper()
+        parts.append(text)
+
+    while parts and parts[-1] in (';', ' '):
+        parts.pop()
+    return ''.join(parts)
+
+FORBIDDEN_KEYWORDS = (
+    'DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'TRUNCATE', 'GRANT', 'REVOKE', 'EXEC',
+    'EXECUTE', 'CREATE', 'COPY', 'CALL', 'MERGE', 'INTO', 'LOCK', 'VACUUM', 'REINDEX'
+)
+_FORBIDDEN_SET = frozenset(FORBIDDEN_KEYWORDS)
+_LEADING_KEYWORDS = frozenset(('SELECT', 'WITH'))
+
+def check_query_safety(sql):
+    """
+    Valida, numa única passada sobre os tokens de tokenize_sql, se a query é uma leitura isolada: deve iniciar com
+    SELECT ou WITH, conter uma só instrução e não usar comandos proibidos. Literais, identificadores entre aspas e
+    comentários são tokens próprios e por isso ignorados. A passada para no primeiro problema encontrado.
+    Retorna (é_segura, mensagem).
+    """
+    leading = True
+    ended = False
+    for kind, text in _iter_tokens(sql):
+        if kind in (WHITESPACE, COMMENT):
+            continue
+        if leading:
+            if kind != WORD or text.upper() not in _LEADING_KEYWORDS:
+                break
+            leading = False
+        elif text == ';':
+            ended = True
+        elif ended:
+            return False, "Apenas uma instrução SQL é permitida por vez."
+        elif kind == WORD and text.upper() in _FORBIDDEN_SET:
+            return False, f"Uso de comando não permitido: {text.upper()}"
+
+    if leading:
+        return False, "Sua consulta deve iniciar com SELECT ou WITH."
+    return True, "Valid."
@@ -0,0 +1,346 @@
+import atexit
+import glob
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from app.database import Session
+from app.database.models import Submission
+from app.main.progress import ProgressRollup
+from app.reports.cache import ReportCache
+
+# submissions-<pid>.jsonl ou, reivindicado na recuperação, submissions-<pid>-claimed-<id>.jsonl.
+_SPILL_NAME_RE = re.compile(r"submissions-(\d+)(?:-claimed-[0-9a-f]+)?\.jsonl")
+
+class SubmissionWriteBehind:
+    """
+    Fila write-behind das submissões: a correção é respondida na hora e as submissões são gravadas em lote
+    (INSERT de várias linhas, com a atualização do resumo de progresso na mesma transação) quando a fila atinge
+    BATCH_SIZE ou a cada FLUSH_INTERVAL_SECONDS.
+    Cada submissão é antes anotada num arquivo de spill local (um por processo, com fsync), que espelha a fila:
+    se o processo cair, o próximo processo a iniciar reenvia as submissões dos arquivos de processos mortos.
+    A entrega é "pelo menos uma vez": uma queda entre o commit do lote e a limpeza do spill pode duplicar esse lote.
+    Se um lote falhar, as linhas são gravadas uma a uma: as recusadas pelo banco (ex.: chave estrangeira inválida) vão
+    para o arquivo de dead-letter do processo, para que uma linha ruim não trave a fila; com o banco indisponível,
+    as linhas restantes continuam na fila e no spill.
+    A fila é por processo: flush() só grava a deste worker, então leituras feitas em outro worker (conclusão das
+    questões especiais, relatórios) podem não ver, por até FLUSH_INTERVAL_SECONDS, submissões que ele já aceitou.
+    Por isso a fila vem desligada por padrão (SUBMISSION_WRITE_BEHIND).
+    """
+
+    ENABLED = os.getenv('SUBMISSION_WRITE_BEHIND', 'false').strip().lower() in ('1', 'true', 'yes')
+    BATCH_SIZE = int(os.getenv('SUBMISSION_BATCH_SIZE', 200))
+    FLUSH_INTERVAL_SECONDS = float(os.getenv('SUBMISSION_FLUSH_INTERVAL_SECONDS', 1.0))
+    SPILL_DIR = os.getenv('SUBMISSION_SPILL_DIR', 'submission_spill')
+    SPILL_FSYNC = os.getenv('SUBMISSION_SPILL_FSYNC', 'true').strip().lower() in ('1', 'true', 'yes')
+
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _wakeup = threading.Event()
+    _buffer = []
+    _spill = None
+    _thread = None
+    _pid = None
+    _stopping = False
+    _stats = {
+        "enqueued": 0,
+        "flushed": 0,
+        "batches": 0,
+        "failures": 0,
+        "recovered": 0,
+        "dead_lettered": 0,
+        "last_batch_size": 0,
+        "last_flush_seconds": None,
+        "last_error": None
+    }
+
+    @staticmethod
+    def start():
+        """Recupera os spills de processos mortos, abre o spill deste processo e inicia a thread de gravação (idempotente)."""
+        with SubmissionWriteBehind._lock:
+            if SubmissionWriteBehind._running():
+                return
+            # Após um fork (ex.: gunicorn com preload) a thread e o spill herdados pertencem ao processo pai.
+            SubmissionWriteBehind._pid = os.getpid()
+            SubmissionWriteBehind._buffer = []
+            os.makedirs(SubmissionWriteBehind.SPILL_DIR, exist_ok=True)
+            SubmissionWriteBehind._spill = open(SubmissionWriteBehind._spill_path(os.getpid()), 'a', encoding='utf-8')
+            SubmissionWriteBehind._recover()
+            SubmissionWriteBehind._stopping = False
+            SubmissionWriteBehind._thread = threading.Thread(target=SubmissionWriteBehind._loop, name='submission-writer', daemon=True)
+            SubmissionWriteBehind._thread.start()
+        atexit.register(SubmissionWriteBehind.shutdown)
+
+    @staticmethod
+    def ensure_started():
+        """
+        Inicia a fila se ela ainda não roda neste processo. Registrado como before_request, de modo que só os processos
+        que atendem requisições a iniciam (comandos de linha de comando do Flask não recuperam nem abrem spills).
+        """
+        if not SubmissionWriteBehind._running():
+            SubmissionWriteBehind.start()
+
+    @staticmethod
+    def enqueue(row):
+        """Anota a submissão no spill e a coloca na fila de gravação."""
+        SubmissionWriteBehind.ensure_started()
+
+        row = dict(row)
+        row.setdefault("submitted_at", datetime.now(timezone.utc).replace(tzinfo=None).isoformat())
+        with SubmissionWriteBehind._lock:
+            SubmissionWriteBehind._write_spill([row])
+            SubmissionWriteBehind._buffer.append(row)
+            SubmissionWriteBehind._stats["enqueued"] += 1
+            full = len(SubmissionWriteBehind._buffer) >= SubmissionWriteBehind.BATCH_SIZE
+        if full:
+            SubmissionWriteBehind._wakeup.set()
+
+    @staticmethod
+    def flush():
+        """
+        Grava no banco, num único INSERT de várias linhas, as submissões pendentes; se o lote falhar, grava-as uma a uma.
+        Só retorna depois que o lote em gravação pela thread de fundo, se houver, também foi concluído, então serve de
+        barreira: tudo o que foi enfileirado neste processo antes da chamada já está no banco (ou ainda no spill, se falhou).
+        Retorna (sucesso, quantidade gravada) ou (False, erro) quando o banco ficou indisponível e restaram linhas na fila.
+        """
+        with SubmissionWriteBehind._flush_lock:
+            with SubmissionWriteBehind._lock:
+                batch = SubmissionWriteBehind._buffer
+                SubmissionWriteBehind._buffer = []
+            if not batch:
+                return True, 0
+
+            started = time.perf_counter()
+            try:
+                SubmissionWriteBehind._insert(batch)
+                written, dead, retry, error = batch, [], [], None
+            except Exception as e:
+                print(f"Falha ao gravar lote de {len(batch)} submissões, gravando uma a uma: {e}")
+                with SubmissionWriteBehind._lock:
+                    SubmissionWriteBehind._stats["failures"] += 1
+                written, dead, retry, error = SubmissionWriteBehind._insert_one_by_one(batch)
+
+            if written:
+                ReportCache.invalidate_submissions((row["student_id"], row["question_id"]) for row in written)
+            with SubmissionWriteBehind._lock:
+                SubmissionWriteBehind._buffer[:0] = retry
+                if dead:
+                    SubmissionWriteBehind._write_dead_letter(dead)
+                if written or dead:
+                    SubmissionWriteBehind._rewrite_spill(SubmissionWriteBehind._buffer)
+                stats = SubmissionWriteBehind._stats
+                stats["flushed"] += len(written)
+                stats["dead_lettered"] += len(dead)
+                if written:
+                    stats["batches"] += 1
+                    stats["last_batch_size"] = len(written)
+                    stats["last_flush_seconds"] = round(time.perf_counter() - started, 4)
+                stats["last_error"] = str(error) if error else (str(dead[-1][1]) if dead else None)
+            if retry:
+                print(f"Banco indisponível: {len(retry)} submissões mantidas no spill: {error}")
+                return False, str(error)
+            return True, len(written)
+
+    @staticmethod
+    def shutdown():
+        """Hook de desligamento: para a thread de gravação e grava tudo o que estiver pendente."""
+        thread = SubmissionWriteBehind._thread
+        if not SubmissionWriteBehind._running():
+            return
+        SubmissionWriteBehind._stopping = True
+        SubmissionWriteBehind._wakeup.set()
+        thread.join(timeout=SubmissionWriteBehind.FLUSH_INTERVAL_SECONDS + 5)
+        SubmissionWriteBehind.flush()
+        with SubmissionWriteBehind._lock:
+            SubmissionWriteBehind._thread = None
+            if SubmissionWriteBehind._spill is not None:
+                SubmissionWriteBehind._spill.close()
+                SubmissionWriteBehind._spill = None
+
+    @staticmethod
+    def stats():
+        """Retorna o estado da fila de gravação."""
+        with SubmissionWriteBehind._lock:
+            return {
+                **SubmissionWriteBehind._stats,
+                "enabled": SubmissionWriteBehind.ENABLED,
+                "pending": len(SubmissionWriteBehind._buffer),
+                "batch_size": SubmissionWriteBehind.BATCH_SIZE,
+                "flush_interval_seconds": SubmissionWriteBehind.FLUSH_INTERVAL_SECONDS,
+                "spill_path": SubmissionWriteBehind._spill_path(os.getpid()),
+                "dead_letter_path": SubmissionWriteBehind._dead_letter_path(os.getpid())
+            }
+
+    @staticmethod
+    def _running():
+        """Indica se a thread de gravação foi iniciada neste processo."""
+        return SubmissionWriteBehind._thread is not None and SubmissionWriteBehind._pid == os.getpid()
+
+    @staticmethod
+    def _insert(rows):
+        """Insere as linhas e atualiza o resumo de progresso numa única transação."""
+        with Session() as session:
+            session.execute(insert(Submission), [SubmissionWriteBehind._to_record(row) for row in rows])
+            ProgressRollup.apply(session, rows)
+            session.commit()
+
+    @staticmethod
+    def _insert_one_by_one(rows):
+        """
+        Grava cada linha na sua própria transação, separando as recusadas pelo banco (dead-letter).
+        Para na primeira falha de conexão: essa linha e as seguintes voltam para a fila.
+        Retorna (gravadas, [(linha, erro)] recusadas, restantes, erro de conexão).
+        """
+        written, dead = [], []
+        for index, row in enumerate(rows):
+            try:
+                SubmissionWriteBehind._insert([row])
+            except Exception as e:
+                if SubmissionWriteBehind._is_unavailable(e):
+                    return written, dead, rows[index:], e
+                print(f"Submissão recusada pelo banco, movida para o dead-letter: {e}")
+                dead.append((row, e))
+                continue
+            written.append(row)
+        return written, dead, [], None
+
+    @staticmethod
+    def _is_unavailable(exc):
+        """Indica se a falha é de conexão/disponibilidade do banco (vale tentar de novo), e não da própria linha."""
+        return isinstance(exc, (OperationalError, InterfaceError)) or getattr(exc, 'connection_invalidated', False)
+
+    @staticmethod
+    def _loop():
+        """Thread de gravação: acorda pelo tamanho do lote ou pelo intervalo e grava a fila."""
+        while not SubmissionWriteBehind._stopping:
+            SubmissionWriteBehind._wakeup.wait(SubmissionWriteBehind.FLUSH_INTERVAL_SECONDS)
+            SubmissionWriteBehind._wakeup.clear()
+            try:
+                SubmissionWriteBehind.flush()
+            except Exception as e:
+                print(f"Falha na thread de gravação de submissões: {e}")
+
+    @staticmethod
+    def _spill_path(pid):
+        """Caminho do arquivo de spill de um processo."""
+        return os.path.join(SubmissionWriteBehind.SPILL_DIR, f"submissions-{pid}.jsonl")
+
+    @staticmethod
+    def _dead_letter_path(pid):
+        """Caminho do arquivo de dead-letter de um processo (fora do padrão dos spills, então não é reenviado)."""
+        return os.path.join(SubmissionWriteBehind.SPILL_DIR, f"dead-letter-{pid}.jsonl")
+
+    @staticmethod
+    def _write_dead_letter(failures):
+        """Anexa ao dead-letter as linhas recusadas pelo banco, com o erro, antes de elas saírem do spill (chamado com o lock adquirido)."""
+        failed_at = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        with open(SubmissionWriteBehind._dead_letter_path(os.getpid()), 'a', encoding='utf-8') as f:
+            f.write(''.join(
+                json.dumps({"row": row, "error": str(error), "failed_at": failed_at}, ensure_ascii=False) + '\n'
+                for row, error in failures
+            ))
+            f.flush()
+            if SubmissionWriteBehind.SPILL_FSYNC:
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _write_spill(rows):
+        """Anexa as linhas ao spill deste processo e força a escrita em disco (chamado com o lock adquirido)."""
+        spill = SubmissionWriteBehind._spill
+        spill.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+        spill.flush()
+        if SubmissionWriteBehind.SPILL_FSYNC:
+            os.fsync(spill.fileno())
+
+    @staticmethod
+    def _rewrite_spill(rows):
+        """Substitui atomicamente o spill pelas linhas ainda pendentes (chamado com o lock adquirido)."""
+        path = SubmissionWriteBehind._spill_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            tmp.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+            tmp.flush()
+            if SubmissionWriteBehind.SPILL_FSYNC:
+                os.fsync(tmp.fileno())
+        SubmissionWriteBehind._spill.close()
+        os.replace(tmp_path, path)
+        SubmissionWriteBehind._spill = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _recover():
+        """
+        Incorpora à fila deste processo os spills deixados por processos que não estão mais vivos (chamado com o lock adquirido).
+        Cada spill órfão é antes reivindicado com um rename atômico para um nome deste processo: se outro processo
+        iniciando ao mesmo tempo chegar primeiro, o rename falha e o arquivo é deixado para ele.
+        """
+        pid = os.getpid()
+        # Spill de um processo morto que tinha o mesmo PID: as linhas já estão no arquivo, basta enfileirá-las.
+        own_path = SubmissionWriteBehind._spill_path(pid)
+        rows = SubmissionWriteBehind._read_spill(own_path)
+        SubmissionWriteBehind._buffer.extend(rows)
+        SubmissionWriteBehind._stats["recovered"] += len(rows)
+
+        for path in glob.glob(os.path.join(SubmissionWriteBehind.SPILL_DIR, "submissions-*.jsonl")):
+            owner = SubmissionWriteBehind._spill_owner(path)
+            if path == own_path or owner is None or (owner != pid and SubmissionWriteBehind._pid_alive(owner)):
+                continue
+
+            claimed = os.path.join(SubmissionWriteBehind.SPILL_DIR, f"submissions-{pid}-claimed-{uuid.uuid4().hex}.jsonl")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"Não foi possível reivindicar o spill {path}: {e}")
+                continue
+
+            rows = SubmissionWriteBehind._read_spill(claimed)
+            if rows:
+                SubmissionWriteBehind._write_spill(rows)
+                SubmissionWriteBehind._buffer.extend(rows)
+                SubmissionWriteBehind._stats["recovered"] += len(rows)
+                print(f"Recuperadas {len(rows)} submissões pendentes de {path}.")
+            os.remove(claimed)
+
+    @staticmethod
+    def _spill_owner(path):
+        """Retorna o PID do processo dono de um arquivo de spill (o original ou um reivindicado), ou None se o nome não for de spill."""
+        match = _SPILL_NAME_RE.fullmatch(os.path.basename(path))
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _read_spill(path):
+        """Lê as linhas de um arquivo de spill, ignorando uma última linha incompleta deixada por uma queda no meio da escrita."""
+        rows = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return rows
+
+    @staticmethod
+    def _pid_alive(pid):
+        """Indica se o processo ainda existe. No Windows não há verificação barata, então os spills são tratados como órfãos."""
+        if os.name == 'nt':
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @staticmethod
+    def _to_record(row):
+        """Converte a linha do spill nos valores da tabela submissions."""
+        record = dict(row)
+        record["submitted_at"] = datetime.fromisoformat(record["submitted_at"])
+        return record
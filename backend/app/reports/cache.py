@@ -0,0 +1,364 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from app.database import Session
+from app.database.models import Question, Enrollment, Class, ScenarioDatabase, ReportCacheTag
+from app.main.progress import upsert
+
+REPORT_DIMENSIONS = ('scenario_id', 'class_id', 'year_semester', 'question_id')
+# Ordem de preferência da etiqueta compartilhada de cada entrada: a dimensão mais seletiva entre os filtros.
+TAG_DIMENSIONS = ('question_id', 'class_id', 'scenario_id', 'year_semester')
+EPOCH_TAG = 'epoch'
+
+class ReportCache:
+    """
+    Cache dos relatórios, chaveado pelo endpoint e pelos filtros (scenario_id, class_id, year_semester, question_id).
+    Os filtros de cada entrada são também as suas etiquetas: uma submissão só invalida as entradas cujos filtros
+    ela satisfaz (mesma questão, mesmo cenário, turma e semestre do aluno). Com STALENESS_SECONDS > 0, uma entrada
+    invalidada ainda pode ser servida por até esse tempo, evitando recalcular o relatório a cada submissão nos
+    horários de aula; com 0, a invalidação é imediata.
+
+    Cada processo tem o seu cache, então as invalidações também são publicadas na tabela report_cache_tags:
+    cada entrada depende da etiqueta 'epoch' e da dimensão mais seletiva dos seus filtros (sem filtros, das etiquetas
+    de todos os cenários), e guarda as gerações lidas antes do cálculo. Um acerto só é servido se as gerações não
+    mudaram; assim a submissão gravada por um worker invalida o relatório em cache nos demais. Como toda mudança
+    que afeta uma entrada casa com todos os seus filtros, ela sempre incrementa a etiqueta da entrada.
+    Para não escrever no banco a cada submissão, as etiquetas a incrementar se acumulam por SHARED_PUBLISH_SECONDS
+    e são publicadas num único upsert; as gerações lidas ficam em memória por SHARED_READ_TTL_SECONDS. Entre
+    processos, uma submissão leva até a soma dos dois tempos para invalidar os relatórios.
+    """
+
+    MAXSIZE = int(os.getenv('REPORT_CACHE_MAXSIZE', 256))
+    TTL_SECONDS = float(os.getenv('REPORT_CACHE_TTL_SECONDS', 300))
+    STALENESS_SECONDS = float(os.getenv('REPORT_CACHE_STALENESS_SECONDS', 0))
+    SHARED_INVALIDATION = os.getenv('REPORT_CACHE_SHARED_INVALIDATION', 'true').lower() != 'false'
+    SHARED_PUBLISH_SECONDS = float(os.getenv('REPORT_CACHE_SHARED_PUBLISH_SECONDS', 1))
+    SHARED_READ_TTL_SECONDS = float(os.getenv('REPORT_CACHE_SHARED_READ_TTL_SECONDS', 1))
+
+    _lock = threading.Lock()
+    _entries = OrderedDict()
+    _generation = 0
+    _stats = {"hits": 0, "stale_hits": 0, "misses": 0, "invalidations": 0, "evictions": 0, "shared_publishes": 0, "shared_reads": 0, "shared_errors": 0}
+    _pending_tags = set()
+    _pending_pairs = set()
+    _publish_timer = None
+    _generations = {}
+    _scenario_tags = (None, 0.0)
+
+    @staticmethod
+    def get_or_compute(endpoint, filters, compute):
+        """
+        Retorna o relatório em cache para o endpoint e filtros, ou o calcula com compute() -> (sucesso, resultado).
+        Apenas resultados de sucesso são armazenados.
+        """
+        filters = {dim: filters.get(dim) for dim in REPORT_DIMENSIONS if dim in filters}
+        key = (endpoint, tuple(sorted(filters.items())))
+        now = time.monotonic()
+        with ReportCache._lock:
+            entry = ReportCache._entries.get(key)
+            fresh = entry is not None and ReportCache._is_fresh(entry, now)
+
+        # A consulta das gerações compartilhadas fica fora do lock; entradas já invalidadas não precisam dela.
+        if fresh and entry["dirty_since"] is None and ReportCache.SHARED_INVALIDATION:
+            fresh = ReportCache._shared_fresh(key, entry, now)
+
+        with ReportCache._lock:
+            if fresh:
+                if key in ReportCache._entries:
+                    ReportCache._entries.move_to_end(key)
+                ReportCache._stats["stale_hits" if entry["dirty_since"] is not None else "hits"] += 1
+                return True, entry["value"]
+            if entry is not None and ReportCache._entries.get(key) is entry:
+                del ReportCache._entries[key]
+            ReportCache._stats["misses"] += 1
+            generation = ReportCache._generation
+
+        # As gerações são lidas antes do cálculo: uma invalidação em outro processo durante o cálculo as altera.
+        shared = ReportCache._read_tags(ReportCache._entry_tags(filters)) if ReportCache.SHARED_INVALIDATION else {}
+        success, result = compute()
+        if not success or shared is None:
+            return success, result
+
+        with ReportCache._lock:
+            # Uma invalidação durante o cálculo pode não estar refletida no resultado: ele já nasce invalidado.
+            dirty_since = None if generation == ReportCache._generation else now
+            ReportCache._entries[key] = {"value": result, "filters": filters, "tags": shared, "created": now, "dirty_since": dirty_since}
+            ReportCache._entries.move_to_end(key)
+            while len(ReportCache._entries) > ReportCache.MAXSIZE:
+                ReportCache._entries.popitem(last=False)
+                ReportCache._stats["evictions"] += 1
+        return success, result
+
+    @staticmethod
+    def invalidate_submissions(pairs):
+        """
+        Invalida os relatórios afetados por submissões gravadas, informadas como pares (student_id, question_id).
+        Busca o cenário de cada questão e as turmas/semestres de cada aluno para casar com os filtros das entradas.
+        """
+        pairs = {(int(student_id), int(question_id)) for student_id, question_id in pairs}
+        if not pairs:
+            return 0
+        if not ReportCache._entries:
+            # Sem entradas locais, as etiquetas só são resolvidas na publicação, junto com as das outras submissões.
+            ReportCache._publish(pairs=pairs)
+            return 0
+
+        try:
+            events = ReportCache._resolve_events(pairs)
+        except SQLAlchemyError as e:
+            print(f"Falha ao resolver as etiquetas dos relatórios, limpando o cache: {e}")
+            ReportCache._publish(pairs=pairs)
+            return ReportCache._invalidate(lambda filters: True)
+
+        ReportCache._publish(tags=ReportCache._event_tags(events))
+        return ReportCache._invalidate(lambda filters: any(ReportCache._affects(filters, event) for event in events))
+
+    @staticmethod
+    def invalidate(**event):
+        """
+        Invalida as entradas afetadas por uma mudança descrita por dimensões (ex.: scenario_id=1, question_id=10);
+        dimensões não informadas valem para qualquer valor. Sem argumentos, invalida tudo.
+        """
+        event = {dim: {value} for dim, value in event.items()}
+        # Mudanças de cenário/questão são raras: nos outros processos, invalidam todas as entradas.
+        ReportCache._publish(tags={EPOCH_TAG})
+        return ReportCache._invalidate(lambda filters: ReportCache._affects(filters, event))
+
+    @staticmethod
+    def invalidate_class(class_id):
+        """
+        Invalida os relatórios que dependem das matrículas ou do semestre de uma turma: os filtrados por essa turma
+        e os filtrados apenas por semestre. Relatórios sem filtro de turma/semestre não consultam matrículas.
+        """
+        ReportCache._publish(tags={EPOCH_TAG})
+        return ReportCache._invalidate(
+            lambda filters: filters.get('class_id') == class_id
+            or (filters.get('class_id') is None and filters.get('year_semester') is not None)
+        )
+
+    @staticmethod
+    def stats():
+        """Retorna as estatísticas de uso do cache de relatórios."""
+        with ReportCache._lock:
+            stats = ReportCache._stats
+            total = stats["hits"] + stats["stale_hits"] + stats["misses"]
+            return {
+                **stats,
+                "size": len(ReportCache._entries),
+                "maxsize": ReportCache.MAXSIZE,
+                "ttl_seconds": ReportCache.TTL_SECONDS,
+                "staleness_seconds": ReportCache.STALENESS_SECONDS,
+                "shared_invalidation": ReportCache.SHARED_INVALIDATION,
+                "shared_pending_tags": len(ReportCache._pending_tags) + len(ReportCache._pending_pairs),
+                "hit_rate_percentage": round((stats["hits"] + stats["stale_hits"]) / total * 100, 2) if total > 0 else 0.0
+            }
+
+    @staticmethod
+    def _invalidate(predicate):
+        """Marca (ou remove, sem tolerância de atraso) as entradas cujos filtros satisfazem o predicado."""
+        now = time.monotonic()
+        with ReportCache._lock:
+            ReportCache._generation += 1
+            affected = [
+                key for key, entry in ReportCache._entries.items()
+                if entry["dirty_since"] is None and predicate(entry["filters"])
+            ]
+            for key in affected:
+                if ReportCache.STALENESS_SECONDS > 0:
+                    ReportCache._entries[key]["dirty_since"] = now
+                else:
+                    del ReportCache._entries[key]
+            ReportCache._stats["invalidations"] += len(affected)
+            return len(affected)
+
+    @staticmethod
+    def _shared_fresh(key, entry, now):
+        """
+        Confere as gerações compartilhadas de uma entrada localmente válida. Se outro processo as incrementou,
+        a entrada é marcada como invalidada (ou removida) e só é servida dentro do atraso tolerado.
+        """
+        current = ReportCache._read_tags(entry["tags"].keys())
+        if current == entry["tags"]:
+            return True
+        with ReportCache._lock:
+            if current is not None:
+                ReportCache._stats["invalidations"] += 1
+            if ReportCache.STALENESS_SECONDS > 0 and current is not None:
+                entry["dirty_since"] = now
+                return True
+            if ReportCache._entries.get(key) is entry:
+                del ReportCache._entries[key]
+            return False
+
+    @staticmethod
+    def _read_tags(tags):
+        """
+        Retorna as gerações das etiquetas (0 para as ainda não criadas), lendo do banco, numa única consulta, só as que
+        não foram lidas nos últimos SHARED_READ_TTL_SECONDS; None se as etiquetas ou a leitura falharem.
+        """
+        if tags is None:
+            return None
+        now = time.monotonic()
+        with ReportCache._lock:
+            cached = {tag: ReportCache._generations.get(tag) for tag in tags}
+        missing = [tag for tag, value in cached.items() if value is None or now - value[1] >= ReportCache.SHARED_READ_TTL_SECONDS]
+        if missing:
+            try:
+                with Session() as session:
+                    stored = dict(session.query(ReportCacheTag.tag, ReportCacheTag.generation).filter(
+                        ReportCacheTag.tag.in_(missing)
+                    ).all())
+            except SQLAlchemyError as e:
+                print(f"Falha ao ler as etiquetas do cache de relatórios: {e}")
+                with ReportCache._lock:
+                    ReportCache._stats["shared_errors"] += 1
+                return None
+            with ReportCache._lock:
+                ReportCache._stats["shared_reads"] += 1
+                for tag in missing:
+                    cached[tag] = ReportCache._generations[tag] = (stored.get(tag, 0), now)
+        return {tag: value[0] for tag, value in cached.items()}
+
+    @staticmethod
+    def _publish(tags=(), pairs=()):
+        """
+        Agenda o incremento das etiquetas (e das etiquetas resolvidas a partir dos pares (student_id, question_id))
+        no banco. Os pedidos que chegam em SHARED_PUBLISH_SECONDS são publicados juntos por _flush_published.
+        """
+        if not ReportCache.SHARED_INVALIDATION:
+            return
+        if not ReportCache._enqueue(tags, pairs):
+            ReportCache._flush_published()
+
+    @staticmethod
+    def _enqueue(tags, pairs):
+        """Acumula os pedidos de publicação e agenda a próxima; retorna False se a publicação deve ser imediata."""
+        with ReportCache._lock:
+            ReportCache._pending_tags.update(tags)
+            ReportCache._pending_pairs.update(pairs)
+            if ReportCache._publish_timer is not None:
+                return True
+            if ReportCache.SHARED_PUBLISH_SECONDS <= 0:
+                return False
+            ReportCache._publish_timer = threading.Timer(ReportCache.SHARED_PUBLISH_SECONDS, ReportCache._flush_published)
+            ReportCache._publish_timer.daemon = True
+            ReportCache._publish_timer.start()
+            return True
+
+    @staticmethod
+    def _flush_published():
+        """
+        Publica as etiquetas pendentes num único upsert que incrementa as suas gerações, invalidando as entradas
+        dependentes em todos os processos. Se o banco falhar, os pedidos voltam para a fila da próxima publicação.
+        """
+        with ReportCache._lock:
+            tags, pairs = ReportCache._pending_tags, ReportCache._pending_pairs
+            ReportCache._pending_tags, ReportCache._pending_pairs = set(), set()
+            ReportCache._publish_timer = None
+        if not tags and not pairs:
+            return
+
+        try:
+            if pairs:
+                tags = tags | ReportCache._event_tags(ReportCache._resolve_events(pairs))
+            with Session() as session:
+                # Ordem fixa das chaves para que incrementos concorrentes não entrem em deadlock.
+                upsert(
+                    session, ReportCacheTag.__table__,
+                    [{"tag": tag, "generation": 1} for tag in sorted(tags)],
+                    lambda table, incoming: {"generation": table.c.generation + 1, "updated_at": func.now()}
+                )
+                session.commit()
+        except SQLAlchemyError as e:
+            print(f"Falha ao publicar a invalidação do cache de relatórios: {e}")
+            with ReportCache._lock:
+                ReportCache._stats["shared_errors"] += 1
+            ReportCache._enqueue(tags, pairs)
+            return
+        with ReportCache._lock:
+            ReportCache._stats["shared_publishes"] += 1
+
+    @staticmethod
+    def _resolve_events(pairs):
+        """
+        Descreve cada submissão pelas dimensões que ela afeta: a questão, o cenário da questão e as turmas/semestres
+        do aluno. Levanta SQLAlchemyError se a consulta falhar.
+        """
+        with Session() as session:
+            scenarios = dict(session.query(Question.id, Question.scenario_database_id).filter(
+                Question.id.in_({question_id for _, question_id in pairs})
+            ).all())
+            classes = {}
+            for student_id, class_id, year_semester in session.query(
+                Enrollment.student_id, Class.id, Class.year_semester
+            ).join(Class, Enrollment.class_id == Class.id).filter(
+                Enrollment.student_id.in_({student_id for student_id, _ in pairs})
+            ).all():
+                classes.setdefault(student_id, []).append((class_id, year_semester))
+
+        events = []
+        for student_id, question_id in pairs:
+            student_classes = classes.get(student_id, [])
+            events.append({
+                "question_id": {question_id},
+                "scenario_id": {scenarios.get(question_id)},
+                "class_id": {class_id for class_id, _ in student_classes},
+                "year_semester": {year_semester for _, year_semester in student_classes}
+            })
+        return events
+
+    @staticmethod
+    def _event_tags(events):
+        """Etiquetas incrementadas pelas mudanças: uma por valor de cada dimensão afetada."""
+        return {ReportCache._tag(dim, value) for event in events for dim, values in event.items() for value in values if value is not None}
+
+    @staticmethod
+    def _entry_tags(filters):
+        """
+        Etiquetas compartilhadas de que a entrada depende: 'epoch' e a da dimensão mais seletiva dos filtros; sem filtros,
+        as de todos os cenários (toda questão pertence a um). Retorna None se os cenários não puderem ser lidos.
+        """
+        for dim in TAG_DIMENSIONS:
+            if filters.get(dim) is not None:
+                return (ReportCache._tag(dim, filters[dim]), EPOCH_TAG)
+
+        scenario_tags, read_at = ReportCache._scenario_tags
+        if scenario_tags is None or time.monotonic() - read_at >= ReportCache.SHARED_READ_TTL_SECONDS:
+            try:
+                with Session() as session:
+                    scenario_tags = tuple(ReportCache._tag('scenario_id', scenario_id) for scenario_id, in session.query(ScenarioDatabase.id).all())
+            except SQLAlchemyError as e:
+                print(f"Falha ao ler os cenários do cache de relatórios: {e}")
+                return None
+            ReportCache._scenario_tags = (scenario_tags, time.monotonic())
+        return (*scenario_tags, EPOCH_TAG)
+
+    @staticmethod
+    def _tag(dim, value):
+        """Nome da etiqueta de uma dimensão, no limite da coluna report_cache_tags.tag."""
+        return f"{dim}={value}"[:64]
+
+    @staticmethod
+    def _affects(filters, event):
+        """Indica se a mudança pode alterar um relatório com esses filtros."""
+        for dim, value in filters.items():
+            if value is None:
+                continue
+            values = event.get(dim)
+            if values is not None and value not in values:
+                return False
+        return True
+
+    @staticmethod
+    def _is_fresh(entry, now):
+        """Indica se a entrada pode ser servida: dentro do TTL e, se invalidada, dentro do atraso tolerado."""
+        if now - entry["created"] > ReportCache.TTL_SECONDS:
+            return False
+        return entry["dirty_since"] is None or now - entry["dirty_since"] < ReportCache.STALENESS_SECONDS
+
+# Publica as invalidações ainda pendentes quando o processo termina.
+atexit.register(ReportCache._flush_published)
@@ -1,6 +1,7 @@
 from flask import request, jsonify, Blueprint
 from flask_jwt_extended import get_jwt
 from .services import ReportService
+from .cache import ReportCache
 from app.auth.decorators import role_required
 
 reports_bp = Blueprint('reports', __name__)
@@ -31,11 +32,11 @@ def get_global_metrics():
     year_semester = request.args.get('year_semester', type=str)
     question_id = request.args.get('question_id', type=int)
 
-    success, result = ReportService.get_question_metrics(
-        scenario_id=scenario_id, 
-        class_id=class_id, 
-        year_semester=year_semester, 
-        question_id=question_id
+    filters = {"scenario_id": scenario_id, "class_id": class_id, "year_semester": year_semester, "question_id": question_id}
+    success, result = ReportCache.get_or_compute(
+        'questions/metrics',
+        filters,
+        lambda: ReportService.get_question_metrics(**filters)
     )
     
     if success:
@@ -115,6 +116,28 @@ def get_student_progress(student_id):
         return jsonify(result), 200
     return jsonify(result), 500
 
+@reports_bp.route('/progress/matrix', methods=['GET'])
+@role_required('admin', 'teacher')
+def get_progress_matrix():
+    """
+    Retorna a matriz de progresso alunos × cenários de uma turma ou lista de alunos, em uma única requisição.
+    Query Params: ?class_id=3 ou ?student_ids=1,2,3 & page=1 & per_page=50 (máximo 200)
+    """
+    class_id = request.args.get('class_id', type=int)
+    raw_ids = request.args.get('student_ids', '', type=str)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+
+    try:
+        student_ids = [int(i) for i in raw_ids.split(',') if i.strip()]
+    except ValueError:
+        return jsonify({"error": "student_ids deve ser uma lista de ids separados por vírgula."}), 400
+
+    success, result = ReportService.get_progress_matrix(class_id, student_ids, page, per_page)
+    if success:
+        return jsonify(result), 200
+    return jsonify(result), 400 if not class_id and not student_ids else 500
+
 @reports_bp.route('/students/<int:student_id>/questions/<int:question_id>/engagement', methods=['GET'])
 @role_required('admin', 'teacher')
 def get_student_question_engagement(student_id, question_id):
@@ -134,13 +157,23 @@ def get_class_questions_detail(class_id):
     Mostra quais alunos acertaram, erraram, o tempo que levaram e métricas como 
     taxa de acerto e tentativas médias antes do acerto.
     """
-    success, result = ReportService.get_class_questions_detail(class_id)
+    success, result = ReportCache.get_or_compute(
+        'classes/questions/details',
+        {"class_id": class_id},
+        lambda: ReportService.get_class_questions_detail(class_id)
+    )
     
     if success:
         return jsonify(result), 200
     
     return jsonify(result), 500
 
+@reports_bp.route('/cache/stats', methods=['GET'])
+@role_required('admin')
+def get_report_cache_stats():
+    """Retorna as estatísticas do cache de relatórios: acertos, acertos com atraso tolerado, invalidações e tamanho."""
+    return jsonify(ReportCache.stats()), 200
+
 @reports_bp.route('/<slug>/progress-submissions', methods=['GET'])
 @role_required('student')
 def get_progress_submissions(slug):
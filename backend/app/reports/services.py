@@ -1,7 +1,8 @@
-from sqlalchemy import func, distinct, case
+from sqlalchemy import func, case, over
 from sqlalchemy.exc import SQLAlchemyError
 from app.database import Session
-from app.database.models import ScenarioDatabase, Question, Submission, Enrollment, Class
+from app.database.models import ScenarioDatabase, Question, Submission, Enrollment, Class, Student, StudentQuestionProgress, QuestionClassMetrics
+from app.main.progress import ProgressRollup
 
 class ReportService:
     """
@@ -12,56 +13,99 @@ class ReportService:
     def get_question_metrics(scenario_id=None, class_id=None, year_semester=None, question_id=None):
         """
         Retorna métricas detalhadas de acerto, tempo e tentativas por questão, com filtros opcionais.
+        Com filtro de turma ou semestre, soma as células do cubo question_class_metrics; sem eles, soma o resumo
+        de progresso. Alunos matriculados em mais de uma turma do semestre são contados uma única vez.
         """
         try:
             with Session() as session:
-                is_truly_correct = (Submission.is_correct == True) & (Submission.submitted_query != 'SKIP')
-
-                query = session.query(
-                    Submission.question_id,
-                    func.count(Submission.id).label('total_attempts'),
-                    func.sum(case((is_truly_correct, 1), else_=0)).label('correct_attempts'),
-                    func.avg(Submission.time_spent_seconds).label('avg_time_spent'),
-                    func.count(distinct(Submission.student_id)).label('students_attempted'),
-                    func.count(distinct(case((is_truly_correct, Submission.student_id), else_=None))).label('students_correct')
-                ).join(Question, Submission.question_id == Question.id)
-
                 if class_id or year_semester:
-                    query = query.join(Enrollment, Submission.student_id == Enrollment.student_id)
-                    query = query.join(Class, Enrollment.class_id == Class.id)
-                    if class_id:
-                        query = query.filter(Class.id == class_id)
-                    if year_semester:
-                        query = query.filter(Class.year_semester == year_semester)
+                    source = QuestionClassMetrics
+                    students_attempted = func.sum(QuestionClassMetrics.students_attempted)
+                    students_correct = func.sum(QuestionClassMetrics.students_correct)
+                else:
+                    source = StudentQuestionProgress
+                    students_attempted = func.count()
+                    students_correct = func.count(StudentQuestionProgress.first_correct_submission_id)
 
+                query = session.query(
+                    source.question_id,
+                    func.sum(source.attempts).label('total_attempts'),
+                    func.sum(source.correct_attempts).label('correct_attempts'),
+                    func.sum(source.total_time_seconds).label('total_time_seconds'),
+                    students_attempted.label('students_attempted'),
+                    students_correct.label('students_correct')
+                ).join(Question, source.question_id == Question.id)
+
+                if class_id:
+                    query = query.filter(QuestionClassMetrics.class_id == class_id)
+                if year_semester:
+                    query = query.filter(QuestionClassMetrics.year_semester == year_semester)
                 if scenario_id:
                     query = query.filter(Question.scenario_database_id == scenario_id)
                 if question_id:
-                    query = query.filter(Submission.question_id == question_id)
+                    query = query.filter(source.question_id == question_id)
 
-                query = query.group_by(Submission.question_id)
-                results = query.all()
+                totals = {
+                    row.question_id: [int(value or 0) for value in row[1:]]
+                    for row in query.group_by(source.question_id).order_by(source.question_id).all()
+                }
+                if year_semester and not class_id:
+                    for row in ReportService._semester_overlap(session, year_semester, scenario_id, question_id):
+                        if row.question_id in totals:
+                            totals[row.question_id] = [
+                                total - int(extra or 0) for total, extra in zip(totals[row.question_id], row[1:])
+                            ]
 
                 metrics = []
-                for row in results:
-                    total_attempts = row.total_attempts or 0
-                    students_attempted = row.students_attempted or 1
-                    
+                for qid, (total_attempts, correct_attempts, total_time, attempted, correct) in totals.items():
+                    if total_attempts <= 0:
+                        continue
                     metrics.append({
-                        "question_id": row.question_id,
+                        "question_id": qid,
                         "total_attempts": total_attempts,
-                        "correct_attempts": int(row.correct_attempts or 0),
-                        "accuracy_percentage": round((row.correct_attempts / total_attempts * 100), 2) if total_attempts > 0 else 0.0,
-                        "avg_time_spent_seconds": round(row.avg_time_spent or 0, 2),
-                        "avg_attempts_per_student": round(total_attempts / students_attempted, 2),
-                        "students_attempted": row.students_attempted,
-                        "students_correct": row.students_correct
+                        "correct_attempts": correct_attempts,
+                        "accuracy_percentage": round((correct_attempts / total_attempts * 100), 2),
+                        "avg_time_spent_seconds": round(total_time / total_attempts, 2),
+                        "avg_attempts_per_student": round(total_attempts / (attempted or 1), 2),
+                        "students_attempted": attempted,
+                        "students_correct": correct
                     })
 
                 return True, metrics
         except SQLAlchemyError as e:
             return False, {"error": f"Erro ao gerar métricas de questões: {str(e)}"}
 
+    @staticmethod
+    def _semester_overlap(session, year_semester, scenario_id=None, question_id=None):
+        """
+        Retorna, por questão, o quanto as células do semestre contam a mais por causa dos alunos matriculados em
+        mais de uma turma dele: o resumo de cada um desses alunos multiplicado pelas turmas excedentes.
+        """
+        extra_classes = session.query(
+            Enrollment.student_id,
+            (func.count() - 1).label('extra')
+        ).join(Class, Enrollment.class_id == Class.id).filter(
+            Class.year_semester == year_semester
+        ).group_by(Enrollment.student_id).having(func.count() > 1).subquery()
+
+        extra = extra_classes.c.extra
+        query = session.query(
+            StudentQuestionProgress.question_id,
+            func.sum(StudentQuestionProgress.attempts * extra),
+            func.sum(StudentQuestionProgress.correct_attempts * extra),
+            func.sum(StudentQuestionProgress.total_time_seconds * extra),
+            func.sum(extra),
+            func.sum(case((ProgressRollup.solved(), extra), else_=0))
+        ).join(
+            extra_classes, StudentQuestionProgress.student_id == extra_classes.c.student_id
+        ).join(Question, StudentQuestionProgress.question_id == Question.id)
+
+        if scenario_id:
+            query = query.filter(Question.scenario_database_id == scenario_id)
+        if question_id:
+            query = query.filter(StudentQuestionProgress.question_id == question_id)
+        return query.group_by(StudentQuestionProgress.question_id).all()
+
     @staticmethod
     def get_user_last_correct_submissions(student_id, question_id=None, scenario_id=None):
         """ 
@@ -73,13 +117,9 @@ class ReportService:
 
         try:
             with Session() as session:
-                subquery = session.query(func.max(Submission.id).label('max_id')).filter(
-                    Submission.student_id == student_id,
-                    Submission.is_correct == True,
-                    Submission.submitted_query != 'SKIP'
-                ).group_by(Submission.question_id).subquery()
-
-                query = session.query(Submission).join(subquery, Submission.id == subquery.c.max_id)
+                query = session.query(Submission).join(
+                    StudentQuestionProgress, Submission.id == StudentQuestionProgress.last_correct_submission_id
+                ).filter(StudentQuestionProgress.student_id == student_id)
 
                 if scenario_id:
                     query = query.join(Question, Submission.question_id == Question.id)\
@@ -105,20 +145,21 @@ class ReportService:
         try:
             with Session() as session:
                 result = session.query(
-                    func.count(Submission.id).label('total_attempts'),
-                    func.sum(Submission.time_spent_seconds).label('total_time'),
-                    func.avg(Submission.time_spent_seconds).label('avg_time')
+                    StudentQuestionProgress.attempts,
+                    StudentQuestionProgress.total_time_seconds
                 ).filter(
-                    Submission.student_id == student_id,
-                    Submission.question_id == question_id
+                    StudentQuestionProgress.student_id == student_id,
+                    StudentQuestionProgress.question_id == question_id
                 ).first()
+                total_attempts = result.attempts if result else 0
+                total_time = result.total_time_seconds if result else 0
 
                 return True, {
                     "question_id": question_id,
                     "student_id": student_id,
-                    "total_attempts": result.total_attempts or 0,
-                    "total_time_spent_seconds": result.total_time or 0,
-                    "avg_time_spent_seconds": round(result.avg_time or 0, 2)
+                    "total_attempts": total_attempts,
+                    "total_time_spent_seconds": total_time,
+                    "avg_time_spent_seconds": round(total_time / total_attempts, 2) if total_attempts else 0
                 }
         except SQLAlchemyError as e:
             return False, {"error": f"Erro ao buscar engajamento: {str(e)}"}
@@ -137,19 +178,18 @@ class ReportService:
                 total_time_seconds = 0
 
                 if student_id:
-                    s_query = session.query(func.count(distinct(Submission.question_id))).filter(
-                        Submission.student_id == student_id,
-                        Submission.is_correct == True,
-                        Submission.submitted_query != 'SKIP'
+                    s_query = session.query(func.count()).select_from(StudentQuestionProgress).filter(
+                        StudentQuestionProgress.student_id == student_id,
+                        ProgressRollup.solved()
                     )
                     
-                    time_query = session.query(func.sum(Submission.time_spent_seconds)).filter(
-                        Submission.student_id == student_id
+                    time_query = session.query(func.sum(StudentQuestionProgress.total_time_seconds)).filter(
+                        StudentQuestionProgress.student_id == student_id
                     )
 
                     if scenario_id:
-                        s_query = s_query.join(Question).filter(Question.scenario_database_id == scenario_id)
-                        time_query = time_query.join(Question).filter(Question.scenario_database_id == scenario_id)
+                        s_query = s_query.join(Question, StudentQuestionProgress.question_id == Question.id).filter(Question.scenario_database_id == scenario_id)
+                        time_query = time_query.join(Question, StudentQuestionProgress.question_id == Question.id).filter(Question.scenario_database_id == scenario_id)
 
                     solved_questions = s_query.scalar() or 0
                     total_time_seconds = time_query.scalar() or 0
@@ -165,94 +205,153 @@ class ReportService:
         except SQLAlchemyError as e:
             return False, {"error": f"Erro ao buscar progresso: {str(e)}"}
 
+    @staticmethod
+    def get_progress_matrix(class_id=None, student_ids=None, page=1, per_page=50):
+        """
+        Retorna a matriz alunos × cenários de progresso de uma turma ou de uma lista de alunos, paginada por aluno.
+        Cada célula tem o mesmo formato de get_progress_summary; o progresso de todos os alunos da página
+        vem de uma única consulta agrupada sobre student_question_progress.
+        """
+        if not class_id and not student_ids:
+            return False, {"error": "Informe class_id ou student_ids."}
+
+        try:
+            with Session() as session:
+                students = session.query(Student.id, Student.name, Student.registration_number)
+                if class_id:
+                    students = students.join(Enrollment, Enrollment.student_id == Student.id).filter(Enrollment.class_id == class_id)
+                if student_ids:
+                    students = students.filter(Student.id.in_(student_ids))
+                total_students = students.count()
+                students = students.order_by(Student.id).offset((page - 1) * per_page).limit(per_page).all()
+
+                scenarios = session.query(
+                    ScenarioDatabase.id,
+                    ScenarioDatabase.name,
+                    func.count(Question.id).label('total_questions')
+                ).outerjoin(
+                    Question, Question.scenario_database_id == ScenarioDatabase.id
+                ).group_by(ScenarioDatabase.id, ScenarioDatabase.name).order_by(ScenarioDatabase.id).all()
+
+                cells = {}
+                if students:
+                    rows = session.query(
+                        StudentQuestionProgress.student_id,
+                        Question.scenario_database_id,
+                        func.sum(case((ProgressRollup.solved(), 1), else_=0)).label('solved'),
+                        func.sum(StudentQuestionProgress.total_time_seconds).label('total_time')
+                    ).join(
+                        Question, StudentQuestionProgress.question_id == Question.id
+                    ).filter(
+                        StudentQuestionProgress.student_id.in_([s.id for s in students])
+                    ).group_by(StudentQuestionProgress.student_id, Question.scenario_database_id).all()
+                    cells = {(row.student_id, row.scenario_database_id): row for row in rows}
+
+                total_questions = sum(sc.total_questions for sc in scenarios)
+                matrix = []
+                for student in students:
+                    progress = []
+                    for scenario in scenarios:
+                        cell = cells.get((student.id, scenario.id))
+                        progress.append(ReportService._progress_cell(
+                            student.id, scenario.id, scenario.total_questions,
+                            int(cell.solved or 0) if cell else 0, int(cell.total_time or 0) if cell else 0
+                        ))
+                    matrix.append({
+                        "student_id": student.id,
+                        "name": student.name,
+                        "registration_number": student.registration_number,
+                        "global": ReportService._progress_cell(
+                            student.id, "all", total_questions,
+                            sum(p["total_solved_questions"] for p in progress), sum(p["total_time_seconds"] for p in progress)
+                        ),
+                        "scenarios": progress
+                    })
+
+                return True, {
+                    "scenarios": [{"id": sc.id, "name": sc.name, "total_questions": sc.total_questions} for sc in scenarios],
+                    "students": matrix,
+                    "page": page,
+                    "per_page": per_page,
+                    "total_students": total_students
+                }
+        except SQLAlchemyError as e:
+            return False, {"error": f"Erro ao gerar matriz de progresso: {str(e)}"}
+
+    @staticmethod
+    def _progress_cell(student_id, scenario_id, total_questions, solved_questions, total_time_seconds):
+        """Monta uma célula da matriz no formato de get_progress_summary."""
+        return {
+            "scenario_id": scenario_id,
+            "student_id": student_id,
+            "total_available_questions": total_questions,
+            "total_solved_questions": solved_questions,
+            "total_time_seconds": total_time_seconds,
+            "completion_percentage": round((solved_questions / total_questions * 100), 2) if total_questions > 0 else 0.0
+        }
+
     @staticmethod
     def get_class_questions_detail(class_id):
-        """Retorna o detalhamento por questão de uma turma específica."""
+        """
+        Retorna o detalhamento por questão de uma turma específica.
+        Lê um resumo por (questão, aluno) de student_question_progress; as métricas da questão vêm de agregações
+        em janela (PARTITION BY question_id) na mesma consulta, sem trazer as submissões para o Python.
+        """
         if not class_id:
             return False, {"error": "ID da turma é obrigatório."}
 
         try:
             with Session() as session:
-                submissions = session.query(
-                    Submission.id,
-                    Submission.question_id,
-                    Submission.student_id,
-                    Submission.is_correct,
-                    Submission.time_spent_seconds,
-                    Submission.submitted_query,
-                    Submission.submitted_at
+                P = StudentQuestionProgress
+                solved = ProgressRollup.solved()
+                rows = session.query(
+                    P.question_id,
+                    P.student_id,
+                    P.attempts,
+                    P.first_correct_at,
+                    P.first_correct_time_spent_seconds,
+                    solved.label('is_correct'),
+                    over(func.sum(P.attempts), partition_by=P.question_id).label('total_class_attempts'),
+                    over(func.count(), partition_by=P.question_id).label('students_attempted'),
+                    over(func.sum(case((solved, 1), else_=0)), partition_by=P.question_id).label('students_correct'),
+                    over(func.avg(case((solved, P.first_correct_time_spent_seconds), else_=None)), partition_by=P.question_id).label('avg_time_to_correct'),
+                    over(func.avg(case((solved, P.attempts), else_=None)), partition_by=P.question_id).label('avg_attempts_to_correct')
                 ).join(
-                    Enrollment, Submission.student_id == Enrollment.student_id
+                    Enrollment, P.student_id == Enrollment.student_id
                 ).filter(
                     Enrollment.class_id == class_id
-                ).order_by(
-                    Submission.question_id, 
-                    Submission.student_id, 
-                    Submission.id.asc()
-                ).all()
-
-                questions_report = {}
-
-                for sub in submissions:
-                    q_id = sub.question_id
-                    s_id = sub.student_id
-
-                    if q_id not in questions_report:
-                        questions_report[q_id] = {
-                            "question_id": q_id,
-                            "total_class_attempts": 0,
-                            "students_data": {} 
-                        }
-
-                    q_data = questions_report[q_id]
-                    q_data["total_class_attempts"] += 1
+                ).order_by(P.question_id, P.student_id).all()
 
-                    if s_id not in q_data["students_data"]:
-                        q_data["students_data"][s_id] = {
-                            "student_id": s_id,
-                            "total_attempts": 0,
-                            "is_correct": False,
-                            "correct_time_spent_seconds": None,
-                            "correct_timestamp": None
-                        }
-
-                    student_data = q_data["students_data"][s_id]
-                    student_data["total_attempts"] += 1
-
-                    is_real_success = sub.is_correct and sub.submitted_query != 'SKIP'
-
-                    if is_real_success and not student_data["is_correct"]:
-                        student_data["is_correct"] = True
-                        student_data["correct_time_spent_seconds"] = sub.time_spent_seconds
-                        if sub.submitted_at:
-                            student_data["correct_timestamp"] = sub.submitted_at.isoformat()
-            
                 final_report = []
-                for q_id, q_data in questions_report.items():
-                    students_list = list(q_data["students_data"].values())
-                    correct_students = [s for s in students_list if s["is_correct"]]
-                    incorrect_students = [s for s in students_list if not s["is_correct"]]
-                    
-                    correct_times = [s["correct_time_spent_seconds"] for s in correct_students if s["correct_time_spent_seconds"] is not None]
-                    avg_correct_time = sum(correct_times) / len(correct_times) if correct_times else 0
-                    
-                    attempts_until_correct = [s["total_attempts"] for s in correct_students]
-                    avg_attempts_to_correct = sum(attempts_until_correct) / len(attempts_until_correct) if attempts_until_correct else 0
-
-                    final_report.append({
-                        "question_id": q_id,
-                        "metrics": {
-                            "total_class_attempts": q_data["total_class_attempts"],
-                            "students_attempted_count": len(students_list),
-                            "students_correct_count": len(correct_students),
-                            "accuracy_rate_percentage": round((len(correct_students) / len(students_list)) * 100, 2) if students_list else 0,
-                            "avg_time_to_correct_seconds": round(avg_correct_time, 2),
-                            "avg_attempts_to_correct": round(avg_attempts_to_correct, 2)
-                        },
-                        "students": {
-                            "correct_submissions": correct_students,
-                            "still_trying": incorrect_students
+                current = None
+                for row in rows:
+                    if current is None or current["question_id"] != row.question_id:
+                        students_attempted = row.students_attempted
+                        students_correct = int(row.students_correct or 0)
+                        current = {
+                            "question_id": row.question_id,
+                            "metrics": {
+                                "total_class_attempts": int(row.total_class_attempts or 0),
+                                "students_attempted_count": students_attempted,
+                                "students_correct_count": students_correct,
+                                "accuracy_rate_percentage": round((students_correct / students_attempted) * 100, 2) if students_attempted else 0,
+                                "avg_time_to_correct_seconds": round(float(row.avg_time_to_correct or 0), 2),
+                                "avg_attempts_to_correct": round(float(row.avg_attempts_to_correct or 0), 2)
+                            },
+                            "students": {
+                                "correct_submissions": [],
+                                "still_trying": []
+                            }
                         }
+                        final_report.append(current)
+
+                    is_correct = bool(row.is_correct)
+                    current["students"]["correct_submissions" if is_correct else "still_trying"].append({
+                        "student_id": row.student_id,
+                        "total_attempts": row.attempts,
+                        "is_correct": is_correct,
+                        "correct_time_spent_seconds": row.first_correct_time_spent_seconds if is_correct else None,
+                        "correct_timestamp": row.first_correct_at.isoformat() if is_correct and row.first_correct_at else None
                     })
 
                 return True, final_report
@@ -265,23 +364,16 @@ class ReportService:
         """Retorna as submissões de um aluno em um cenário específico, mostrando o progresso detalhado por questão."""
         try:
             with Session() as session:
-                submissions = session.query(Submission).join(Question).filter(
-                    Submission.student_id == student_id,
-                    Question.scenario_database_id == scenario_id,
-                    Submission.is_correct == True,
-                    Submission.submitted_query != 'SKIP'
+                submissions = session.query(Submission.question_id, Submission.submitted_query).join(
+                    StudentQuestionProgress, Submission.id == StudentQuestionProgress.last_correct_submission_id
+                ).join(
+                    Question, Submission.question_id == Question.id
+                ).filter(
+                    StudentQuestionProgress.student_id == student_id,
+                    Question.scenario_database_id == scenario_id
                 ).order_by(Submission.submitted_at.desc()).all()
                 
-                result = []
-                seen_qs = set()
-                
-                for sub in submissions:
-                    if sub.question_id not in seen_qs:
-                        seen_qs.add(sub.question_id)
-                        result.append({
-                            "question_id": sub.question_id,
-                            "student_sql": sub.submitted_query
-                        })
+                result = [{"question_id": sub.question_id, "student_sql": sub.submitted_query} for sub in submissions]
                 
                 return True, result
         except SQLAlchemyError as e:
@@ -0,0 +1,174 @@
+"""
+Benchmark do relatório por questão de uma turma (ReportService.get_class_questions_detail).
+
+    python benchmarks/class_questions_detail.py [--students 120] [--enrolled 60] [--questions 40] [--max-attempts 80]
+
+Gera um banco SQLite temporário com os modelos do app e um histórico sintético de submissões (com ~1% de SKIP e
+~15% de acertos), reconstrói o resumo de progresso (ProgressRollup.backfill) e compara a implementação atual, que lê
+student_question_progress com agregações em janela, com a anterior, que trazia todas as submissões da turma para o
+Python. Confere que os dois relatórios são iguais e mostra o melhor tempo de 5 execuções e o pico de memória
+(tracemalloc) de cada uma.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+# app.database monta a URL do TiDB na importação; o benchmark usa apenas o SQLite abaixo.
+for name, value in (('TIDB_HOST', 'localhost'), ('TIDB_PORT', '4000'), ('TIDB_USER', 'bench'), ('TIDB_PASSWORD', 'bench'), ('TIDB_DB_NAME', 'bench')):
+    os.environ.setdefault(name, value)
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from app.database.models import Base, ScenarioDatabase, Question, Submission, Student, Class, Teacher, Enrollment
+from app.main import progress
+from app.reports import services as reports
+
+CLASS_ID = 1
+
+def legacy_class_questions_detail(session_factory, class_id):
+    """Implementação anterior do relatório, mantida aqui como linha de base: agrega as submissões da turma no Python."""
+    with session_factory() as session:
+        submissions = session.query(
+            Submission.id,
+            Submission.question_id,
+            Submission.student_id,
+            Submission.is_correct,
+            Submission.time_spent_seconds,
+            Submission.submitted_query,
+            Submission.submitted_at
+        ).join(
+            Enrollment, Submission.student_id == Enrollment.student_id
+        ).filter(
+            Enrollment.class_id == class_id
+        ).order_by(
+            Submission.question_id,
+            Submission.student_id,
+            Submission.id.asc()
+        ).all()
+
+        questions_report = {}
+        for sub in submissions:
+            q_data = questions_report.setdefault(sub.question_id, {"total_class_attempts": 0, "students_data": {}})
+            q_data["total_class_attempts"] += 1
+            student_data = q_data["students_data"].setdefault(sub.student_id, {
+                "student_id": sub.student_id,
+                "total_attempts": 0,
+                "is_correct": False,
+                "correct_time_spent_seconds": None,
+                "correct_timestamp": None
+            })
+            student_data["total_attempts"] += 1
+            if sub.is_correct and sub.submitted_query != 'SKIP' and not student_data["is_correct"]:
+                student_data["is_correct"] = True
+                student_data["correct_time_spent_seconds"] = sub.time_spent_seconds
+                if sub.submitted_at:
+                    student_data["correct_timestamp"] = sub.submitted_at.isoformat()
+
+        final_report = []
+        for q_id, q_data in questions_report.items():
+            students_list = list(q_data["students_data"].values())
+            correct_students = [s for s in students_list if s["is_correct"]]
+            incorrect_students = [s for s in students_list if not s["is_correct"]]
+            correct_times = [s["correct_time_spent_seconds"] for s in correct_students if s["correct_time_spent_seconds"] is not None]
+            attempts_until_correct = [s["total_attempts"] for s in correct_students]
+            final_report.append({
+                "question_id": q_id,
+                "metrics": {
+                    "total_class_attempts": q_data["total_class_attempts"],
+                    "students_attempted_count": len(students_list),
+                    "students_correct_count": len(correct_students),
+                    "accuracy_rate_percentage": round((len(correct_students) / len(students_list)) * 100, 2) if students_list else 0,
+                    "avg_time_to_correct_seconds": round(sum(correct_times) / len(correct_times) if correct_times else 0, 2),
+                    "avg_attempts_to_correct": round(sum(attempts_until_correct) / len(attempts_until_correct) if attempts_until_correct else 0, 2)
+                },
+                "students": {
+                    "correct_submissions": correct_students,
+                    "still_trying": incorrect_students
+                }
+            })
+        return True, final_report
+
+def seed(session_factory, args):
+    """Cria o cenário, a turma, os alunos e o histórico sintético de submissões; retorna a quantidade de submissões."""
+    with session_factory() as session:
+        session.add(ScenarioDatabase(id=1, name='RH', slug='rh', diagram_url='-'))
+        session.add(Teacher(id=1, registration_number='t', name='t', email='t', password_hash='-'))
+        session.add(Class(id=CLASS_ID, teacher_id=1, class_name='c', subject='s', year_semester='2026/1'))
+        for question_id in range(1, args.questions + 1):
+            session.add(Question(id=question_id, scenario_database_id=1, statement='-', expected_query='SELECT 1', question_number=question_id))
+        for student_id in range(1, args.students + 1):
+            session.add(Student(id=student_id, registration_number=str(student_id), name='-'))
+            if student_id <= args.enrolled:
+                session.add(Enrollment(class_id=CLASS_ID, student_id=student_id))
+        session.commit()
+
+        rows = []
+        started_at = datetime.datetime(2026, 3, 1)
+        for student_id in range(1, args.students + 1):
+            for question_id in range(1, args.questions + 1):
+                for attempt in range(random.randint(0, args.max_attempts)):
+                    skip = random.random() < 0.01
+                    rows.append({
+                        "student_id": student_id,
+                        "question_id": question_id,
+                        "time_spent_seconds": random.randint(1, 300),
+                        "submitted_query": 'SKIP' if skip else f"SELECT e.name FROM employees e WHERE e.salary > {attempt}",
+                        "is_correct": skip or random.random() < 0.15,
+                        "execution_output": None,
+                        "submitted_at": started_at + datetime.timedelta(seconds=len(rows))
+                    })
+        session.execute(insert(Submission), rows)
+        session.commit()
+    return len(rows)
+
+def measure(fn):
+    """Retorna (resultado, melhor tempo de 5 execuções, pico de memória) depois de uma execução de aquecimento."""
+    fn()
+    timings = []
+    for _ in range(5):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(timings), peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=120)
+    parser.add_argument('--enrolled', type=int, default=60)
+    parser.add_argument('--questions', type=int, default=40)
+    parser.add_argument('--max-attempts', type=int, default=80)
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}")
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+        progress.Session = session_factory
+        reports.Session = session_factory
+
+        print(f"submissões: {seed(session_factory, args)}")
+        print(f"backfill do resumo: {progress.ProgressRollup.backfill()}")
+
+        (_, legacy), legacy_seconds, legacy_peak = measure(lambda: legacy_class_questions_detail(session_factory, CLASS_ID))
+        (success, current), current_seconds, current_peak = measure(lambda: reports.ReportService.get_class_questions_detail(CLASS_ID))
+        engine.dispose()
+
+    print(f"relatórios iguais: {success and legacy == current}")
+    print(f"anterior: {legacy_seconds * 1000:.0f} ms, pico {legacy_peak / 2 ** 20:.1f} MiB")
+    print(f"atual:    {current_seconds * 1000:.0f} ms, pico {current_peak / 2 ** 20:.1f} MiB")
+    return 0 if success and legacy == current else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
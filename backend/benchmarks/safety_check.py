@@ -0,0 +1,106 @@
+"""
+Benchmark da checagem de segurança das queries (app/main/sqltext.py) sobre as submissões reais dos alunos.
+
+    python benchmarks/safety_check.py [--limit 20000] [--export corpus.jsonl]
+    python benchmarks/safety_check.py --corpus corpus.jsonl [--reference-tokenizer ARQUIVO]
+
+- corpus: por padrão, as consultas distintas da tabela submissions (sem as desistências), lidas com as credenciais
+  do TiDB do .env; com --export o corpus é salvo em JSON Lines ({"submitted_query": ...}) e, com --corpus, o
+  benchmark roda a partir desse arquivo, sem acesso ao banco;
+- benchmark: compara o tempo por query da checagem antiga (regex sobre o texto em maiúsculas) com check_query_safety
+  e lista as consultas com vereditos divergentes (em geral, palavras proibidas dentro de literais ou comentários);
+- --reference-tokenizer: compara tokenize_sql com o de outra versão do módulo (ex.: extraída com git show) sobre o corpus.
+
+O módulo sqltext é carregado direto do arquivo; o app só é importado para ler o corpus do banco.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import re
+import sys
+import timeit
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..')
+SQLTEXT_PATH = os.path.join(BACKEND_DIR, 'app', 'main', 'sqltext.py')
+
+def load_module(name, path):
+    """Carrega um módulo Python direto do arquivo."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def legacy_check(query):
+    """Checagem de segurança anterior ao sqltext (SQLGrader.is_safe_query original), usada como linha de base."""
+    query_upper = query.upper()
+    if not (query.strip().lower().startswith('select') or query.strip().lower().startswith('with')):
+        return False, "Sua consulta deve iniciar com SELECT ou WITH."
+    if ';' in query.strip().rstrip(';'):
+        return False, "Apenas uma instrução SQL é permitida por vez."
+    for keyword in [r'\bDROP\b', r'\bDELETE\b', r'\bUPDATE\b', r'\bINSERT\b', r'\bALTER\b', r'\bTRUNCATE\b', r'\bGRANT\b', r'\bREVOKE\b', r'\bEXEC\b']:
+        if re.search(keyword, query_upper):
+            return False, f"Uso de comando não permitido: {keyword.replace(chr(92) + 'b', '')}"
+    return True, "Valid."
+
+def load_corpus_from_db(limit):
+    """Lê as consultas distintas submetidas pelos alunos, mais recentes primeiro."""
+    sys.path.insert(0, BACKEND_DIR)
+    from app.database import Session
+    from app.database.models import Submission
+
+    with Session() as session:
+        rows = session.query(Submission.submitted_query).filter(
+            Submission.submitted_query != 'SKIP'
+        ).group_by(Submission.submitted_query).order_by(Submission.submitted_query).limit(limit).all()
+    return [query for query, in rows if query]
+
+def load_corpus_from_file(path):
+    """Lê um corpus exportado com --export."""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['submitted_query'] for line in f if line.strip()]
+
+def export_corpus(corpus, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for query in corpus:
+            f.write(json.dumps({"submitted_query": query}, ensure_ascii=False) + '\n')
+
+def run_benchmark(sqltext, corpus):
+    divergent = [q for q in corpus if legacy_check(q)[0] != sqltext.check_query_safety(q)[0]]
+    print(f"corpus: {len(corpus)} consultas, vereditos divergentes: {len(divergent)}")
+    for query in divergent[:10]:
+        print(f"  antiga={legacy_check(query)[0]} atual={sqltext.check_query_safety(query)[0]}: {query[:120]!r}")
+    for name, check in (('antiga', legacy_check), ('check_query_safety', sqltext.check_query_safety)):
+        seconds = min(timeit.repeat(lambda: [check(q) for q in corpus], number=5, repeat=3)) / 5
+        print(f"{name}: {seconds / len(corpus) * 1e6:.1f} us/query")
+
+def run_tokenizer_comparison(sqltext, reference, corpus):
+    mismatches = [q for q in corpus if sqltext.tokenize_sql(q) != reference.tokenize_sql(q)]
+    for query in mismatches[:10]:
+        print(f"tokens divergentes: {query[:120]!r}")
+    print(f"tokenizador: {len(corpus)} consultas, divergências: {len(mismatches)}")
+    return len(mismatches)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help="arquivo JSON Lines exportado com --export (sem ele, lê as submissões do banco)")
+    parser.add_argument('--limit', type=int, default=20000)
+    parser.add_argument('--export', help="salva o corpus lido do banco neste arquivo")
+    parser.add_argument('--reference-tokenizer', help="outra versão de sqltext.py para comparar tokenize_sql")
+    args = parser.parse_args()
+
+    corpus = load_corpus_from_file(args.corpus) if args.corpus else load_corpus_from_db(args.limit)
+    if not corpus:
+        print("corpus vazio: nenhuma submissão encontrada.")
+        return 1
+    if args.export:
+        export_corpus(corpus, args.export)
+
+    sqltext = load_module('sqltext', SQLTEXT_PATH)
+    run_benchmark(sqltext, corpus)
+    if args.reference_tokenizer:
+        return 1 if run_tokenizer_comparison(sqltext, load_module('sqltext_reference', args.reference_tokenizer), corpus) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+import os
+
+# O pacote app lê a configuração do banco ao ser importado; os testes não conectam, então valores fictícios bastam.
+for key, value in {
+    "TIDB_HOST": "localhost",
+    "TIDB_PORT": "4000",
+    "TIDB_USER": "test",
+    "TIDB_PASSWORD": "test",
+    "TIDB_DB_NAME": "test",
+    # Sem banco, a publicação das invalidações do cache de relatórios só falharia; os testes dela a religam.
+    "REPORT_CACHE_SHARED_INVALIDATION": "false",
+}.items():
+    os.environ.setdefault(key, value)
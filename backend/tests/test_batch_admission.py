@@ -0,0 +1,109 @@
+import threading
+import time
+from types import SimpleNamespace
+from app.main.admission import AdmissionRegistry, ScenarioAdmission
+from app.main.services import GradingService
+
+
+class CountingExecutor:
+    """Executor lento que registra o pico de consultas simultâneas."""
+
+    backend = 'sqlite'
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def explain_cost(self, sql, request_timeout=None):
+        return None
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        return ['n'], [(1,)]
+
+
+def test_each_batch_candidate_takes_an_admission_slot(monkeypatch):
+    monkeypatch.setattr(AdmissionRegistry, 'MAX_CONCURRENT', 2)
+    slug = 'lote-admissao'
+    executor = CountingExecutor()
+    question = SimpleNamespace(id=7, expected_query='SELECT 1 AS n', statement_timeout_ms=None)
+    candidates = [f'SELECT {i} AS n' for i in range(10)]
+
+    success, result = GradingService.grade_batch(executor, slug, question, candidates, 'professor')
+
+    assert success
+    assert [r['outcome'] for r in result['results']] == ['graded'] * len(candidates)
+    assert AdmissionRegistry.get(slug).snapshot()['admitted'] == len(candidates) + 1
+    assert executor.peak <= 2
+
+
+def test_batch_refused_when_expected_query_is_not_admitted(monkeypatch):
+    monkeypatch.setattr(AdmissionRegistry, 'MAX_CONCURRENT', 1)
+    monkeypatch.setattr(AdmissionRegistry, 'MAX_QUEUE', 0)
+    slug = 'lote-cheio'
+    admission = AdmissionRegistry.get(slug)
+    executor = CountingExecutor()
+    question = SimpleNamespace(id=8, expected_query='SELECT 1 AS n', statement_timeout_ms=None)
+
+    success, result = GradingService.grade_batch(executor, slug, question, ['SELECT 1 AS n'], 'professor')
+    assert success
+
+    admission.acquire('aluno')
+    try:
+        success, result = GradingService.grade_batch(executor, slug, question, ['SELECT 1 AS n'], 'professor')
+    finally:
+        admission.release()
+    assert not success and result['overloaded'] and result['retry_after'] >= 1
+
+
+def test_low_priority_lane_keeps_slots_for_students():
+    admission = ScenarioAdmission(2, 10, 0.05, max_low_priority=1)
+    assert admission.acquire('regrade', low_priority=True)[0]
+    assert not admission.acquire('regrade', low_priority=True)[0]
+    assert admission.acquire('aluno')[0]
+    assert admission.snapshot()['active_low_priority'] == 1
+
+
+def test_waiting_students_are_served_before_low_priority():
+    admission = ScenarioAdmission(1, 10, 5)
+    admission.acquire('aluno-1')
+    order = []
+
+    def wait(key, low_priority):
+        admission.acquire(key, low_priority=low_priority)
+        order.append(key)
+
+    regrade = threading.Thread(target=wait, args=('regrade', True))
+    regrade.start()
+    while admission.snapshot()['low_priority_queue_depth'] == 0:
+        time.sleep(0.001)
+    student = threading.Thread(target=wait, args=('aluno-2', False))
+    student.start()
+    while admission.snapshot()['queue_depth'] == 0:
+        time.sleep(0.001)
+
+    admission.release()
+    student.join(5)
+    assert order == ['aluno-2']
+    admission.release()
+    regrade.join(5)
+    admission.release(low_priority=True)
+    assert order == ['aluno-2', 'regrade']
+    assert admission.snapshot()['active'] == 0
+
+
+def test_grading_routes_share_the_role_qualified_key(monkeypatch):
+    keys = []
+    monkeypatch.setattr(AdmissionRegistry, 'run', staticmethod(lambda slug, key, func, low_priority=False: (keys.append(key), (False, 1))[1]))
+    question = SimpleNamespace(id=9, expected_query='SELECT 1 AS n', statement_timeout_ms=None)
+
+    graded = GradingService.grade_submission(CountingExecutor(), 'chave', question, 7, 'SELECT 1 AS n', 0)
+    assert graded['outcome'] == 'overloaded'
+    assert keys == ['student:7']
+    assert AdmissionRegistry.key('student', 7) != AdmissionRegistry.key('teacher', 7)
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+import httpx
+import pytest
+from app.main.cache import CostEstimateCache
+from app.main.costguard import QueryCostGuard
+from app.main.executors import SupabaseExecutor
+from app.main.resilience import CircuitBreakerRegistry, Deadline
+from app.main.services import GradingService
+
+
+class ExplainExecutor:
+    """Registra as chamadas ao EXPLAIN e devolve um custo fixo."""
+
+    backend = 'supabase'
+
+    def __init__(self, cost=10.0):
+        self.cost = cost
+        self.explains = []
+
+    def explain_cost(self, sql, request_timeout=None):
+        self.explains.append(request_timeout)
+        return {'total_cost': self.cost, 'plan_rows': 1.0}
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        raise AssertionError('a consulta não deveria ser executada')
+
+
+@pytest.fixture(autouse=True)
+def explain_mode(monkeypatch):
+    monkeypatch.setattr(QueryCostGuard, 'MODE', 'explain')
+    CostEstimateCache._cache.invalidate()
+
+
+def test_explain_is_bounded_by_remaining_deadline():
+    executor = ExplainExecutor()
+    QueryCostGuard.evaluate(executor, 'SELECT 1', deadline=Deadline(0.5))
+    assert 0 < executor.explains[0] <= 0.5
+
+    QueryCostGuard.evaluate(executor, 'SELECT 1', deadline=Deadline(60))
+    assert executor.explains[1] == QueryCostGuard.EXPLAIN_TIMEOUT_SECONDS
+
+
+def test_explain_skipped_when_deadline_expired():
+    executor = ExplainExecutor(cost=1e9)
+    guard = QueryCostGuard.evaluate(executor, 'SELECT 1', deadline=Deadline(0))
+    assert executor.explains == []
+    assert guard['source'] == 'heuristic'
+
+
+def test_explain_estimate_cached_per_canonical_query():
+    executor = ExplainExecutor(cost=2e7)
+    first = QueryCostGuard.evaluate(executor, 'select 1', slug='rh', canonical_sql='SELECT 1')
+    second = QueryCostGuard.evaluate(executor, 'SELECT  1;', slug='rh', canonical_sql='SELECT 1')
+    assert first['action'] == second['action'] == QueryCostGuard.REJECT
+    assert len(executor.explains) == 1
+
+
+def test_grade_checks_breaker_before_explain(monkeypatch):
+    breaker = CircuitBreakerRegistry.get('breaker-aberto')
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    executor = ExplainExecutor()
+    question = SimpleNamespace(id=1, expected_query='SELECT 1', statement_timeout_ms=None)
+
+    graded = GradingService.grade(executor, 'breaker-aberto', question, 'SELECT 2')
+
+    assert graded['outcome'] == 'unavailable'
+    assert graded['result_table']['retry_after'] > 0
+    assert executor.explains == []
+    assert breaker.snapshot()['state'] == breaker.OPEN
+
+
+def test_heuristic_downgrades_cartesian_products_with_a_warning(monkeypatch):
+    monkeypatch.setattr(QueryCostGuard, 'MODE', 'heuristic')
+    guard = QueryCostGuard.evaluate(None, 'SELECT * FROM a, b, c, d')
+    assert guard['action'] == QueryCostGuard.DOWNGRADE
+    assert guard['estimate']['cartesian_relations'] == 4
+    assert 'produto cartesiano' in guard['reason']
+
+
+def test_statement_timeout_travels_in_the_request_header():
+    http_client = httpx.Client()
+    executor = SupabaseExecutor(None, http_client)
+    request = httpx.Request('POST', 'http://cenario/rest/v1/rpc/rpc_sql')
+    with executor._bounded(1.5, 1200):
+        executor._apply_request_timeout(request)
+    assert request.headers[SupabaseExecutor.STATEMENT_TIMEOUT_HEADER] == '1200'
+    assert request.extensions['timeout']['read'] == 1.5
+
+    request = httpx.Request('POST', 'http://cenario/rest/v1/rpc/rpc_sql')
+    executor._apply_request_timeout(request)
+    assert SupabaseExecutor.STATEMENT_TIMEOUT_HEADER not in request.headers
+    http_client.close()
@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+import pytest
+from app.main.executors import SQLiteExecutor, DuckDBExecutor, ScenarioQueryError
+
+
+@pytest.fixture
+def duckdb_path(tmp_path):
+    duckdb = pytest.importorskip('duckdb')
+    path = str(tmp_path / 'cenario.duckdb')
+    conn = duckdb.connect(path)
+    conn.execute("CREATE TABLE emp AS SELECT 1 AS id, 'Ana' AS nome")
+    conn.close()
+    return path
+
+
+def test_duckdb_runs_queries_on_scenario_file(duckdb_path):
+    executor = DuckDBExecutor(duckdb_path)
+    assert executor.fetch("SELECT id, nome FROM emp") == (['id', 'nome'], [(1, 'Ana')])
+    executor.close()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM read_text('/etc/passwd')",
+    "SELECT * FROM read_csv_auto('/etc/passwd')",
+    "SELECT * FROM read_text('.env')",
+    "SELECT * FROM read_text('/proc/self/environ')",
+])
+def test_duckdb_blocks_server_file_access(duckdb_path, sql):
+    executor = DuckDBExecutor(duckdb_path)
+    with pytest.raises(ScenarioQueryError):
+        executor.fetch(sql)
+    executor.close()
+
+
+def test_duckdb_configuration_is_locked(duckdb_path):
+    executor = DuckDBExecutor(duckdb_path)
+    with pytest.raises(ScenarioQueryError):
+        executor.fetch("SET enable_external_access = true")
+    executor.close()
+
+
+def test_sqlite_file_is_read_only(tmp_path):
+    path = str(tmp_path / 'cenario.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE emp (id INTEGER)")
+    conn.commit()
+    conn.close()
+    executor = SQLiteExecutor(path)
+    with pytest.raises(ScenarioQueryError):
+        executor.fetch("INSERT INTO emp VALUES (1)")
+    executor.close()
+
+
+def test_sqlite_close_closes_every_thread_connection(tmp_path):
+    path = str(tmp_path / 'cenario.sqlite')
+    sqlite3.connect(path).close()
+    executor = SQLiteExecutor(path)
+    workers = [threading.Thread(target=executor.fetch, args=("SELECT 1",)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    connections = list(executor._connections)
+    assert len(connections) == 3
+
+    executor.close()
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
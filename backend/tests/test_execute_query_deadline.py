@@ -0,0 +1,54 @@
+import time
+import httpx
+from app.main.resilience import CircuitBreakerRegistry, Deadline
+from app.main.services import SupabaseService
+
+
+class HangingExecutor:
+    """Simula um banco que não responde: registra os timeouts recebidos e falha com timeout de rede."""
+
+    backend = 'supabase'
+
+    def __init__(self):
+        self.calls = []
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        self.calls.append((timeout_ms, request_timeout))
+        raise httpx.ReadTimeout('timed out')
+
+
+def test_http_call_is_bounded_by_remaining_deadline():
+    executor = HangingExecutor()
+    SupabaseService.execute_query(executor, 'SELECT 1', retries=1, deadline=Deadline(2.0))
+    timeout_ms, request_timeout = executor.calls[0]
+    assert timeout_ms <= 2000
+    assert request_timeout <= 2.0 + SupabaseService.DEADLINE_GRACE_SECONDS
+
+
+def test_no_attempt_or_backoff_after_deadline(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', lambda seconds: slept.append(seconds))
+    executor = HangingExecutor()
+    res = SupabaseService.execute_query(executor, 'SELECT 1', retries=3, backoff=10, deadline=Deadline(0.01))
+    assert res['retryable']
+    assert slept == []
+    assert len(executor.calls) <= 1
+
+    executor = HangingExecutor()
+    res = SupabaseService.execute_query(executor, 'SELECT 1', deadline=Deadline(0))
+    assert executor.calls == [] and res['retryable']
+
+
+def test_expired_deadline_does_not_hold_the_half_open_probe():
+    breaker = CircuitBreakerRegistry.get('meio-aberto')
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+
+    executor = HangingExecutor()
+    res = SupabaseService.execute_query(executor, 'SELECT 1', slug='meio-aberto', deadline=Deadline(0))
+    assert executor.calls == [] and res['retryable']
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot()['state'] == breaker.CLOSED
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+import pytest
+from app.main.grading import ResultComparator
+from app.main.services import AnswerKeyService, GradingService
+
+
+class ScenarioExecutor:
+    """Banco do cenário cujo gabarito já não bate com a impressão digital gravada (os dados mudaram)."""
+
+    backend = 'sqlite'
+
+    def __init__(self):
+        self.expected_runs = 0
+
+    def explain_cost(self, sql, request_timeout=None):
+        return None
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        if 'FROM gabarito' in sql:
+            self.expected_runs += 1
+            return ['n'], [(1,), (2,)]
+        if 'FROM errada' in sql:
+            return ['n'], [(9,)]
+        return ['n'], [(1,), (2,)]
+
+
+@pytest.fixture
+def stale_fingerprint(monkeypatch):
+    fingerprint = ResultComparator.fingerprint('SELECT n FROM gabarito', {'columns': ['n'], 'rows': [(1,), (2,), (3,)]})
+    monkeypatch.setattr(AnswerKeyService, 'get_fingerprint', staticmethod(lambda question, with_row_digests=False: (True, fingerprint)))
+
+
+def question(question_id):
+    return SimpleNamespace(id=question_id, expected_query='SELECT n FROM gabarito', statement_timeout_ms=None)
+
+
+def test_stale_fingerprint_does_not_fail_a_correct_answer(stale_fingerprint):
+    executor = ScenarioExecutor()
+    graded = GradingService.grade(executor, 'digital-antiga', question(31), 'SELECT n FROM certa')
+    assert graded['outcome'] == 'graded' and graded['valid']
+    assert executor.expected_runs == 1
+
+
+def test_wrong_answer_carries_the_expected_result(stale_fingerprint):
+    executor = ScenarioExecutor()
+    graded = GradingService.grade(executor, 'digital-feedback', question(32), 'SELECT n FROM errada')
+    assert graded['outcome'] == 'graded' and not graded['valid']
+    assert graded['expected_table']['data']['rows'] == [(1,), (2,)]
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import SimpleNamespace
+import pytest
+from app.main.services import GradingService, GradingTicketService, SupabaseService
+
+
+@pytest.fixture
+def tickets(monkeypatch):
+    """Registro de tickets limpo, com correções que só terminam quando o teste libera."""
+    release = threading.Event()
+    monkeypatch.setattr(GradingTicketService, '_tickets', OrderedDict())
+    monkeypatch.setattr(GradingTicketService, '_finished', OrderedDict())
+    monkeypatch.setattr(GradingTicketService, '_done', {})
+    monkeypatch.setattr(GradingTicketService, '_pending', 0)
+    monkeypatch.setattr(GradingTicketService, '_rejected', 0)
+
+    @contextmanager
+    def lease_client(slug):
+        yield object()
+
+    def grade_submission(client, slug, question, student_id, student_sql, time_spent):
+        release.wait(5)
+        return {'outcome': 'graded', 'valid': True, 'message': 'ok'}
+
+    monkeypatch.setattr(SupabaseService, 'lease_client', staticmethod(lease_client))
+    monkeypatch.setattr(GradingService, 'grade_submission', staticmethod(grade_submission))
+    yield release
+    release.set()
+
+
+QUESTION = SimpleNamespace(id=1)
+
+
+def submit(student_id):
+    return GradingTicketService.submit('rh', QUESTION, student_id, 'SELECT 1', 3)
+
+
+def wait_done(ticket_id, student_id):
+    return GradingTicketService.get_ticket(ticket_id, student_id, wait_seconds=5)[1]
+
+
+def test_live_tickets_are_never_pruned(tickets, monkeypatch):
+    monkeypatch.setattr(GradingTicketService, 'MAX_TICKETS_KEPT', 2)
+    monkeypatch.setattr(GradingTicketService, 'MAX_PENDING', 10)
+    _, first = submit(1)
+    _, second = submit(2)
+
+    accepted, retry_after = submit(3)
+    assert not accepted and retry_after >= 1
+    assert GradingTicketService.get_ticket(first['id'], 1)[0]
+    assert GradingTicketService.get_ticket(second['id'], 2)[0]
+
+    tickets.set()
+    assert wait_done(first['id'], 1)['status'] == 'done'
+    assert wait_done(second['id'], 2)['status'] == 'done'
+    accepted, third = submit(3)
+    assert accepted
+    kept = [GradingTicketService.get_ticket(t['id'], t['student_id'])[0] for t in (first, second)]
+    assert sorted(kept) == [False, True]
+    assert GradingTicketService.get_ticket(third['id'], 3)[0]
+
+
+def test_submissions_refused_when_pending_queue_is_full(tickets, monkeypatch):
+    monkeypatch.setattr(GradingTicketService, 'MAX_PENDING', 2)
+    assert submit(1)[0] and submit(2)[0]
+
+    accepted, retry_after = submit(3)
+    assert not accepted and retry_after >= 1
+    assert GradingTicketService.stats()['rejected'] == 1
+    assert GradingTicketService.stats()['pending'] == 2
@@ -0,0 +1,43 @@
+import re
+from types import SimpleNamespace
+from app.main.services import AnswerKeyService, GradingService, SupabaseService
+
+ROWS = [(n,) for n in range(8)]
+
+
+class LargeResultExecutor:
+    """Cenário cujo gabarito passa do teto de linhas; registra cada execução de consulta dos alunos."""
+
+    backend = 'sqlite'
+
+    def __init__(self):
+        self.student_runs = []
+
+    def explain_cost(self, sql, request_timeout=None):
+        return None
+
+    def fetch(self, sql, timeout_ms=None, request_timeout=None):
+        if 'FROM gabarito' in sql and '_sql_trail_q' not in sql:
+            return ['n'], ROWS
+        self.student_runs.append(sql)
+        if sql.startswith('SELECT COUNT(*)'):
+            return ['total'], [(len(ROWS),)]
+        limit = re.search(r'LIMIT (\d+)$', sql)
+        return ['n'], ROWS[:int(limit.group(1))] if limit else ROWS
+
+
+QUESTION = SimpleNamespace(id=41, expected_query='SELECT n FROM gabarito', statement_timeout_ms=None)
+
+
+def test_large_answer_runs_once_when_expected_size_is_known(monkeypatch):
+    monkeypatch.setattr(SupabaseService, 'MAX_RESULT_ROWS', 3)
+    monkeypatch.setattr(AnswerKeyService, 'get_fingerprint', staticmethod(lambda question, with_row_digests=False: (False, None)))
+    executor = LargeResultExecutor()
+
+    expected = SupabaseService.execute_expected_query(executor, 'grande', QUESTION)
+    assert expected['data']['total'] == len(ROWS)
+
+    graded = GradingService.grade(executor, 'grande', QUESTION, 'SELECT n FROM aluno')
+    assert graded['valid']
+    assert executor.student_runs == ['SELECT * FROM (\nSELECT n FROM aluno\n) AS _sql_trail_q LIMIT 9']
+    assert graded['result_table']['data']['total'] == len(ROWS)
@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from app.auth import services as auth_services
+from app.auth.services import AuthService
+from app.database.models import Base, ScenarioDatabase, Question, Submission, Student, Class, Teacher, Enrollment, QuestionClassMetrics
+from app.main.progress import ProgressRollup
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Banco SQLite com uma turma de dois alunos matriculados e uma questão."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'cube.sqlite'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.add(ScenarioDatabase(id=1, name='RH', slug='rh', diagram_url='-'))
+        session.add(Teacher(id=1, registration_number='t', name='t', email='t', password_hash='-'))
+        session.add(Class(id=1, teacher_id=1, class_name='c', subject='s', year_semester='2026/1'))
+        session.add(Question(id=1, scenario_database_id=1, statement='-', expected_query='SELECT 1', question_number=1))
+        for student_id in (1, 2):
+            session.add(Student(id=student_id, registration_number=str(student_id), name='-'))
+            session.add(Enrollment(class_id=1, student_id=student_id))
+        session.commit()
+    monkeypatch.setattr(auth_services, 'Session', session_factory)
+    yield session_factory
+    engine.dispose()
+
+
+def submit(session_factory, student_id, is_correct):
+    row = {"student_id": student_id, "question_id": 1, "time_spent_seconds": 10, "submitted_query": "SELECT 1", "is_correct": is_correct}
+    with session_factory() as session:
+        session.execute(insert(Submission), [row])
+        ProgressRollup.apply(session, [row])
+        session.commit()
+
+
+def cell(session_factory):
+    with session_factory() as session:
+        metrics = session.get(QuestionClassMetrics, (1, 1))
+        return metrics.attempts, metrics.students_attempted, metrics.students_correct
+
+
+def test_students_are_counted_once_per_question(db):
+    submit(db, 1, False)
+    submit(db, 1, True)
+    submit(db, 1, True)
+    submit(db, 2, False)
+    assert cell(db) == (4, 2, 1)
+
+
+def test_deleting_a_student_removes_them_from_the_cube(db):
+    submit(db, 1, True)
+    submit(db, 2, False)
+
+    success, _ = AuthService.delete_student(1)
+
+    assert success
+    assert cell(db) == (1, 1, 0)
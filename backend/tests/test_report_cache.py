@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database.models import Base, ReportCacheTag, ScenarioDatabase, Question
+from app.reports import cache
+from app.reports.cache import ReportCache
+
+
+@pytest.fixture
+def shared_db(tmp_path, monkeypatch):
+    """Cache vazio com as etiquetas compartilhadas num SQLite temporário, como o banco visto por vários workers."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'tags.sqlite'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.add(ScenarioDatabase(id=1, name='RH', slug='rh', diagram_url='-'))
+        session.add(Question(id=5, scenario_database_id=1, statement='-', expected_query='SELECT 1', question_number=1))
+        session.commit()
+    monkeypatch.setattr(cache, 'Session', session_factory)
+    monkeypatch.setattr(ReportCache, 'SHARED_INVALIDATION', True)
+    monkeypatch.setattr(ReportCache, 'SHARED_PUBLISH_SECONDS', 0)
+    monkeypatch.setattr(ReportCache, 'SHARED_READ_TTL_SECONDS', 0)
+    monkeypatch.setattr(ReportCache, 'STALENESS_SECONDS', 0)
+    monkeypatch.setattr(ReportCache, '_entries', OrderedDict())
+    monkeypatch.setattr(ReportCache, '_generations', {})
+    monkeypatch.setattr(ReportCache, '_scenario_tags', (None, 0.0))
+    monkeypatch.setattr(ReportCache, '_pending_tags', set())
+    monkeypatch.setattr(ReportCache, '_pending_pairs', set())
+    yield session_factory
+    engine.dispose()
+
+
+class Report:
+    """compute() que conta quantas vezes o relatório foi calculado."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return True, {"calls": self.calls}
+
+
+def publish_elsewhere(tags=(), pairs=()):
+    """Simula a invalidação publicada por outro processo: só o banco muda, o cache local não é tocado."""
+    ReportCache._publish(tags=set(tags), pairs=set(pairs))
+
+
+def stored_tags(session_factory):
+    with session_factory() as session:
+        return dict(session.query(ReportCacheTag.tag, ReportCacheTag.generation).all())
+
+
+def test_invalidation_from_another_process_is_seen(shared_db):
+    report = Report()
+    ReportCache.get_or_compute('question', {"question_id": 5, "class_id": 3}, report)
+    assert ReportCache.get_or_compute('question', {"question_id": 5, "class_id": 3}, report)[1] == {"calls": 1}
+
+    publish_elsewhere(tags={'question_id=6', 'class_id=4'})
+    assert ReportCache.get_or_compute('question', {"question_id": 5, "class_id": 3}, report)[1] == {"calls": 1}
+
+    publish_elsewhere(pairs={(7, 5)})
+    assert ReportCache.get_or_compute('question', {"question_id": 5, "class_id": 3}, report)[1] == {"calls": 2}
+
+
+def test_unfiltered_reports_follow_the_scenario_tags(shared_db):
+    report = Report()
+    ReportCache.get_or_compute('overview', {}, report)
+    ReportCache.invalidate_submissions([(7, 5)])
+    assert '*' not in stored_tags(shared_db)
+    assert ReportCache.get_or_compute('overview', {}, report)[1] == {"calls": 2}
+
+
+def test_bumps_are_coalesced_into_one_publish(shared_db, monkeypatch):
+    monkeypatch.setattr(ReportCache, 'SHARED_PUBLISH_SECONDS', 60)
+    monkeypatch.setattr(ReportCache, '_publish_timer', None)
+    before = ReportCache.stats()["shared_publishes"]
+    for student_id in (7, 8, 9):
+        ReportCache.invalidate_submissions([(student_id, 5)])
+    assert stored_tags(shared_db) == {}
+
+    ReportCache._publish_timer.cancel()
+    ReportCache._flush_published()
+    assert stored_tags(shared_db) == {'question_id=5': 1, 'scenario_id=1': 1}
+    assert ReportCache.stats()["shared_publishes"] == before + 1
+
+
+def test_generations_are_read_once_per_ttl(shared_db, monkeypatch):
+    monkeypatch.setattr(ReportCache, 'SHARED_READ_TTL_SECONDS', 60)
+    report = Report()
+    before = ReportCache.stats()["shared_reads"]
+    for _ in range(5):
+        ReportCache.get_or_compute('question', {"question_id": 5}, report)
+    assert report.calls == 1
+    assert ReportCache.stats()["shared_reads"] == before + 1
+
+
+def test_class_change_invalidates_every_process(shared_db):
+    report = Report()
+    ReportCache.get_or_compute('overview', {"scenario_id": 1}, report)
+    publish_elsewhere(tags={'epoch'})
+    assert ReportCache.get_or_compute('overview', {"scenario_id": 1}, report)[1] == {"calls": 2}
+
+
+def test_unreadable_tags_are_not_cached(shared_db, monkeypatch):
+    monkeypatch.setattr(ReportCache, '_read_tags', staticmethod(lambda tags: None))
+    report = Report()
+    ReportCache.get_or_compute('overview', {}, report)
+    ReportCache.get_or_compute('overview', {}, report)
+    assert report.calls == 2
@@ -0,0 +1,121 @@
+import math
+import re
+import pandas as pd
+import pytest
+from app.main.grading import ResultComparator
+
+
+def legacy_compare(base_sql, base_data, stu_data):
+    """Comparação original do SQLGrader (anterior ao ResultComparator), usada como referência de paridade."""
+    base_upper = " " + base_sql.upper().replace('\n', ' ') + " "
+
+    if base_data['total'] != stu_data['total']:
+        return False, f"O número de linhas retornadas difere. Esperado: {base_data['total']}, Recebido: {stu_data['total']}."
+
+    df_base = pd.DataFrame(base_data['rows'], columns=base_data['columns'])
+    df_stu = pd.DataFrame(stu_data['rows'], columns=stu_data['columns'])
+
+    if df_base.empty and df_stu.empty:
+        return True, "Parabens! As consultas sao equivalentes."
+
+    def normalize(df):
+        df = df.round(2)
+        df = df.astype(str)
+        return df.map(lambda x: x.strip().lower() if isinstance(x, str) else x)
+
+    df_base_norm = normalize(df_base)
+    df_stu_norm = normalize(df_stu)
+
+    if df_base_norm.values.tolist() == df_stu_norm.values.tolist():
+        return True, "Parabens! As consultas sao equivalentes."
+
+    if sorted(df_base_norm.values.tolist()) == sorted(df_stu_norm.values.tolist()):
+        if re.search(r'\bORDER\s+BY\b', base_upper):
+            return False, "Os dados estão corretos, mas a ordem está errada."
+        return True, "Parabens! As consultas sao equivalentes."
+
+    if len(df_base_norm) == len(df_stu_norm):
+        stu_pool = [re.sub(r'[^a-z0-9]', '', "".join(map(str, row))) for row in df_stu_norm.values.tolist()]
+        all_found = True
+        for b_row in df_base_norm.values.tolist():
+            b_vals = [re.sub(r'[^a-z0-9]', '', str(v)) for v in b_row]
+            for i, s_string in enumerate(stu_pool):
+                if all(b_val in s_string for b_val in b_vals):
+                    stu_pool.pop(i)
+                    break
+            else:
+                all_found = False
+                break
+        if all_found:
+            return True, "Parabens! As consultas sao equivalentes."
+
+    return False, "Os dados nao conferem."
+
+
+def result(columns, rows):
+    return {"columns": columns, "rows": rows, "total": len(rows)}
+
+
+SELECT = "SELECT id, nome FROM funcionarios"
+ORDERED = "SELECT id, nome FROM funcionarios ORDER BY id"
+
+CASES = {
+    # Ordem
+    "mesma_ordem": (SELECT, result(["id", "nome"], [[1, "Ana"], [2, "Bia"]]), result(["id", "nome"], [[1, "Ana"], [2, "Bia"]])),
+    "ordem_trocada_sem_order_by": (SELECT, result(["id", "nome"], [[1, "Ana"], [2, "Bia"]]), result(["id", "nome"], [[2, "Bia"], [1, "Ana"]])),
+    "ordem_trocada_com_order_by": (ORDERED, result(["id", "nome"], [[1, "Ana"], [2, "Bia"]]), result(["id", "nome"], [[2, "Bia"], [1, "Ana"]])),
+    "order_by_multilinha": ("SELECT id\nFROM t\nORDER\nBY id", result(["id"], [[1], [2]]), result(["id"], [[2], [1]])),
+    "order_by_em_identificador": ("SELECT id AS xorder_by FROM t", result(["id"], [[1], [2]]), result(["id"], [[2], [1]])),
+    # Duplicatas
+    "duplicatas_iguais": (SELECT, result(["id"], [[1], [1], [2]]), result(["id"], [[2], [1], [1]])),
+    "duplicatas_diferentes": (SELECT, result(["id"], [[1], [1], [2]]), result(["id"], [[1], [2], [2]])),
+    "linhas_repetidas_texto": (SELECT, result(["nome"], [["Ana"], ["Ana"]]), result(["nome"], [["Ana"], ["Bia"]])),
+    # NULL / NaN
+    "null_igual": (SELECT, result(["id", "gerente"], [[1, None], [2, 3]]), result(["id", "gerente"], [[1, None], [2, 3]])),
+    "null_contra_valor": (SELECT, result(["id", "gerente"], [[1, None]]), result(["id", "gerente"], [[1, 0]])),
+    "null_contra_texto_none": (SELECT, result(["id", "gerente"], [[1, None]]), result(["id", "gerente"], [[1, "None"]])),
+    "nan_contra_null": (SELECT, result(["v"], [[float("nan")], [1.5]]), result(["v"], [[None], [1.5]])),
+    "nan_igual": (SELECT, result(["v"], [[math.nan]]), result(["v"], [[math.nan]])),
+    "coluna_toda_null": (SELECT, result(["v"], [[None], [None]]), result(["v"], [[None], [None]])),
+    # Tolerância de float (arredondamento para 2 casas)
+    "float_dentro_da_tolerancia": (SELECT, result(["salario"], [[1000.001]]), result(["salario"], [[1000.004]])),
+    "float_fora_da_tolerancia": (SELECT, result(["salario"], [[1000.01]]), result(["salario"], [[1000.02]])),
+    "float_contra_int": (SELECT, result(["salario"], [[1000.0]]), result(["salario"], [[1000]])),
+    "float_texto_contra_numero": (SELECT, result(["salario"], [["1000.5"]]), result(["salario"], [[1000.5]])),
+    "bool_contra_texto": (SELECT, result(["ativo"], [[True], [False]]), result(["ativo"], [["true"], ["false"]])),
+    # Apelidos de coluna e normalização de texto
+    "apelidos_diferentes": (SELECT, result(["id", "nome"], [[1, "Ana"]]), result(["codigo", "nome_completo"], [[1, "Ana"]])),
+    "caixa_e_espacos": (SELECT, result(["nome"], [["Ana Souza"]]), result(["nome"], [["  ana souza "]])),
+    "colunas_trocadas": (SELECT, result(["id", "nome"], [[1, "Ana"]]), result(["nome", "id"], [["Ana", 1]])),
+    # Busca flexível (nível 3)
+    "concatenacao": (SELECT, result(["nome", "sobrenome"], [["Ana", "Souza"], ["Bia", "Lima"]]), result(["nome_completo"], [["Bia Lima"], ["Ana Souza"]])),
+    "coluna_extra": (SELECT, result(["nome"], [["Ana"], ["Bia"]]), result(["id", "nome"], [[2, "Bia"], [1, "Ana"]])),
+    "coluna_faltando": (SELECT, result(["id", "nome"], [[1, "Ana"], [2, "Bia"]]), result(["nome"], [["Ana"], ["Bia"]])),
+    "pontuacao_ignorada": (SELECT, result(["telefone"], [["(11) 9999-0000"]]), result(["telefone"], [["11 99990000"]])),
+    "flexivel_consome_linha": (SELECT, result(["nome"], [["Ana"], ["Ana"]]), result(["nome", "x"], [["Ana", 1], ["Bia", 2]])),
+    "flexivel_substring_ambigua": (SELECT, result(["v"], [["a"], ["ab"]]), result(["v", "w"], [["ab", 1], ["c", 2]])),
+    "flexivel_com_order_by": (ORDERED, result(["nome"], [["Ana"], ["Bia"]]), result(["id", "nome"], [[2, "Bia"], [1, "Ana"]])),
+    # Número de linhas e resultados vazios
+    "total_diferente": (SELECT, result(["id"], [[1], [2]]), result(["id"], [[1]])),
+    "ambos_vazios": (SELECT, result(["id"], []), result(["x", "y"], [])),
+    "dados_diferentes": (SELECT, result(["id", "nome"], [[1, "Ana"]]), result(["id", "nome"], [[1, "Bruna"]])),
+}
+
+
+@pytest.mark.parametrize("base_sql, base_data, stu_data", CASES.values(), ids=CASES.keys())
+def test_compare_matches_legacy(base_sql, base_data, stu_data):
+    assert ResultComparator.compare(base_sql, base_data, stu_data) == legacy_compare(base_sql, base_data, stu_data)
+
+
+@pytest.mark.parametrize("base_sql, base_data, stu_data", CASES.values(), ids=CASES.keys())
+def test_columnar_payload_matches_legacy(base_sql, base_data, stu_data):
+    base_payload = ResultComparator.to_columnar(base_data)
+    stu_payload = ResultComparator.to_columnar(stu_data)
+    assert ResultComparator.compare(base_sql, base_payload, stu_payload) == legacy_compare(base_sql, base_data, stu_data)
+
+
+def test_fingerprint_agrees_with_compare():
+    base = result(["id", "nome"], [[1, "Ana"], [2, "Bia"]])
+    fingerprint = ResultComparator.fingerprint(SELECT, base)
+    assert ResultComparator.matches_fingerprint(fingerprint, result(["a", "b"], [[2, "bia "], [1, "ANA"]]))
+    assert not ResultComparator.matches_fingerprint(fingerprint, result(["a", "b"], [[2, "Bia"], [1, "Ana"], [3, "Cau"]]))
@@ -0,0 +1,59 @@
+import pytest
+from app.main import scenarios
+from app.main.scenarios import ScenarioClientRegistry
+
+
+class FakeExecutor:
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setitem(scenarios.EMBEDDED_EXECUTORS, 'sqlite', FakeExecutor)
+    monkeypatch.setattr(scenarios, 'dotenv_values', lambda: {})
+    monkeypatch.setattr(ScenarioClientRegistry, '_entries', {})
+    monkeypatch.setattr(ScenarioClientRegistry, '_config', None)
+    monkeypatch.setenv('SCENARIO_BACKEND_RH', 'sqlite')
+    monkeypatch.setenv('SCENARIO_DB_PATH_RH', '/tmp/rh-v1.sqlite')
+    return ScenarioClientRegistry
+
+
+def test_lease_reuses_warm_executor(registry):
+    with registry.lease('rh') as first:
+        pass
+    with registry.lease('rh') as second:
+        assert second is first
+    assert registry.stats()['warm_clients']['RH']['acquisitions'] == 2
+    assert registry.stats()['warm_clients']['RH']['in_use'] == 0
+
+
+def test_lease_of_unknown_scenario_is_none(registry):
+    with registry.lease('inexistente') as executor:
+        assert executor is None
+
+
+def test_reload_defers_close_until_lease_is_released(registry, monkeypatch):
+    with registry.lease('rh') as old:
+        monkeypatch.setenv('SCENARIO_DB_PATH_RH', '/tmp/rh-v2.sqlite')
+        registry.reload()
+        assert not old.closed
+        with registry.lease('rh') as new:
+            assert new is not old and new.path == '/tmp/rh-v2.sqlite'
+        assert not old.closed
+    assert old.closed
+    assert not new.closed
+
+
+def test_reload_closes_idle_executor_immediately(registry, monkeypatch):
+    with registry.lease('rh') as old:
+        pass
+    monkeypatch.delenv('SCENARIO_BACKEND_RH')
+    assert 'RH' not in registry.reload()
+    assert old.closed
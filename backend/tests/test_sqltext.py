@@ -0,0 +1,40 @@
+import pytest
+from app.main.sqltext import check_query_safety
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("select * from emp", True),
+    ("SELECT name FROM emp WHERE note = 'drop table x'", True),
+    ("select 1 -- delete everything\n", True),
+    ("select 1; drop table x", False),
+    ("select 1;", True),
+    ("select 1;;  ", True),
+    ("select 1; -- x", True),
+    ("with t as (select 1) select * from t", True),
+    ("/* c */ select 1", True),
+    ("update emp set a=1", False),
+    ("delete from emp", False),
+    ("select * into t2 from emp", False),
+    ("select \"update\" from emp", True),
+    ("select 'a;b'", True),
+    ("select $$; drop$$", True),
+    ("select * from emp where x = 1 /* ; drop table emp */", True),
+    ("", False),
+    ("   ", False),
+    ("(select 1)", False),
+    # '$' dentro de identificadores não abre dollar quoting nem E''.
+    ("SELECT 1 AS a$b$c; DROP TABLE t", False),
+    ("SELECT a$b$c FROM t; DELETE FROM t", False),
+    ("select a$e'\\' ; drop table t; --'", False),
+    ("select nomee'x' from t; drop table t", False),
+    ("select a$b$c, a_drop, drop1 from t", True),
+    # Após dígito ou '$' o token depende do anterior: 1$a$ abre um literal, x1into é um identificador.
+    ("select 1$a$ ' $a$; drop table t; --'", False),
+    ("select $$x$$$$ ' $$; drop table t; --'", False),
+    ("select 1$a$;$a$", True),
+    ("select 1into t from x", False),
+    ("select x1into from t", True),
+])
+def test_check_query_safety(sql, expected):
+    assert check_query_safety(sql)[0] is expected
+
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app.main.writebehind import SubmissionWriteBehind
+
+
+@pytest.fixture
+def write_behind(tmp_path, monkeypatch):
+    """Fila isolada num diretório temporário, sem a thread de gravação e com o INSERT simulado."""
+    monkeypatch.setattr(SubmissionWriteBehind, 'SPILL_DIR', str(tmp_path))
+    monkeypatch.setattr(SubmissionWriteBehind, 'SPILL_FSYNC', False)
+    monkeypatch.setattr(SubmissionWriteBehind, '_buffer', [])
+    monkeypatch.setattr(SubmissionWriteBehind, '_stats', {**SubmissionWriteBehind._stats, "recovered": 0, "dead_lettered": 0})
+    monkeypatch.setattr(SubmissionWriteBehind, '_running', staticmethod(lambda: True))
+    spill = open(SubmissionWriteBehind._spill_path(os.getpid()), 'a', encoding='utf-8')
+    monkeypatch.setattr(SubmissionWriteBehind, '_spill', spill)
+    inserted = []
+    yield inserted
+    SubmissionWriteBehind._spill.close()
+
+
+def row(student_id):
+    return {"student_id": student_id, "question_id": 1, "time_spent_seconds": 5, "submitted_query": "SELECT 1", "is_correct": True}
+
+
+def fake_insert(inserted, failing):
+    def insert(rows):
+        for r in rows:
+            if r["student_id"] in failing:
+                raise failing[r["student_id"]]
+        inserted.extend(rows)
+    return staticmethod(insert)
+
+
+def spilled():
+    return SubmissionWriteBehind._read_spill(SubmissionWriteBehind._spill_path(os.getpid()))
+
+
+def test_bad_row_goes_to_dead_letter_and_does_not_block_the_queue(write_behind, monkeypatch):
+    fk_error = IntegrityError('INSERT', {}, Exception('foreign key constraint fails'))
+    monkeypatch.setattr(SubmissionWriteBehind, '_insert', fake_insert(write_behind, {2: fk_error}))
+    for student_id in (1, 2, 3):
+        SubmissionWriteBehind.enqueue(row(student_id))
+
+    assert SubmissionWriteBehind.flush() == (True, 2)
+    assert [r["student_id"] for r in write_behind] == [1, 3]
+    assert SubmissionWriteBehind._buffer == [] and spilled() == []
+    with open(SubmissionWriteBehind._dead_letter_path(os.getpid()), encoding='utf-8') as f:
+        dead = [json.loads(line) for line in f]
+    assert [d["row"]["student_id"] for d in dead] == [2]
+    assert SubmissionWriteBehind.stats()["dead_lettered"] == 1
+
+
+def test_rows_stay_queued_and_spilled_while_database_is_down(write_behind, monkeypatch):
+    down = OperationalError('INSERT', {}, Exception('connection refused'))
+    monkeypatch.setattr(SubmissionWriteBehind, '_insert', fake_insert(write_behind, {1: down, 2: down}))
+    for student_id in (1, 2):
+        SubmissionWriteBehind.enqueue(row(student_id))
+
+    success, _ = SubmissionWriteBehind.flush()
+    assert not success
+    assert [r["student_id"] for r in SubmissionWriteBehind._buffer] == [1, 2]
+    assert [r["student_id"] for r in spilled()] == [1, 2]
+
+
+def test_non_database_errors_do_not_drop_rows(write_behind, monkeypatch):
+    monkeypatch.setattr(SubmissionWriteBehind, '_insert', fake_insert(write_behind, {1: ValueError('bad submitted_at')}))
+    for student_id in (1, 2):
+        SubmissionWriteBehind.enqueue(row(student_id))
+
+    assert SubmissionWriteBehind.flush() == (True, 1)
+    assert SubmissionWriteBehind.stats()["dead_lettered"] == 1
+    assert os.path.exists(SubmissionWriteBehind._dead_letter_path(os.getpid()))
+
+
+def dead_pid():
+    pid = 4_000_000
+    while SubmissionWriteBehind._pid_alive(pid):
+        pid += 1
+    return pid
+
+
+def test_orphan_spill_is_claimed_once(write_behind, monkeypatch, tmp_path):
+    orphan = tmp_path / f"submissions-{dead_pid()}.jsonl"
+    orphan.write_text(json.dumps(row(9)) + '\n', encoding='utf-8')
+
+    SubmissionWriteBehind._recover()
+    assert [r["student_id"] for r in SubmissionWriteBehind._buffer] == [9]
+    assert not orphan.exists()
+    assert [p.name for p in tmp_path.iterdir()] == [f"submissions-{os.getpid()}.jsonl"]
+
+
+def test_spill_claimed_by_another_process_is_skipped(write_behind, monkeypatch, tmp_path):
+    orphan = tmp_path / f"submissions-{dead_pid()}.jsonl"
+    orphan.write_text(json.dumps(row(9)) + '\n', encoding='utf-8')
+
+    def claimed_elsewhere(src, dst):
+        os.remove(src)
+        raise FileNotFoundError(src)
+    monkeypatch.setattr(os, 'rename', claimed_elsewhere)
+
+    SubmissionWriteBehind._recover()
+    assert SubmissionWriteBehind._buffer == []
+
+
+def test_flush_waits_for_the_batch_in_flight(write_behind, monkeypatch):
+    gate = threading.Event()
+    inserting = threading.Event()
+
+    def slow_insert(rows):
+        inserting.set()
+        gate.wait(5)
+        write_behind.extend(rows)
+    monkeypatch.setattr(SubmissionWriteBehind, '_insert', staticmethod(slow_insert))
+
+    SubmissionWriteBehind.enqueue(row(1))
+    writer = threading.Thread(target=SubmissionWriteBehind.flush)
+    writer.start()
+    inserting.wait(5)
+
+    SubmissionWriteBehind.enqueue(row(2))
+    barrier = threading.Thread(target=SubmissionWriteBehind.flush)
+    barrier.start()
+    barrier.join(0.1)
+    assert barrier.is_alive()
+
+    gate.set()
+    barrier.join(5)
+    writer.join(5)
+    assert [r["student_id"] for r in write_behind] == [1, 2]
@@ -7,7 +7,7 @@ import ProtectedRoute from '@/components/ProtectedRoute';
 import { AdminService } from '@/lib/services/admin';
 import LoadingSpinner from '@/components/LoadingSpinner';
 import Toast from '@/components/Toast';
-import { Student, Class, Scenario } from '@/types/models';
+import { Student, Class } from '@/types/models';
 import { Notification } from '@/types/ui';
 import { ProgressData } from '@/types/metrics';
 
@@ -23,7 +23,6 @@ import { ProgressData } from '@/types/metrics';
 export default function AdminStudentsPage() {
   const [students, setStudents] = useState<Student[]>([]);
   const [classes, setClasses] = useState<Class[]>([]);
-  const [scenarios, setScenarios] = useState<Scenario[]>([]);
   const [loading, setLoading] = useState(true);
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [notification, setNotification] = useState<Notification | null>(null);
@@ -58,14 +57,12 @@ export default function AdminStudentsPage() {
   const loadInitialData = async () => {
     setLoading(true);
     try {
-      const [studentsData, classesData, scenariosData] = await Promise.all([
+      const [studentsData, classesData] = await Promise.all([
         AdminService.getAllStudents(),
         AdminService.getAllClasses(),
-        AdminService.getAllScenarios(),
       ]);
       setStudents(studentsData);
       setClasses(classesData);
-      setScenarios(scenariosData);
     } catch (error: any) {
       showNotification(`Erro ao carregar dados iniciais: ${error}.`, 'error');
     } finally {
@@ -192,18 +189,18 @@ export default function AdminStudentsPage() {
     setMetricsStudent(student);
     setLoadingMetrics(true);
     try {
-      const global = await AdminService.getStudentProgress(student.id);
-      setGlobalProgress(global);
-
-      const perScenario = await Promise.all(
-        scenarios.map(async (scen) => {
-          const prog = await AdminService.getStudentProgress(student.id, {
-            scenario_id: scen.id,
-          });
-          return { ...prog, scenario_name: scen.name };
-        }),
+      const matrix = await AdminService.getProgressMatrix({
+        student_ids: String(student.id),
+      });
+      const row = matrix.students[0];
+      if (!row) throw new Error('Aluno não encontrado.');
+      setGlobalProgress(row.global);
+      setScenarioProgress(
+        row.scenarios.map((prog, idx) => ({
+          ...prog,
+          scenario_name: matrix.scenarios[idx].name,
+        })),
       );
-      setScenarioProgress(perScenario);
     } catch (error: any) {
       showNotification(
         `Erro ao carregar desempenho do aluno. ${error}`,
@@ -8,7 +8,7 @@ import ProtectedRoute from '@/components/ProtectedRoute';
 import { teacherService } from '@/lib/services/teacher';
 import LoadingSpinner from '@/components/LoadingSpinner';
 import Toast from '@/components/Toast'; //
-import { Student, Class, Scenario } from '@/types/models';
+import { Student, Class } from '@/types/models';
 import { ProgressData } from '@/types/metrics';
 import { Notification } from '@/types/ui';
 
@@ -23,7 +23,6 @@ import { Notification } from '@/types/ui';
 export default function TeacherStudentsPage() {
   const [students, setStudents] = useState<Student[]>([]);
   const [classes, setClasses] = useState<Class[]>([]);
-  const [scenarios, setScenarios] = useState<Scenario[]>([]);
   const [loading, setLoading] = useState(true);
   const [notification, setNotification] = useState<Notification | null>(null);
 
@@ -73,12 +72,8 @@ export default function TeacherStudentsPage() {
   const loadInitialData = useCallback(async () => {
     setLoading(true);
     try {
-      const [classesData, scenariosData] = await Promise.all([
-        teacherService.getMyClasses(),
-        teacherService.getAllScenarios(),
-      ]);
+      const classesData = await teacherService.getMyClasses();
       setClasses(classesData);
-      setScenarios(scenariosData);
 
       if (classesData.length > 0) {
         await fetchStudents('all', classesData);
@@ -113,18 +108,18 @@ export default function TeacherStudentsPage() {
     setMetricsStudent(student);
     setLoadingMetrics(true);
     try {
-      const global = await teacherService.getStudentProgress(student.id);
-      setGlobalProgress(global);
-
-      const perScenario = await Promise.all(
-        scenarios.map(async (scen) => {
-          const prog = await teacherService.getStudentProgress(student.id, {
-            scenario_id: scen.id,
-          });
-          return { ...prog, scenario_name: scen.name };
-        }),
+      const matrix = await teacherService.getProgressMatrix({
+        student_ids: String(student.id),
+      });
+      const row = matrix.students[0];
+      if (!row) throw new Error('Aluno não encontrado.');
+      setGlobalProgress(row.global);
+      setScenarioProgress(
+        row.scenarios.map((prog, idx) => ({
+          ...prog,
+          scenario_name: matrix.scenarios[idx].name,
+        })),
       );
-      setScenarioProgress(perScenario);
     } catch (error: any) {
       showNotification(
         `Erro ao carregar desempenho do aluno. ${error.message}`,
@@ -1,4 +1,5 @@
 import { api } from '@/lib/api';
+import { ProgressMatrix } from '@/types/metrics';
 
 export const AdminService = {
   // ADMIN CRUD
@@ -285,6 +286,16 @@ export const AdminService = {
     return response.data;
   },
 
+  getProgressMatrix: async (params: {
+    class_id?: number;
+    student_ids?: string;
+    page?: number;
+    per_page?: number;
+  }): Promise<ProgressMatrix> => {
+    const response = await api.get('/reports/progress/matrix', { params });
+    return response.data;
+  },
+
   getStudentQuestionEngagement: async (
     studentId: number,
     questionId: number,
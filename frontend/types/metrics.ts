@@ -29,6 +29,23 @@ export interface ProgressData {
   scenario_name?: string;
 }
 
+/**
+ * Matriz de progresso alunos × cenários, paginada por aluno.
+ */
+export interface ProgressMatrix {
+  scenarios: { id: number; name: string; total_questions: number }[];
+  students: {
+    student_id: number;
+    name: string;
+    registration_number: string;
+    global: ProgressData;
+    scenarios: ProgressData[];
+  }[];
+  page: number;
+  per_page: number;
+  total_students: number;
+}
+
 /**
  * Métricas de uma questão específica.
  */